@@ -0,0 +1,444 @@
+import os
+import sys
+import io
+import json
+import gzip
+import time
+import shutil
+import hashlib
+import platform
+import itertools
+import subprocess
+import configparser
+import statistics
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+#csv2pg 导入流水线的端到端基准测试
+#- 按 [Bench] 参数生成确定性的合成数据集（行数、列数、类型配比、需加引号的文本比例、NULL 比例、随机种子），
+#  相同参数在同一 numpy 版本下逐字节相同，结果中记录每个文件的 sha256 便于确认两次运行用的是同一份数据；
+#- 对 [Bench] 中的参数矩阵（如 transfer_mode、transfer_codec、import_workers 的组合）逐一运行导入，
+#  每个组合在独立子进程中按覆盖后的配置加载 csv2pg（CSV2PG_CONF），导入前删除目标库、关闭导入清单与推断缓存；
+#- 分阶段计时：推断（schema）、传输（transfer，仅 staged 模式的上传；stream 模式传输与 COPY 重叠计入 copy）、
+#  COPY、导入后处理（建表、SET LOGGED、主键索引、ANALYZE 等），输出 MB/s 与 rows/s；
+#- 结果写入 bench_results/<时间>.json，`python bench_import.py compare a.json b.json` 比较两次结果。
+#
+#目标服务器使用与 csv2pg 相同的 [ServerN] 配置，一般指向本机：127.0.0.1 上的 sshd 与 PostgreSQL。
+#用法：
+#  python bench_import.py                 生成（或复用）数据集并运行全部组合
+#  python bench_import.py gen             只生成数据集
+#  python bench_import.py compare a b     比较两份结果，有阶段吞吐下降超过阈值时退出码为 1
+
+
+# ——————— 指定配置文件 ———————
+# 与 csv2pg 相同格式的配置文件（[General]/[ServerN]/[Table:x]）另加 [Bench] 段；可用环境变量 BENCH_CONF 指定
+BENCH_DIR = Path(__file__).parent
+config_path = Path(os.environ.get('BENCH_CONF') or BENCH_DIR / 'bench_config.conf')
+# 合成数据集与结果目录
+DATA_DIR = BENCH_DIR / 'bench_data'
+RESULTS_DIR = BENCH_DIR / 'bench_results'
+RESULT_VERSION = 1
+
+# 生成器支持的列类型
+COLUMN_TYPES = ("int", "bigint", "float", "numeric", "bool", "date", "timestamp", "text")
+# 每次生成的行数（随机数按块抽取，改动它会改变生成的数据）
+GEN_CHUNK_ROWS = 100000
+# NULL 写法，与 csv2pg.NULL_TOKEN 一致
+NULL_TOKEN = 'NULL'
+# 文本字符集；需加引号的文本会混入逗号、双引号或换行
+TEXT_ALPHABET = np.frombuffer(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ", dtype=np.uint8)
+QUOTE_FRAGMENTS = np.array([",", '"', "\n", ', "x"'])
+# 比较结果时默认的回退阈值（吞吐下降比例）
+DEFAULT_THRESHOLD = 0.10
+# 计入 post 阶段之外的计时项
+STAGE_KEYS = {"transfer": "transfer", "copy": "copy"}
+
+
+def load_config() -> configparser.ConfigParser:
+    if not config_path.exists():
+        raise FileNotFoundError(f"配置文件不存在: {config_path}")
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    if not config.has_section('Bench'):
+        raise ValueError(f"配置文件缺少 [Bench] 段: {config_path}")
+    return config
+
+
+def parse_type_mix(text: str) -> dict:
+    """"int:3, text:2" -> {"int": 3.0, "text": 2.0}"""
+    mix = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition(':')
+        name = name.strip().lower()
+        if name not in COLUMN_TYPES:
+            raise ValueError(f"[Bench] types 中的列类型 '{name}' 不受支持。当前支持: {list(COLUMN_TYPES)}")
+        mix[name] = float(weight or 1)
+        if mix[name] < 0:
+            raise ValueError(f"[Bench] types 中 {name} 的权重不能为负数")
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("[Bench] types 至少需要一个权重为正的列类型")
+    return mix
+
+
+def dataset_spec(config: configparser.ConfigParser) -> dict:
+    spec = {
+        "rows": config.getint('Bench', 'rows', fallback=1000000),
+        "cols": config.getint('Bench', 'cols', fallback=12),
+        "files": config.getint('Bench', 'files', fallback=4),
+        "types": parse_type_mix(config.get('Bench', 'types', fallback='int:3, float:2, text:3, date:1, timestamp:1')),
+        "null_ratio": config.getfloat('Bench', 'null_ratio', fallback=0.05),
+        "quote_ratio": config.getfloat('Bench', 'quote_ratio', fallback=0.1),
+        "text_len": config.getint('Bench', 'text_len', fallback=24),
+        "format": config.get('Bench', 'format', fallback='csv').strip().lower(),
+        "seed": config.getint('Bench', 'seed', fallback=42),
+    }
+    if spec["rows"] < 1 or spec["cols"] < 1 or spec["files"] < 1 or spec["text_len"] < 1:
+        raise ValueError("[Bench] rows / cols / files / text_len 必须为正整数")
+    for key in ("null_ratio", "quote_ratio"):
+        if not 0 <= spec[key] <= 1:
+            raise ValueError(f"[Bench] {key} 必须在 0 到 1 之间")
+    if spec["format"] not in ("csv", "csv.gz"):
+        raise ValueError(f"[Bench] format 参数 '{spec['format']}' 不受支持。当前支持: ['csv', 'csv.gz']")
+    return spec
+
+
+def spec_id(spec: dict) -> str:
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:10]
+
+
+# ——————— 合成数据生成 ———————
+def column_types(spec: dict) -> list:
+    """按类型配比为每列抽取类型（与行数据使用不同的随机流，改行数不影响列类型）"""
+    rng = np.random.default_rng([spec["seed"], 0])
+    names = sorted(spec["types"])
+    weights = np.array([spec["types"][n] for n in names])
+    return [str(t) for t in rng.choice(names, size=spec["cols"], p=weights / weights.sum())]
+
+
+def _text(rng, n: int, text_len: int, quote_ratio: float) -> np.ndarray:
+    lengths = rng.integers(1, text_len + 1, size=n)
+    chars = TEXT_ALPHABET[rng.integers(0, len(TEXT_ALPHABET), size=(n, text_len))]
+    # 超出长度的位置置 0，按定长字节串解释时末尾的 0 会被去掉
+    chars[np.arange(text_len) >= lengths[:, None]] = 0
+    vals = chars.view(f'S{text_len}').ravel().astype(str).astype(object)
+    quoted = rng.random(n) < quote_ratio
+    if quoted.any():
+        frags = QUOTE_FRAGMENTS[rng.integers(0, len(QUOTE_FRAGMENTS), size=int(quoted.sum()))]
+        vals[quoted] = vals[quoted] + frags
+    return vals
+
+
+def _column(rng, kind: str, n: int, start: int, spec: dict) -> pd.Series:
+    if kind == "int":
+        vals = rng.integers(-2**31, 2**31 - 1, size=n)
+    elif kind == "bigint":
+        vals = rng.integers(-2**62, 2**62, size=n)
+    elif kind == "float":
+        vals = rng.normal(0, 1e6, size=n)
+    elif kind == "numeric":
+        vals = np.char.mod('%.4f', rng.uniform(-1e8, 1e8, size=n))
+    elif kind == "bool":
+        vals = np.where(rng.random(n) < 0.5, 'true', 'false')
+    elif kind == "date":
+        vals = (np.datetime64('2000-01-01') + rng.integers(0, 365 * 30, size=n)).astype(str)
+    elif kind == "timestamp":
+        secs = rng.integers(0, 86400 * 365 * 30, size=n)
+        vals = np.datetime_as_string(np.datetime64('2000-01-01T00:00:00') + secs.astype('timedelta64[s]'))
+        vals = np.char.replace(vals, 'T', ' ')
+    else:
+        vals = _text(rng, n, spec["text_len"], spec["quote_ratio"])
+    col = pd.Series(vals, index=range(start, start + n)).astype(str)
+    if spec["null_ratio"] > 0:
+        col[rng.random(n) < spec["null_ratio"]] = None
+    return col
+
+
+def generate_file(path: Path, spec: dict, types: list, file_no: int, rows: int):
+    """逐块生成一个文件；每个文件使用独立的随机流 (seed, 1 + 文件序号)，互不影响"""
+    rng = np.random.default_rng([spec["seed"], 1 + file_no])
+    header = [f"c{i:03d}_{t}" for i, t in enumerate(types)]
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as raw:
+        # 固定 gzip 头中的文件名与时间戳，保证压缩结果也逐字节相同
+        out = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) if spec["format"] == "csv.gz" else raw
+        with io.TextIOWrapper(out, encoding='utf-8', newline='') as f:
+            for start in range(0, rows, GEN_CHUNK_ROWS):
+                n = min(GEN_CHUNK_ROWS, rows - start)
+                df = pd.DataFrame({h: _column(rng, t, n, start, spec) for h, t in zip(header, types)})
+                df.to_csv(f, header=(start == 0), index=False, na_rep=NULL_TOKEN, lineterminator='\n')
+    os.replace(tmp, path)
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(4 * 1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def ensure_dataset(spec: dict) -> tuple:
+    """
+    生成（或复用）数据集，返回 (数据集目录, 描述)。目录名含参数摘要，同一参数只生成一次；
+    目录下 dataset.json 记录参数、列类型与各文件的行数、字节数、sha256。
+    """
+    sid = spec_id(spec)
+    root = DATA_DIR / sid
+    # 目录名即目标数据库名
+    ds_dir = root / f"bench_{sid}"
+    info_path = root / 'dataset.json'
+    if info_path.exists():
+        info = json.loads(info_path.read_text(encoding='utf-8'))
+        if all((ds_dir / f["name"]).exists() for f in info["files"]):
+            print(f"[bench] 复用数据集 {ds_dir}")
+            return ds_dir, info
+    shutil.rmtree(root, ignore_errors=True)
+    ds_dir.mkdir(parents=True)
+    types = column_types(spec)
+    per_file = [spec["rows"] // spec["files"] + (1 if i < spec["rows"] % spec["files"] else 0)
+                for i in range(spec["files"])]
+    t0 = time.time()
+    files = []
+    for i, rows in enumerate(per_file):
+        path = ds_dir / f"t{i:02d}.{spec['format']}"
+        generate_file(path, spec, types, i, rows)
+        files.append({"name": path.name, "rows": rows, "bytes": path.stat().st_size, "sha256": file_sha256(path)})
+    info = {"id": sid, "spec": spec, "column_types": types, "files": files,
+            "rows": sum(f["rows"] for f in files), "bytes": sum(f["bytes"] for f in files)}
+    info_path.write_text(json.dumps(info, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"[bench] 生成数据集 {ds_dir}: {info['rows']} 行, {info['bytes'] / 1e6:.1f} MB, "
+          f"用时 {time.time() - t0:.1f}s")
+    return ds_dir, info
+
+
+# ——————— 参数矩阵 ———————
+def parse_matrix(config: configparser.ConfigParser) -> list:
+    """
+    [Bench] 中 matrix.<参数> = 值1, 值2 声明要比较的 csv2pg 参数，返回全部组合（笛卡尔积）的列表；
+    未声明时只跑当前配置一次。
+    """
+    axes = []
+    for key, value in config.items('Bench'):
+        if key.startswith('matrix.'):
+            values = [v.strip() for v in value.split(',') if v.strip()]
+            if not values:
+                raise ValueError(f"[Bench] {key} 至少需要一个取值")
+            axes.append((key[len('matrix.'):], values))
+    axes.sort()
+    return [dict(zip([k for k, _ in axes], combo)) for combo in itertools.product(*[v for _, v in axes])]
+
+
+def case_key(params: dict) -> str:
+    return ", ".join(f"{k}={v}" for k, v in sorted(params.items())) or "default"
+
+
+def write_case_config(config: configparser.ConfigParser, params: dict, ds_dir: Path, path: Path):
+    """在原配置上套用本组合的参数（写入 [General] 与所有 [ServerN]），并固定基准测试需要的设置"""
+    case = configparser.ConfigParser()
+    case.read_dict({s: dict(config.items(s, raw=True)) for s in config.sections() if s != 'Bench'})
+    if not case.has_section('General'):
+        case.add_section('General')
+    general = {"local_csv_dir": str(ds_dir), "local_csv_root": "", "use_manifest": "false", "keep_uploads": "false"}
+    general.update(params)
+    for key, value in general.items():
+        case.set('General', key, value)
+        for section in case.sections():
+            if section.startswith('Server') and case.has_option(section, key):
+                case.set(section, key, value)
+    with open(path, 'w', encoding='utf-8') as f:
+        case.write(f)
+
+
+# ——————— 单个组合（子进程中运行） ———————
+def run_case(case_conf: str, out_path: str):
+    """按 case_conf 加载 csv2pg，删除目标库后依次计时推断与导入，把原始计时写入 out_path"""
+    os.environ['CSV2PG_CONF'] = case_conf
+    import csv2pg
+    import ssh_pool
+    import pg_binary
+    import input_formats
+    out = Path(out_path)
+    # 每次都重新推断，推断缓存写到临时位置
+    csv2pg.SCHEMA_CACHE_PATH = out.with_suffix('.schema_cache.json')
+    [(db, ds_dir)] = csv2pg.discover_datasets()
+    files = input_formats.list_inputs(ds_dir)
+    for server in csv2pg.servers:
+        ssh = ssh_pool.get_pool(server['ip'], server['port'], server['username'], server['password'],
+                                max_channels=server['ssh_channels'])
+        code, _, err = csv2pg.run_psql(ssh, server, 'postgres', f'DROP DATABASE IF EXISTS "{db}";')
+        if code != 0:
+            raise RuntimeError(f"[{server['ip']}] 删除基准测试数据库 {db} 失败: {err}")
+    t0 = time.time()
+    schemas = csv2pg.prepare_schemas(files)
+    schema_sec = time.time() - t0
+    t0 = time.time()
+    csv2pg.deploy_and_import([(db, files)], schemas, csv2pg.config.getint('General', 'global_workers', fallback=0))
+    import_sec = time.time() - t0
+    pg_binary.shutdown_pool()
+    ssh_pool.close_all()
+    out.write_text(json.dumps({"servers": len(csv2pg.servers), "schema_sec": schema_sec, "import_sec": import_sec,
+                               "tables": csv2pg.IMPORT_STATS}, ensure_ascii=False), encoding='utf-8')
+
+
+def _rate(amount: float, sec: float):
+    return round(amount / sec, 1) if sec > 0 else None
+
+
+def summarize_case(raw: dict, info: dict) -> dict:
+    """
+    把子进程的原始计时汇总为各阶段耗时与吞吐。
+    transfer / copy / post 为各表耗时之和（表间并行时大于墙钟时间），吞吐即单个会话的平均吞吐；
+    wall 为整个导入的墙钟时间，吞吐按全部服务器导入的总数据量计算。
+    """
+    mb = info["bytes"] / 1e6
+    rows = info["rows"]
+    servers = max(1, raw["servers"])
+    stage_sec = {"transfer": 0.0, "copy": 0.0, "post": 0.0}
+    for t in raw["tables"]:
+        for key, sec in t["timings"].items():
+            stage_sec[STAGE_KEYS.get(key, "post")] += sec
+    loaded_mb = sum(t["bytes"] for t in raw["tables"]) / 1e6
+    loaded_rows = sum(t["rows"] for t in raw["tables"])
+    stages = {"schema": {"sec": round(raw["schema_sec"], 3), "mb_s": _rate(mb, raw["schema_sec"]),
+                         "rows_s": _rate(rows, raw["schema_sec"])}}
+    for name, sec in stage_sec.items():
+        stages[name] = {"sec": round(sec, 3), "mb_s": _rate(loaded_mb, sec), "rows_s": _rate(loaded_rows, sec)}
+    stages["wall"] = {"sec": round(raw["import_sec"], 3), "mb_s": _rate(mb * servers, raw["import_sec"]),
+                      "rows_s": _rate(rows * servers, raw["import_sec"])}
+    return {"stages": stages, "tables_ok": len(raw["tables"]), "tables_expected": len(info["files"]) * servers,
+            "rows_loaded": loaded_rows, "rows_expected": rows * servers}
+
+
+def median_stages(runs: list) -> dict:
+    """多次重复时各阶段的耗时与吞吐分别取中位数"""
+    return {name: {"sec": round(statistics.median(r["stages"][name]["sec"] for r in runs), 3),
+                   "mb_s": _median_opt(r["stages"][name]["mb_s"] for r in runs),
+                   "rows_s": _median_opt(r["stages"][name]["rows_s"] for r in runs)}
+            for name in runs[0]["stages"]}
+
+
+def _median_opt(values):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+def git_info() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def run_bench(config: configparser.ConfigParser):
+    spec = dataset_spec(config)
+    ds_dir, info = ensure_dataset(spec)
+    cases = parse_matrix(config)
+    repeat = max(1, config.getint('Bench', 'repeat', fallback=1))
+    label = config.get('Bench', 'label', fallback='').strip()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    work = RESULTS_DIR / f".{stamp}"
+    work.mkdir()
+    result = {"version": RESULT_VERSION, "label": label, "started_at": datetime.now().isoformat(timespec='seconds'),
+              "git": git_info(), "host": {"platform": platform.platform(), "python": platform.python_version(),
+                                          "numpy": np.__version__, "pandas": pd.__version__, "cpus": os.cpu_count()},
+              "dataset": info, "repeat": repeat, "cases": []}
+    print(f"[bench] {len(cases)} 个组合 × {repeat} 次")
+    for ci, params in enumerate(cases):
+        key = case_key(params)
+        case_conf = work / f"case{ci:02d}.conf"
+        write_case_config(config, params, ds_dir, case_conf)
+        runs, errors = [], []
+        for r in range(repeat):
+            out = work / f"case{ci:02d}_{r}.json"
+            print(f"[bench] ({ci + 1}/{len(cases)}) {key} 第 {r + 1} 次")
+            proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "_case", str(case_conf), str(out)],
+                                  cwd=BENCH_DIR)
+            if proc.returncode != 0 or not out.exists():
+                errors.append(f"第 {r + 1} 次运行失败，退出码 {proc.returncode}")
+                continue
+            runs.append(summarize_case(json.loads(out.read_text(encoding='utf-8')), info))
+        entry = {"key": key, "params": params, "runs": runs, "errors": errors}
+        if runs:
+            entry["stages"] = median_stages(runs)
+            entry["complete"] = all(r["tables_ok"] == r["tables_expected"] and r["rows_loaded"] == r["rows_expected"]
+                                    for r in runs)
+            wall = entry["stages"]["wall"]
+            print(f"[bench] {key}: wall {wall['sec']:.2f}s, {wall['mb_s']} MB/s, {wall['rows_s']} rows/s"
+                  + ("" if entry["complete"] else "（有表未导入成功或行数不符）"))
+        result["cases"].append(entry)
+    shutil.rmtree(work, ignore_errors=True)
+    path = RESULTS_DIR / f"{stamp}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"[bench] 结果已写入 {path}")
+    print_table(result)
+    return path
+
+
+def print_table(result: dict):
+    stages = ("schema", "transfer", "copy", "post", "wall")
+    print(f"{'组合':<48}" + "".join(f"{s + ' MB/s':>16}" for s in stages))
+    for case in result["cases"]:
+        cells = [(case.get("stages", {}).get(s) or {}).get("mb_s") for s in stages]
+        print(f"{case['key']:<48}" + "".join(f"{('-' if c is None else c):>16}" for c in cells))
+
+
+# ——————— 结果比较 ———————
+def compare_results(path_a: str, path_b: str, threshold: float = DEFAULT_THRESHOLD) -> bool:
+    """按组合逐阶段比较 MB/s（b 相对 a），返回是否有阶段吞吐下降超过 threshold"""
+    a, b = (json.loads(Path(p).read_text(encoding='utf-8')) for p in (path_a, path_b))
+    if a["dataset"]["id"] != b["dataset"]["id"]:
+        print(f"[WARN] 两次运行的数据集不同（{a['dataset']['id']} vs {b['dataset']['id']}），吞吐仅供参考")
+    print(f"A: {path_a} ({a['git'].get('commit') or '-'} {a.get('label', '')})")
+    print(f"B: {path_b} ({b['git'].get('commit') or '-'} {b.get('label', '')})")
+    cases_a = {c["key"]: c for c in a["cases"] if c.get("stages")}
+    regressed = False
+    for case in b["cases"]:
+        old = cases_a.get(case["key"])
+        if not old or not case.get("stages"):
+            print(f"{case['key']}: 无可比较的结果")
+            continue
+        print(case["key"])
+        for stage, cur in case["stages"].items():
+            prev = old["stages"].get(stage)
+            if not prev or not prev.get("mb_s") or not cur.get("mb_s"):
+                continue
+            change = cur["mb_s"] / prev["mb_s"] - 1
+            flag = ""
+            # 耗时过短的阶段误差大，不判定回退
+            if change < -threshold and max(prev["sec"], cur["sec"]) >= 0.5:
+                flag = "  <-- 回退"
+                regressed = True
+            print(f"  {stage:<10}{prev['mb_s']:>12} -> {cur['mb_s']:<12} MB/s {change:+.1%}{flag}")
+    return regressed
+
+
+# ——————— 入口 ———————
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_case":
+        run_case(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) not in (4, 5):
+            raise SystemExit("用法: python bench_import.py compare <a.json> <b.json> [阈值，默认 0.1]")
+        threshold = float(sys.argv[4]) if len(sys.argv) == 5 else DEFAULT_THRESHOLD
+        sys.exit(1 if compare_results(sys.argv[2], sys.argv[3], threshold) else 0)
+    config = load_config()
+    if len(sys.argv) > 1 and sys.argv[1] == "gen":
+        ensure_dataset(dataset_spec(config))
+    elif len(sys.argv) > 1:
+        raise SystemExit(f"未知子命令: {sys.argv[1]}（支持 gen / compare）")
+    else:
+        run_bench(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,47 @@
+import os
 import re
+import sys
+import json
+import time
+import zlib
+import shlex
+import select
+import socket
+import threading
 import paramiko
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import configparser
+import pg_binary
+import input_formats
+
+# 仓库根目录下与 excute_sql 共用的模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ssh_pool
+import sftp_upload
+import stream_capture
+
+# zstd 为可选依赖，未安装时仅支持 none/gzip 传输压缩
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 原生驱动引擎（engine = psycopg）的可选依赖：优先 psycopg 3，其次 psycopg2
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
 
 #2025.10.08 v5.1版本(目前是pg版本)
 #支持将指定目录下的.csv数据集批量导入到pg数据库中，自动检测数据库是否存在，不存在则直接创建，文件夹需要小写命名
@@ -17,9 +55,9 @@ import configparser
 
 
 # ——————— 指定全局配置文件 ———————
-# 该模块将读取server_config.conf配置文件，并获取相关参数
+# 该模块将读取server_config.conf配置文件，并获取相关参数；可用环境变量 CSV2PG_CONF 指定其它配置文件（bench_import.py 使用）
 config = configparser.ConfigParser()
-config_path = Path(__file__).parent / 'server_config.conf'  # 获取配置文件的绝对路径
+config_path = Path(os.environ.get('CSV2PG_CONF') or Path(__file__).parent / 'server_config.conf')  # 获取配置文件的绝对路径
 
 # ———————配置文件错误检查———————
 # 检查配置文件是否存在
@@ -34,12 +72,68 @@ if not config.sections():
     raise ValueError(f"配置文件内容为空或无法解析: {config_path}")
 
 # ——————— 全局配置 ———————
-# 数据集所在目录
-LOCAL_CSV_DIR = Path(config.get('General', 'local_csv_dir'))
+# 数据集所在目录（单数据集模式，目录名即数据库名）
+LOCAL_CSV_DIR = Path(config.get('General', 'local_csv_dir', fallback=''))
+# 多数据集模式：设置后忽略 local_csv_dir，其下每个含 .csv 的子目录为一个数据集，子目录名即数据库名
+LOCAL_CSV_ROOT = config.get('General', 'local_csv_root', fallback='').strip()
+if not LOCAL_CSV_ROOT and not config.get('General', 'local_csv_dir', fallback='').strip():
+    raise ValueError("[General] 需要配置 local_csv_dir 或 local_csv_root")
 
 #服务器上的临时目录地址
 REMOTE_TMP_DIR = "/tmp/csvs"
 
+# COPY 使用的 NULL 标记，类型推断时同样视其为空值
+NULL_TOKEN = 'NULL'
+# COPY 的数据格式参数（暂存导入与流式导入共用）
+COPY_OPTIONS = f"FORMAT csv, HEADER true, NULL '{NULL_TOKEN}'"
+# 分块导入时除第一块外不含表头
+COPY_OPTIONS_NO_HEADER = f"FORMAT csv, HEADER false, NULL '{NULL_TOKEN}'"
+
+# 分块切分时扫描文件的读块大小
+SPLIT_SCAN_BLOCK = 16 * 1024 * 1024
+
+# 表结构推断缓存：按 文件路径+大小+修改时间 缓存推断结果，数据集不变时重跑直接跳过推断
+SCHEMA_CACHE_PATH = Path(__file__).parent / '.schema_cache.json'
+# 推断算法变化时递增，使旧缓存整体失效
+SCHEMA_CACHE_VERSION = 2
+# 增量导入：每台服务器每张表上次成功导入文件的逐行哈希（.npy）与本次变化行的临时 CSV
+DELTA_DIR = Path(__file__).parent / '.csv2pg_delta'
+# 导入清单：记录每台服务器每张表的文件指纹、行数与状态，重跑时跳过已完成的表
+MANIFEST_PATH = Path(__file__).parent / '.load_manifest.json'
+USE_MANIFEST = config.getboolean('General', 'use_manifest', fallback=True)
+# 二进制编码的进程数（默认 CPU 核数，所有表共用一个进程池）
+BINARY_WORKERS = config.getint('General', 'binary_workers', fallback=os.cpu_count() or 1)
+# 推断阶段的进程数（默认 CPU 核数）
+INFER_WORKERS = config.getint('General', 'infer_workers', fallback=os.cpu_count() or 1)
+# 流式推断每块行数；infer_stride = N 表示只分析每 N 块中的 1 块（1 为全量扫描）
+INFER_CHUNK_ROWS = 100000
+INFER_STRIDE = max(1, config.getint('General', 'infer_stride', fallback=1))
+
+# 流式导入时每次读取并写入 SSH 通道的块大小
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+# 远端命令输出在内存中最多保留的字节数（stdout/stderr 各自计算），超出部分只计数
+OUTPUT_CAP = config.getint('General', 'output_cap_mb', fallback=16) * 1024 * 1024
+
+# 支持的传输方式：staged = 先 SFTP 上传到临时目录再服务器端 COPY；stream = 边读边经 SSH 通道 COPY FROM STDIN
+SUPPORTED_TRANSFER_MODES = ("staged", "stream")
+
+# 导入模式：normal = 普通建表后 COPY；fast = UNLOGGED 建表 + COPY FREEZE，导入后 SET LOGGED、建索引并 ANALYZE
+SUPPORTED_LOAD_MODES = ("normal", "fast")
+
+# COPY 数据格式：csv = 文本 CSV 由服务器解析；binary = 本地按推断类型转成二进制 COPY 格式，服务器免解析
+SUPPORTED_COPY_FORMATS = ("csv", "binary")
+
+# 数据库执行引擎：psql = 每条语句在远端起一个 psql 进程；psycopg = 经 SSH 端口转发的本地驱动连接池
+SUPPORTED_ENGINES = ("psql", "psycopg")
+
+# 传输压缩：本地流式压缩，远端解压后直接送入 psql 的 COPY FROM STDIN
+SUPPORTED_CODECS = ("none", "gzip", "zstd", "auto")
+# 各编码的远端解压命令与暂存文件后缀
+CODEC_DECOMPRESS_CMD = {"gzip": "gzip -dc", "zstd": "zstd -dc"}
+CODEC_SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
+# auto 模式下用于估算压缩比与压缩速度的采样大小
+CODEC_SAMPLE_SIZE = 4 * 1024 * 1024
+
 #数据库服务器的配置
 servers = []
 for section in config.sections():
@@ -60,7 +154,71 @@ for section in config.sections():
             "password": config.get(section, 'password'),
             "psql": config.get(section, 'psql'),
             "pg_port": config.getint(section, 'pg_port'),
-            "dbms": config.get(section, 'dbms').lower()
+            "dbms": config.get(section, 'dbms').lower(),
+            # 单台服务器内并行导入的表数量（[ServerN] 优先，其次 [General]，默认 1 即串行）
+            "import_workers": config.getint(
+                section, 'import_workers',
+                fallback=config.getint('General', 'import_workers', fallback=1)
+            ),
+            # 数据传输方式（[ServerN] 优先，其次 [General]，默认 staged）
+            "transfer_mode": config.get(
+                section, 'transfer_mode',
+                fallback=config.get('General', 'transfer_mode', fallback='staged')
+            ).lower(),
+            # 传输压缩编码与级别（[ServerN] 优先，其次 [General]）
+            "transfer_codec": config.get(
+                section, 'transfer_codec',
+                fallback=config.get('General', 'transfer_codec', fallback='none')
+            ).lower(),
+            "codec_level": config.getint(
+                section, 'codec_level',
+                fallback=config.getint('General', 'codec_level', fallback=3)
+            ),
+            # 到该服务器的链路带宽（Mbit/s），auto 模式据此估算是否值得压缩
+            "link_mbps": config.getfloat(
+                section, 'link_mbps',
+                fallback=config.getfloat('General', 'link_mbps', fallback=100.0)
+            ),
+            # 大文件按行切块并发 COPY：块大小（MB，0 表示不切分）与单表并发会话数
+            "chunk_size_mb": config.getint(
+                section, 'chunk_size_mb',
+                fallback=config.getint('General', 'chunk_size_mb', fallback=0)
+            ),
+            "chunk_workers": config.getint(
+                section, 'chunk_workers',
+                fallback=config.getint('General', 'chunk_workers', fallback=4)
+            ),
+            # 执行引擎及 psycopg 引擎使用的数据库连接参数（经 SSH 转发到远端 pg_host:pg_port）
+            "engine": config.get(
+                section, 'engine',
+                fallback=config.get('General', 'engine', fallback='psql')
+            ).lower(),
+            "pg_host": config.get(section, 'pg_host', fallback='127.0.0.1'),
+            "pg_user": config.get(section, 'pg_user', fallback=config.get(section, 'username')),
+            "pg_password": config.get(section, 'pg_password', fallback=''),
+            "pg_pool_size": config.getint(section, 'pg_pool_size', fallback=0),
+            "load_mode": config.get(
+                section, 'load_mode',
+                fallback=config.get('General', 'load_mode', fallback='normal')
+            ).lower(),
+            "copy_format": config.get(
+                section, 'copy_format',
+                fallback=config.get('General', 'copy_format', fallback='csv')
+            ).lower(),
+            # 到该主机同时打开的 SSH 通道上限（含 SFTP、COPY 会话与端口转发），0 表示按并发度自动估算
+            "ssh_channels": config.getint(
+                section, 'ssh_channels',
+                fallback=config.getint('General', 'ssh_channels', fallback=0)
+            ),
+            # staged 模式未压缩上传：单文件并发写入的段数；保留远端文件时，下次摘要一致即跳过上传
+            "upload_parts": config.getint(
+                section, 'upload_parts',
+                fallback=config.getint('General', 'upload_parts', fallback=sftp_upload.DEFAULT_PARTS)
+            ),
+            "keep_uploads": config.getboolean(
+                section, 'keep_uploads',
+                fallback=config.getboolean('General', 'keep_uploads', fallback=False)
+            ),
         }
         # 新增：验证dbms参数合法性
         supported_dbms = ["postgresql"]  # 当前支持的数据库类型
@@ -69,8 +227,64 @@ for section in config.sections():
                 f"服务器配置节 [{section}] 中的dbms参数 '{server['dbms']}' 不受支持。"
                 f"当前支持: {supported_dbms}"
             )
+        if server["transfer_mode"] not in SUPPORTED_TRANSFER_MODES:
+            raise ValueError(
+                f"服务器配置节 [{section}] 中的transfer_mode参数 '{server['transfer_mode']}' 不受支持。"
+                f"当前支持: {list(SUPPORTED_TRANSFER_MODES)}"
+            )
+        if server["transfer_codec"] not in SUPPORTED_CODECS:
+            raise ValueError(
+                f"服务器配置节 [{section}] 中的transfer_codec参数 '{server['transfer_codec']}' 不受支持。"
+                f"当前支持: {list(SUPPORTED_CODECS)}"
+            )
+        if server["load_mode"] not in SUPPORTED_LOAD_MODES:
+            raise ValueError(
+                f"服务器配置节 [{section}] 中的load_mode参数 '{server['load_mode']}' 不受支持。"
+                f"当前支持: {list(SUPPORTED_LOAD_MODES)}"
+            )
+        if server["copy_format"] not in SUPPORTED_COPY_FORMATS:
+            raise ValueError(
+                f"服务器配置节 [{section}] 中的copy_format参数 '{server['copy_format']}' 不受支持。"
+                f"当前支持: {list(SUPPORTED_COPY_FORMATS)}"
+            )
+        if server["engine"] not in SUPPORTED_ENGINES:
+            raise ValueError(
+                f"服务器配置节 [{section}] 中的engine参数 '{server['engine']}' 不受支持。"
+                f"当前支持: {list(SUPPORTED_ENGINES)}"
+            )
+        if server["upload_parts"] < 1:
+            raise ValueError(f"服务器配置节 [{section}] 中的upload_parts参数必须为正整数")
+        if server["ssh_channels"] < 0:
+            raise ValueError(f"服务器配置节 [{section}] 中的ssh_channels参数不能为负数")
+        if server["ssh_channels"] == 0:
+            server["ssh_channels"] = max(
+                ssh_pool.DEFAULT_MAX_CHANNELS,
+                server["import_workers"] * max(1, server["chunk_workers"]) + server["pg_pool_size"] + 2,
+            )
+        if server["engine"] == "psycopg" and psycopg is None and psycopg2 is None:
+            raise ValueError(f"服务器配置节 [{section}] 使用 psycopg 引擎，但本地未安装 psycopg 或 psycopg2")
+        if server["transfer_codec"] == "zstd" and zstandard is None:
+            raise ValueError(f"服务器配置节 [{section}] 使用 zstd 压缩，但本地未安装 zstandard 模块")
         servers.append(server)
 
+# 表级配置：[Table:表名] 段声明主键与索引，导入完成后再建（先灌数据后建索引更快）
+#   primary_key = id
+#   indexes = col1; col2, col3      （分号分隔多个索引，逗号分隔组合列）
+#   merge_key = id                  （设置后表中已有数据时走增量导入：暂存表 + INSERT ... ON CONFLICT）
+#   skip_unchanged = true           （增量导入时值未变的行不更新）
+TABLE_OPTIONS = {}
+for section in config.sections():
+    if section.startswith('Table:'):
+        TABLE_OPTIONS[section[len('Table:'):].strip()] = {
+            "primary_key": [c.strip() for c in config.get(section, 'primary_key', fallback='').split(',') if c.strip()],
+            "indexes": [
+                [c.strip() for c in idx.split(',') if c.strip()]
+                for idx in config.get(section, 'indexes', fallback='').split(';') if idx.strip()
+            ],
+            "merge_key": [c.strip() for c in config.get(section, 'merge_key', fallback='').split(',') if c.strip()],
+            "skip_unchanged": config.getboolean(section, 'skip_unchanged', fallback=True),
+        }
+
 # 数据库名格式化处理
 def sanitize_db_name(name: str) -> str:
     # 原始：空格 -> 下划线
@@ -80,7 +294,24 @@ def sanitize_db_name(name: str) -> str:
     # 避免纯数字或空字符串导致的奇怪问题
     return name or "import_db"
 
-db_name = sanitize_db_name(LOCAL_CSV_DIR.name)
+def discover_datasets() -> list:
+    """返回 [(数据库名, 数据集目录)]：多数据集模式为 local_csv_root 下的各子目录，否则为 local_csv_dir"""
+    if not LOCAL_CSV_ROOT:
+        return [(sanitize_db_name(LOCAL_CSV_DIR.name), LOCAL_CSV_DIR)]
+    root = Path(LOCAL_CSV_ROOT)
+    if not root.is_dir():
+        raise ValueError(f"local_csv_root 不是目录: {root}")
+    datasets = {}
+    for d in sorted(root.iterdir()):
+        if not d.is_dir() or not input_formats.list_inputs(d):
+            continue
+        db = sanitize_db_name(d.name)
+        if db in datasets:
+            raise ValueError(f"子目录 {datasets[db].name} 与 {d.name} 对应同一个数据库名 {db}")
+        datasets[db] = d
+    if not datasets:
+        raise ValueError(f"local_csv_root 下没有包含数据文件的子目录: {root}")
+    return list(datasets.items())
 
 # ——————— 列名清理函数 ———————
 def sanitize_column_name(name: str) -> str:
@@ -90,50 +321,262 @@ def sanitize_column_name(name: str) -> str:
     name = re.sub(r'[\x00-\x1F\x7F]', '', name)
     return name.strip() or "column"
 
-# ——————— 数据类型映射函数 ———————
-def dtype_to_sql(dtype) -> str:
-    if pd.api.types.is_integer_dtype(dtype):
-        return 'INT'
-    if pd.api.types.is_float_dtype(dtype):
-        return 'DOUBLE PRECISION'
-    if pd.api.types.is_bool_dtype(dtype):
-        return 'BOOLEAN'
-    if pd.api.types.is_datetime64_any_dtype(dtype):
-        return 'TIMESTAMP'
-    if pd.api.types.is_categorical_dtype(dtype):
-        return 'VARCHAR'
-    if pd.api.types.is_object_dtype(dtype):
-        return 'VARCHAR'
-    return 'TEXT'
-
-# ——————— 检测是否存在对应数据库，不存在则创建 ———————
-def csv_create_table_sql(csv_path: Path) -> str:
-    """
-    根据 CSV 文件前几行推断列类型，生成：
-      CREATE TABLE IF NOT EXISTS "table_name" ( ... );
-    """
-    table = csv_path.stem
-    # 只读前 1000 行以加速类型推断，避免 low_memory 警告
-    df = pd.read_csv(csv_path, nrows=1000, low_memory=False)
-    cols = [
-        f'"{sanitize_column_name(col)}" {dtype_to_sql(df[col].dtype)}'
-        for col in df.columns
-    ]
+# ——————— 表结构推断 ———————
+# 类型拓宽顺序：数值链 SMALLINT→INT→BIGINT→DOUBLE PRECISION→NUMERIC，时间链 DATE→TIMESTAMP，
+# 其余不兼容组合一律拓宽为 VARCHAR
+NUMERIC_CHAIN = ['SMALLINT', 'INT', 'BIGINT', 'DOUBLE PRECISION', 'NUMERIC']
+TEMPORAL_CHAIN = ['DATE', 'TIMESTAMP']
+# 单块候选类型的检测顺序（由窄到宽）
+TYPE_CANDIDATES = ['BOOLEAN'] + NUMERIC_CHAIN + TEMPORAL_CHAIN + ['VARCHAR']
+BOOL_TOKENS = {'true', 'false', 't', 'f', 'yes', 'no'}
+INT_RE = r'[+-]?\d+'
+FLOAT_RE = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|(?i:[+-]?(?:nan|inf|infinity))'
+SPECIAL_FLOAT_RE = r'(?i:[+-]?(?:nan|inf|infinity))'
+DATE_RE = r'\d{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01])'
+TIMESTAMP_RE = DATE_RE + r'(?:[ T](?:[01]\d|2[0-3]):[0-5]\d(?::[0-5]\d(?:\.\d{1,6})?)?)?'
+
+
+def _int_rank(vals: pd.Series) -> pd.Series:
+    """对全为整数的字符串列逐值给出最窄整数类型在 NUMERIC_CHAIN 中的位置（超出 BIGINT 记为 NUMERIC）"""
+    digits = vals.str.lstrip('+-').str.lstrip('0').str.len()
+    num = pd.to_numeric(vals.where(digits <= 18, '0'), errors='coerce')
+    rank = pd.Series(2, index=vals.index)
+    rank[(num >= -2 ** 31) & (num < 2 ** 31)] = 1
+    rank[(num >= -2 ** 15) & (num < 2 ** 15)] = 0
+    for idx in vals.index[digits >= 19]:
+        rank[idx] = 2 if -2 ** 63 <= int(vals[idx]) < 2 ** 63 else 4
+    return rank
+
+
+def _fit_mask(sql_type: str, vals: pd.Series) -> pd.Series:
+    """逐值判断能否以 sql_type 被 COPY 接受（vals 已剔除 NULL 标记），全部向量化执行"""
+    if sql_type == 'VARCHAR':
+        return pd.Series(True, index=vals.index)
+    if sql_type == 'BOOLEAN':
+        return vals.str.lower().isin(BOOL_TOKENS)
+    if sql_type in NUMERIC_CHAIN:
+        is_int = vals.str.fullmatch(INT_RE)
+        if sql_type in ('SMALLINT', 'INT', 'BIGINT'):
+            mask = is_int.copy()
+            if is_int.any():
+                mask[is_int] = _int_rank(vals[is_int]) <= NUMERIC_CHAIN.index(sql_type)
+            return mask
+        mask = is_int | vals.str.fullmatch(FLOAT_RE)
+        if sql_type == 'DOUBLE PRECISION':
+            if is_int.any():
+                # 超出 BIGINT 的整数放入 DOUBLE PRECISION 会丢精度，需要 NUMERIC
+                mask[is_int] = _int_rank(vals[is_int]) <= 3
+            decimal = mask & ~is_int & ~vals.str.fullmatch(SPECIAL_FLOAT_RE)
+            if decimal.any():
+                # 超出 double 范围的值（如 1e400 上溢、1e-400 下溢为 0）会被 COPY 拒绝，需要 NUMERIC
+                num = pd.to_numeric(vals[decimal], errors='coerce')
+                underflow = (num == 0) & vals[decimal].str.split('[eE]').str[0].str.contains('[1-9]')
+                mask[decimal] = np.isfinite(num) & ~underflow
+        return mask
+    if sql_type == 'DATE':
+        return vals.str.fullmatch(DATE_RE)
+    return vals.str.fullmatch(TIMESTAMP_RE)
+
+
+def _widen(a: str, b: str) -> str:
+    """两种类型的最小公共上界"""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    for chain in (NUMERIC_CHAIN, TEMPORAL_CHAIN):
+        if a in chain and b in chain:
+            return chain[max(chain.index(a), chain.index(b))]
+    return 'VARCHAR'
+
+
+def infer_schema(csv_path: Path) -> dict:
+    """
+    流式扫描整个 CSV（或按 INFER_STRIDE 间隔抽样）推断列类型，内存占用与文件大小无关。
+    每块向量化判断，遇到不兼容的值时按拓宽规则放宽类型，并记录拓宽原因。
+    返回 {"columns": [[列名, SQL 类型], ...], "notes": [拓宽说明, ...], "rows": 扫描行数}。
+    为模块级函数，可在进程池中执行。
+    Parquet 文件不扫描数据，列类型直接由文件 schema 映射（见 input_formats.parquet_columns）。
+    """
+    if input_formats.input_kind(csv_path) == "parquet":
+        columns, rows = input_formats.parquet_columns(csv_path)
+        return {"columns": [[sanitize_column_name(name), t] for name, t in columns], "notes": [], "rows": rows}
+    types = None
+    names = []
+    notes = []
+    rows = 0
+    for n, chunk in enumerate(input_formats.iter_frames(csv_path, INFER_CHUNK_ROWS, NULL_TOKEN)):
+        if types is None:
+            names = list(chunk.columns)
+            types = [None] * len(names)
+        start_row = rows
+        rows += len(chunk)
+        if n % INFER_STRIDE:
+            continue
+        for i, col in enumerate(names):
+            vals = chunk[col]
+            vals = vals[vals != NULL_TOKEN]
+            if vals.empty:
+                continue
+            cur = types[i]
+            if cur is not None and _fit_mask(cur, vals).all():
+                continue
+            if (vals == '').any():
+                # COPY 只把 NULL 标记当作空值，空串无法写入非文本列
+                new = 'VARCHAR'
+            else:
+                # 本块能容纳的最窄类型，再与已有类型取公共上界
+                new = _widen(cur, next(t for t in TYPE_CANDIDATES if _fit_mask(t, vals).all()))
+            if cur is not None and new != cur:
+                bad = vals[~_fit_mask(cur, vals)]
+                row_no = start_row + chunk.index.get_loc(bad.index[0]) + 1
+                notes.append(f'{col}: {cur} -> {new}（第 {row_no} 行值 {bad.iloc[0]!r}）')
+            types[i] = new
+    columns = [[sanitize_column_name(str(col)), t or 'VARCHAR'] for col, t in zip(names, types or [])]
+    return {"columns": columns, "notes": notes, "rows": rows}
+
+
+def csv_create_table_sql(csv_path: Path, columns: list, unlogged: bool = False) -> str:
+    """
+    根据推断出的列生成：
+      CREATE [UNLOGGED] TABLE IF NOT EXISTS "table_name" ( ... );
+    """
+    table = input_formats.table_name(csv_path)
+    cols = [f'"{name}" {sql_type}' for name, sql_type in columns]
     cols_sql = ",\n  ".join(cols)
     return (
-        f'CREATE TABLE IF NOT EXISTS {table}(\n'
+        f'CREATE {"UNLOGGED " if unlogged else ""}TABLE IF NOT EXISTS {table}(\n'
         f'  {cols_sql}\n'
         f');'
     )
 
+
+def file_fingerprint(path: Path) -> dict:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def load_schema_cache() -> dict:
+    """读取推断缓存，版本不符或文件损坏时视为空缓存"""
+    try:
+        data = json.loads(SCHEMA_CACHE_PATH.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != SCHEMA_CACHE_VERSION:
+        return {}
+    return data.get("entries", {})
+
+
+def save_schema_cache(entries: dict):
+    """剔除源文件已删除或已变化的过期条目后原子写回缓存"""
+    fresh = {}
+    for key, entry in entries.items():
+        path = Path(key)
+        if path.exists() and file_fingerprint(path) == entry.get("fingerprint"):
+            fresh[key] = entry
+    tmp = SCHEMA_CACHE_PATH.with_suffix('.tmp')
+    tmp.write_text(json.dumps({"version": SCHEMA_CACHE_VERSION, "entries": fresh}, ensure_ascii=False),
+                   encoding='utf-8')
+    os.replace(tmp, SCHEMA_CACHE_PATH)
+
+
+def print_schema(csv_file: Path, entry: dict, cached: bool):
+    """输出推断出的列类型及拓宽原因"""
+    cols = ", ".join(f"{name} {sql_type}" for name, sql_type in entry["columns"])
+    print(f"[schema] {csv_file.name}{' (缓存)' if cached else ''}: {entry.get('rows', 0)} 行; {cols}")
+    for note in entry.get("notes", []):
+        print(f"[schema]   拓宽 {note}")
+
+
+def prepare_schemas(csv_files: list) -> dict:
+    """
+    在分发到各服务器前统一推断一次表结构，返回 {csv 路径: 列定义}。
+    命中缓存的文件直接复用，其余文件在进程池中并行推断（绕开 GIL）。
+    """
+    entries = load_schema_cache()
+    schemas = {}
+    misses = []
+    for csv_file in csv_files:
+        key = str(csv_file.resolve())
+        entry = entries.get(key)
+        if entry and entry.get("fingerprint") == file_fingerprint(csv_file):
+            schemas[csv_file] = entry["columns"]
+            print_schema(csv_file, entry, cached=True)
+        else:
+            misses.append(csv_file)
+    print(f"[schema] 共 {len(csv_files)} 个文件，缓存命中 {len(csv_files) - len(misses)}，需推断 {len(misses)}")
+
+    if misses:
+        t0 = time.time()
+        workers = max(1, min(INFER_WORKERS, len(misses)))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(infer_schema, misses))
+        else:
+            results = [infer_schema(f) for f in misses]
+        for csv_file, result in zip(misses, results):
+            schemas[csv_file] = result["columns"]
+            entry = dict(result, fingerprint=file_fingerprint(csv_file))
+            entries[str(csv_file.resolve())] = entry
+            print_schema(csv_file, entry, cached=False)
+        print(f"[schema] 推断完成，用时 {time.time() - t0:.1f}s")
+
+    try:
+        save_schema_cache(entries)
+    except OSError as e:
+        print(f"[WARN] 写入推断缓存失败: {e}")
+    return schemas
+
+# ——————— 导入清单 ———————
+class LoadManifest:
+    """
+    本地 JSON 导入清单：{服务器键: {表名: {fingerprint, rows, status, updated_at}}}。
+    status 取值 loading / done / failed；每次更新都加锁并原子写盘，进程中途退出也不会丢失已完成记录。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self.data = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, key: str, tbl: str) -> Optional[dict]:
+        with self._lock:
+            entry = self.data.get(key, {}).get(tbl)
+            return dict(entry) if entry else None
+
+    def update(self, key: str, tbl: str, **fields):
+        with self._lock:
+            entry = self.data.setdefault(key, {}).setdefault(tbl, {})
+            entry.update(fields, updated_at=datetime.now().isoformat(timespec='seconds'))
+            tmp = self.path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self.data, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp, self.path)
+
+
+def manifest_key(server: dict, db: str) -> str:
+    return f"{server['ip']}:{server['pg_port']}/{db}"
+
+
+MANIFEST = LoadManifest(MANIFEST_PATH) if USE_MANIFEST else None
+
+# 每张成功导入的表一条记录：{server, db, table, bytes, rows, timings}，供 bench_import.py 汇总各阶段吞吐
+IMPORT_STATS = []
+
 # ——————— SSH 执行辅助 ———————
-def run_ssh_cmd(ssh: paramiko.SSHClient, cmd: str, print_cmd=True):
+def run_ssh_cmd(ssh: paramiko.SSHClient, cmd: str, print_cmd=True, out_sink=None):
+    # stdout 与 stderr 同时流式读取，内存中各保留至多 OUTPUT_CAP 字节；
+    # out_sink（如 stream_capture.FileSink / HashSink）可另外接收完整的 stdout
     if print_cmd:
         print(">>>", cmd)
     stdin, stdout, stderr = ssh.exec_command(cmd)
-    out = stdout.read().decode(errors="ignore").strip()
-    err = stderr.read().decode(errors="ignore").strip()
-    exit_status = stdout.channel.recv_exit_status()
+    out_buf = stream_capture.CappedBuffer(OUTPUT_CAP)
+    err_buf = stream_capture.CappedBuffer(OUTPUT_CAP)
+    exit_status = stream_capture.pump(stdout.channel, stream_capture.Tee(out_buf, out_sink), err_buf)
+    out = out_buf.text().strip()
+    err = err_buf.text().strip()
     print(f"[DEBUG] exit={exit_status}")
     if out:
         print(f"[STDOUT]\n{out}")
@@ -149,6 +592,602 @@ def psql_cmd(server: dict, db: str, sql: str) -> str:
         f'-v ON_ERROR_STOP=1 -X -tA -c "{sql}"'
     )
 
+# ——————— 传输压缩 ———————
+class GzipReader:
+    """把本地可读流包装为 gzip 压缩流，read() 返回压缩后的字节，raw_bytes 记录已读原始字节数"""
+
+    def __init__(self, src, level: int = 6):
+        self.src = src
+        self.level = level
+        self.raw_bytes = 0
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 生成 gzip 格式
+        self._eof = False
+
+    def read(self, size: int = STREAM_CHUNK_SIZE) -> bytes:
+        out = b""
+        while not out and not self._eof:
+            buf = self.src.read(size)
+            if not buf:
+                self._eof = True
+                return self._z.flush()
+            self.raw_bytes += len(buf)
+            out = self._z.compress(buf)
+        return out
+
+
+class CountingReader:
+    """不压缩，仅统计已读原始字节数，与 GzipReader 接口一致"""
+
+    def __init__(self, src):
+        self.src = src
+        self.raw_bytes = 0
+
+    def read(self, size: int = STREAM_CHUNK_SIZE) -> bytes:
+        buf = self.src.read(size)
+        self.raw_bytes += len(buf)
+        return buf
+
+
+class ZstdReader:
+    """zstd 压缩流（依赖可选的 zstandard 模块），多线程压缩"""
+
+    def __init__(self, src, level: int = 3):
+        self._counter = CountingReader(src)
+        self._reader = zstandard.ZstdCompressor(level=level, threads=-1).stream_reader(
+            self._counter, read_size=STREAM_CHUNK_SIZE
+        )
+
+    @property
+    def raw_bytes(self) -> int:
+        return self._counter.raw_bytes
+
+    def read(self, size: int = STREAM_CHUNK_SIZE) -> bytes:
+        return self._reader.read(size)
+
+
+def open_compressed(src, codec: str, level: int):
+    """按 codec 返回压缩读取器（均带 read() 与 raw_bytes）"""
+    if codec == "gzip":
+        return GzipReader(src, level)
+    if codec == "zstd":
+        return ZstdReader(src, level)
+    return CountingReader(src)
+
+
+def choose_codec(server: dict, csv_file: Path) -> str:
+    """
+    解析服务器配置的压缩编码；auto 时对文件开头采样，估算压缩比与本地压缩速度，
+    结合 link_mbps 选择预计总耗时最短的编码（压缩与传输流水线重叠，取两者较慢者）。
+    """
+    codec = server.get('transfer_codec', 'none')
+    if codec != 'auto':
+        return codec
+    size = csv_file.stat().st_size
+    with open(csv_file, 'rb') as f:
+        sample = f.read(CODEC_SAMPLE_SIZE)
+    if not sample:
+        return 'none'
+    link_bps = server.get('link_mbps', 100.0) * 1024 * 1024 / 8
+    best, best_sec = 'none', size / link_bps
+    candidates = ['gzip'] + (['zstd'] if zstandard is not None else [])
+    for cand in candidates:
+        t0 = time.perf_counter()
+        if cand == 'gzip':
+            z = zlib.compressobj(server.get('codec_level', 3), zlib.DEFLATED, 31)
+            packed = z.compress(sample) + z.flush()
+        else:
+            packed = zstandard.ZstdCompressor(level=server.get('codec_level', 3)).compress(sample)
+        cost = max(time.perf_counter() - t0, 1e-6)
+        ratio = len(sample) / max(len(packed), 1)
+        est_sec = max(size / ratio / link_bps, size / (len(sample) / cost))
+        if est_sec < best_sec:
+            best, best_sec = cand, est_sec
+    print(f"[{server['ip']}] {csv_file.name} 自动选择传输压缩: {best}")
+    return best
+
+
+# ——————— COPY FROM STDIN 流式导入 ———————
+def copy_options(header: bool = True, freeze: bool = False, binary: bool = False, null: str = NULL_TOKEN) -> str:
+    """生成 COPY 的 WITH 参数；binary 格式没有表头与 NULL 标记的概念"""
+    if binary:
+        opts = "FORMAT binary"
+    elif null != NULL_TOKEN:
+        opts = f"FORMAT csv, HEADER {'true' if header else 'false'}, NULL '{null}'"
+    else:
+        opts = COPY_OPTIONS if header else COPY_OPTIONS_NO_HEADER
+    return f"{opts}, FREEZE true" if freeze else opts
+
+
+def psql_setup_args(setup_sql: Optional[str]) -> str:
+    """
+    setup_sql 非空时生成 "-1 -c <setup>"，使其与随后的 COPY 在同一事务内执行（COPY FREEZE 需要）。
+    调用方须同时传 -v ON_ERROR_STOP=1，否则 setup 失败后 psql 仍会继续，退出码只反映最后一条命令。
+    """
+    return f"-1 -c {shlex.quote(setup_sql)} " if setup_sql else ""
+
+
+def copy_from_stdin_cmd(server: dict, db: str, tbl: str, codec: str = "none", remote_file: str = None,
+                        options: str = COPY_OPTIONS, setup_sql: Optional[str] = None) -> str:
+    """
+    生成远端 COPY FROM STDIN 命令。
+    codec 非 none 时先解压（来自通道 stdin 或远端暂存文件 remote_file）再管道给 psql，
+    并用 bash pipefail 保证解压失败时整体返回非零。
+    setup_sql（如建表 / TRUNCATE）与 COPY 放在同一事务中执行。
+    """
+    psql = (
+        f"{server['psql']} -p {server['pg_port']} -d {db} -v ON_ERROR_STOP=1 -X {psql_setup_args(setup_sql)}-c "
+        f"\"COPY \\\"{tbl}\\\" FROM STDIN WITH ({options});\""
+    )
+    if codec == "none":
+        return f"{psql} < {remote_file}" if remote_file else psql
+    decompress = CODEC_DECOMPRESS_CMD[codec]
+    if remote_file:
+        decompress = f"{decompress} {remote_file}"
+    return f"bash -o pipefail -c {shlex.quote(f'{decompress} | {psql}')}"
+
+
+def stream_copy(ssh: paramiko.SSHClient, server: dict, db: str, tbl: str, src, codec: str = "none",
+                options: str = COPY_OPTIONS, setup_sql: Optional[str] = None) -> tuple:
+    """
+    在远端启动 psql 执行 COPY ... FROM STDIN，并把本地可读流 src 分块写入通道的 stdin，
+    上传与服务器端解析同时进行，不落远端临时文件。src 为按 codec 压缩后的流。
+    返回 (exit_code, stdout, stderr, 发送字节数, 耗时秒)。
+    """
+    cmd = copy_from_stdin_cmd(server, db, tbl, codec, options=options, setup_sql=setup_sql)
+    print(">>>", cmd)
+    t0 = time.time()
+    stdin, stdout, stderr = ssh.exec_command(cmd)
+    channel = stdout.channel
+    sent = 0
+    try:
+        while True:
+            buf = src.read(STREAM_CHUNK_SIZE)
+            if not buf:
+                break
+            try:
+                channel.sendall(buf)
+            except OSError as e:
+                # 远端 psql 提前退出（如数据格式错误）时通道被关闭，停止发送并读取错误信息
+                print(f"[{server['ip']}] 向 {tbl} 发送数据中断: {e}")
+                break
+            sent += len(buf)
+    except Exception as e:
+        # 本地读取/解压/编码失败：不发送 EOF（EOF 会被 psql 当作数据正常结束而提交截断的数据），
+        # 直接关闭通道让远端 COPY 中止
+        channel.close()
+        print(f"[{server['ip']}] 读取 {tbl} 的本地数据失败，已中止 COPY: {e}")
+        return -1, "", f"本地数据读取失败: {e}", sent, time.time() - t0
+    channel.shutdown_write()
+    out_buf = stream_capture.CappedBuffer(OUTPUT_CAP)
+    err_buf = stream_capture.CappedBuffer(OUTPUT_CAP)
+    code = stream_capture.pump(channel, out_buf, err_buf)
+    return code, out_buf.text().strip(), err_buf.text().strip(), sent, time.time() - t0
+
+# ——————— 大文件切块 ———————
+class RangeReader:
+    """只读取文件从当前位置起 length 字节的可读流，用于按块流式导入"""
+
+    def __init__(self, f, length: int):
+        self.f = f
+        self.remaining = length
+
+    def __iter__(self):
+        # pandas 判断类文件对象时要求可迭代
+        return iter(lambda: self.read(STREAM_CHUNK_SIZE), b"")
+
+    def read(self, size: int = STREAM_CHUNK_SIZE) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        buf = self.f.read(min(size, self.remaining))
+        self.remaining -= len(buf)
+        return buf
+
+
+def split_csv_ranges(csv_file: Path, chunk_bytes: int) -> list:
+    """
+    按约 chunk_bytes 将 CSV 切分为若干 [start, end) 字节区间，边界只落在引号外的换行之后，
+    因此带引号的多行字段不会被拆开（引号奇偶判断与 PostgreSQL CSV 解析一致，"" 转义计两次不影响）。
+    """
+    size = csv_file.stat().st_size
+    if chunk_bytes <= 0 or size <= chunk_bytes:
+        return [(0, size)]
+    bounds = [0]
+    target = chunk_bytes
+    in_quote = False
+    pos = 0
+    with open(csv_file, 'rb') as f:
+        while True:
+            block = f.read(SPLIT_SCAN_BLOCK)
+            if not block:
+                break
+            i = 0
+            while True:
+                rel = target - pos
+                if rel >= len(block):
+                    # 本块内未到达下一个切分点，只累计引号奇偶
+                    in_quote ^= bool(block.count(b'"', i) & 1)
+                    break
+                rel = max(rel, i)
+                in_quote ^= bool(block.count(b'"', i, rel) & 1)
+                i = rel
+                # 从切分点向后寻找第一个位于引号外的换行
+                found = False
+                while True:
+                    nl = block.find(b'\n', i)
+                    if nl < 0:
+                        in_quote ^= bool(block.count(b'"', i) & 1)
+                        i = len(block)
+                        break
+                    in_quote ^= bool(block.count(b'"', i, nl) & 1)
+                    i = nl + 1
+                    if not in_quote:
+                        found = True
+                        break
+                if not found:
+                    break  # 跨块继续寻找
+                bounds.append(pos + i)
+                target = pos + i + chunk_bytes
+            pos += len(block)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def run_psql(ssh: paramiko.SSHClient, server: dict, db: str, sql: str):
+    """执行任意 SQL（用 shlex 引用，SQL 中可直接使用双引号标识符），返回 run_ssh_cmd 的结果"""
+    cmd = (
+        f"{server['psql']} -p {server['pg_port']} -d {db} "
+        f"-v ON_ERROR_STOP=1 -X -tA -c {shlex.quote(sql)}"
+    )
+    return run_ssh_cmd(ssh, cmd)
+
+
+def parse_copy_rows(out: str) -> int:
+    """从 psql 输出的 "COPY n" / "INSERT 0 n" 中解析行数"""
+    m = re.search(r'^(?:COPY|INSERT 0) (\d+)$', out, re.M)
+    return int(m.group(1)) if m else 0
+
+
+# ——————— 数据库执行引擎 ———————
+class PsqlEngine:
+    """
+    原有执行方式：每条 SQL / 每次 COPY 在远端启动一个 psql 进程。
+    与 PsycopgEngine 接口一致：execute / copy_in / ensure_database / close。
+    """
+    name = "psql"
+
+    def __init__(self, ssh: paramiko.SSHClient, server: dict):
+        self.ssh = ssh
+        self.server = server
+
+    def execute(self, db: str, sql: str) -> tuple:
+        return run_psql(self.ssh, self.server, db, sql)
+
+    def copy_in(self, db: str, tbl: str, src, codec: str = "none", options: str = COPY_OPTIONS,
+                setup_sql: Optional[str] = None) -> tuple:
+        return stream_copy(self.ssh, self.server, db, tbl, src, codec, options=options, setup_sql=setup_sql)
+
+    def ensure_database(self, db: str):
+        ensure_database(self.ssh, self.server, db)
+
+    def close(self):
+        pass
+
+
+class PortForwarder:
+    """
+    在本地 127.0.0.1 的随机端口监听，把每个入站连接经已有 SSH transport 的 direct-tcpip 通道
+    转发到远端 remote_host:remote_port，不需要额外的 SSH 握手。
+    transport 为任何提供 open_channel 的对象（paramiko.Transport 或 ssh_pool.SSHPool，后者计入通道上限）。
+    """
+
+    def __init__(self, transport, remote_host: str, remote_port: int):
+        self.transport = transport
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        self._closed = False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                client, addr = self._sock.accept()
+            except OSError:
+                break
+            try:
+                chan = self.transport.open_channel(
+                    "direct-tcpip", (self.remote_host, self.remote_port), addr
+                )
+            except Exception as e:
+                print(f"[forward] 打开转发通道失败: {e}")
+                client.close()
+                continue
+            threading.Thread(target=self._pipe, args=(client, chan), daemon=True).start()
+
+    @staticmethod
+    def _pipe(sock: socket.socket, chan: paramiko.Channel):
+        try:
+            while True:
+                readable, _, _ = select.select([sock, chan], [], [])
+                if sock in readable:
+                    data = sock.recv(STREAM_CHUNK_SIZE)
+                    if not data:
+                        break
+                    chan.sendall(data)
+                if chan in readable:
+                    data = chan.recv(STREAM_CHUNK_SIZE)
+                    if not data:
+                        break
+                    sock.sendall(data)
+        except OSError:
+            pass
+        finally:
+            chan.close()
+            sock.close()
+
+    def close(self):
+        self._closed = True
+        self._sock.close()
+
+
+class PgPool:
+    """
+    线程安全的多数据库连接池：所有数据库共用 size 个名额，打开的连接（使用中 + 空闲）总数不超过 size，
+    每个连接占一条 SSH 转发通道。空闲连接按数据库复用；需要新连接而名额已满时，关闭其它数据库的一个空闲连接腾出名额，
+    避免导入多个数据集时各库残留的空闲连接占满 ssh_channels。出错的连接直接丢弃。
+    """
+
+    def __init__(self, connect, size: int):
+        self._connect = connect
+        self._size = max(1, size)
+        self._slots = threading.BoundedSemaphore(self._size)
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._open = 0
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, db: str):
+        self._slots.acquire()
+        conn = None
+        evicted = None
+        ok = False
+        try:
+            with self._lock:
+                idle = self._idle.get(db)
+                if idle:
+                    conn = idle.pop()
+                else:
+                    if self._open >= self._size:
+                        # 使用中的连接少于 size，名额被其它库的空闲连接占着，取最早空闲的一个关闭
+                        evicted = next(lst for lst in self._idle.values() if lst).pop(0)
+                        self._open -= 1
+                    self._open += 1
+            if evicted is not None:
+                self._close_quietly(evicted)
+            if conn is None:
+                try:
+                    conn = self._connect(db)
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            yield conn
+            ok = True
+        finally:
+            if conn is not None:
+                if ok and not conn.closed:
+                    with self._lock:
+                        self._idle.setdefault(db, []).append(conn)
+                else:
+                    with self._lock:
+                        self._open -= 1
+                    self._close_quietly(conn)
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            conns = [c for lst in self._idle.values() for c in lst]
+            self._idle.clear()
+            self._open -= len(conns)
+        for conn in conns:
+            self._close_quietly(conn)
+
+
+class PsycopgEngine:
+    """
+    原生驱动执行方式：在现有 SSH transport 上开本地端口转发，所有数据库共用一个 psycopg 连接池（总连接数 pool_size），
+    DDL、目录查询与 COPY FROM STDIN（本地流直接写入）都走连接池，
+    省去每条语句的远端进程与后端连接启动开销，也不再需要 shell 引号转义。
+    """
+    name = "psycopg"
+
+    def __init__(self, ssh: paramiko.SSHClient, server: dict):
+        self.ssh = ssh
+        self.server = server
+        self.forwarder = PortForwarder(ssh, server['pg_host'], server['pg_port'])
+        self.pool_size = server.get('pg_pool_size') or (
+            server.get('import_workers', 1) * max(1, server.get('chunk_workers', 1)) + 1
+        )
+        self.pool = PgPool(self._connect, self.pool_size)
+
+    def _connect(self, db: str):
+        kwargs = dict(host="127.0.0.1", port=self.forwarder.port, dbname=db,
+                      user=self.server['pg_user'], password=self.server['pg_password'] or None)
+        if psycopg is not None:
+            return psycopg.connect(autocommit=True, **kwargs)
+        conn = psycopg2.connect(**kwargs)
+        conn.autocommit = True
+        return conn
+
+    def query(self, db: str, sql: str, params=None) -> list:
+        with self.pool.connection(db) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall() if cur.description else []
+
+    def execute(self, db: str, sql: str) -> tuple:
+        """执行 SQL，返回与 run_psql 相同形式的 (code, out, err)；out 为 -tA 风格的结果或命令标签"""
+        print(f"[{self.server['ip']}] >>> [{db}] {sql}")
+        try:
+            with self.pool.connection(db) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    if cur.description:
+                        out = "\n".join("|".join("" if v is None else str(v) for v in row)
+                                        for row in cur.fetchall())
+                    else:
+                        out = cur.statusmessage or ""
+            return 0, out, ""
+        except Exception as e:
+            return 1, "", str(e).strip()
+
+    def copy_in(self, db: str, tbl: str, src, codec: str = "none", options: str = COPY_OPTIONS,
+                setup_sql: Optional[str] = None) -> tuple:
+        """
+        把本地流 src 直接写入 COPY FROM STDIN；驱动路径不做远端解压，codec 必须为 none。
+        setup_sql 非空时与 COPY 在同一显式事务中执行。
+        """
+        sql = f'COPY "{tbl}" FROM STDIN WITH ({options})'
+        print(f"[{self.server['ip']}] >>> [{db}] {setup_sql + ' ' if setup_sql else ''}{sql}")
+        t0 = time.time()
+        sent = 0
+        try:
+            with self.pool.connection(db) as conn:
+                with conn.cursor() as cur:
+                    if setup_sql:
+                        cur.execute("BEGIN")
+                        cur.execute(setup_sql)
+                    if psycopg is not None:
+                        with cur.copy(sql) as copy:
+                            while True:
+                                buf = src.read(STREAM_CHUNK_SIZE)
+                                if not buf:
+                                    break
+                                copy.write(buf)
+                                sent += len(buf)
+                        out = cur.statusmessage or f"COPY {cur.rowcount}"
+                    else:
+                        cur.copy_expert(sql, src, size=STREAM_CHUNK_SIZE)
+                        sent = getattr(src, "raw_bytes", 0)
+                        out = f"COPY {cur.rowcount}"
+                    if setup_sql:
+                        cur.execute("COMMIT")
+            return 0, out, "", sent, time.time() - t0
+        except Exception as e:
+            return 1, "", str(e).strip(), sent, time.time() - t0
+
+    def ensure_database(self, db: str):
+        ip = self.server['ip']
+        if self.query("postgres", "SELECT 1 FROM pg_database WHERE datname = %s", (db,)):
+            print(f'[{ip}] 数据库 "{db}" 已存在')
+            return
+        code, out, err = self.execute("postgres", f'CREATE DATABASE "{db}" WITH ENCODING \'UTF8\' TEMPLATE template0')
+        if code != 0:
+            print(f'[{ip}] 创建数据库失败: {err or out}')
+            raise RuntimeError("创建数据库失败")
+        print(f'[{ip}] 已创建数据库 "{db}"')
+
+    def close(self):
+        self.pool.close()
+        self.forwarder.close()
+
+
+def make_engine(ssh: paramiko.SSHClient, server: dict):
+    if server.get('engine') == 'psycopg':
+        return PsycopgEngine(ssh, server)
+    return PsqlEngine(ssh, server)
+
+
+
+def import_csv_chunked(engine, server: dict, db: str, csv_file: Path, tbl: str, columns: list,
+                       ranges: list, codec: str, unlogged: bool = False, created: bool = False) -> Optional[int]:
+    """
+    将一个大 CSV 按 ranges 切块，用多个 COPY 会话并发导入同一张暂存表，全部成功后在一个事务内
+    并入目标表，任一块失败则丢弃暂存表，保证每张表要么完整导入、要么不变。成功返回导入行数，失败返回 None。
+    目标表由本次导入新建（created）时直接用暂存表改名替换，免去二次写入；已有的表可能带视图、外键、
+    授权等依赖，一律 INSERT ... SELECT 并入，不替换表本身。
+    """
+    ip = f"{server['ip']}/{db}"
+    stage = f"{tbl}__load"
+    level = server.get('codec_level', 3)
+    workers = max(1, server.get('chunk_workers', 4))
+    print(f"[{ip}] {tbl} 切分为 {len(ranges)} 块，并发 {workers} 个 COPY 会话")
+
+    code, out, err = engine.execute(db,
+                                    f'DROP TABLE IF EXISTS "{stage}"; '
+                                    f'CREATE {"UNLOGGED " if unlogged else ""}TABLE "{stage}" (LIKE "{tbl}" INCLUDING ALL);')
+    if code != 0:
+        print(f"[{ip}] 创建暂存表 {stage} 失败: {err or out}")
+        return None
+
+    binary = server.get('copy_format') == 'binary'
+
+    def load_chunk(idx: int, start: int, end: int):
+        with open(csv_file, 'rb') as f:
+            f.seek(start)
+            src = RangeReader(f, end - start)
+            if binary:
+                # 每块独立编码为完整的二进制 COPY 流，只有第一块带 CSV 表头
+                src = pg_binary.BinaryCopyReader(src, columns, NULL_TOKEN, workers=BINARY_WORKERS,
+                                                 has_header=(idx == 0))
+            src = open_compressed(src, codec, level)
+            return engine.copy_in(db, stage, src, codec, options=copy_options(idx == 0, binary=binary))
+
+    t0 = time.time()
+    ok = True
+    rows = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(load_chunk, i, start, end): i for i, (start, end) in enumerate(ranges)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                code, out, err, _, _ = future.result()
+            except Exception as e:
+                code, out, err = -1, "", str(e)
+            if code != 0:
+                print(f"[{ip}] {tbl} 第 {idx + 1}/{len(ranges)} 块导入失败: {err or out}")
+                ok = False
+            else:
+                rows += parse_copy_rows(out)
+
+    if not ok:
+        engine.execute(db, f'DROP TABLE IF EXISTS "{stage}";')
+        print(f"[{ip}] 导入 {tbl} 失败，已丢弃暂存数据，目标表未改动")
+        return None
+
+    # 全部块成功：本次新建的空表改名替换，否则整体插入；均在单个事务中完成
+    code = -1
+    if created:
+        code, out, err = engine.execute(db, f'SELECT count(*) FROM (SELECT 1 FROM "{tbl}" LIMIT 1) t;')
+    if code == 0 and out.strip() == "0":
+        commit_sql = f'BEGIN; DROP TABLE "{tbl}"; ALTER TABLE "{stage}" RENAME TO "{tbl}"; COMMIT;'
+        code, out, err = engine.execute(db, commit_sql)
+    else:
+        code = -1
+    if code != 0:
+        commit_sql = f'BEGIN; INSERT INTO "{tbl}" SELECT * FROM "{stage}"; DROP TABLE "{stage}"; COMMIT;'
+        code, out, err = engine.execute(db, commit_sql)
+    if code != 0:
+        engine.execute(db, f'DROP TABLE IF EXISTS "{stage}";')
+        print(f"[{ip}] 合并 {tbl} 失败: {err or out}")
+        return None
+    sec = time.time() - t0
+    size = csv_file.stat().st_size
+    rate = size / sec / 1024 / 1024 if sec > 0 else 0.0
+    print(f"[{ip}] 导入 {tbl} 成功 ({rows} 行, {size / 1024 / 1024:.1f} MB, {sec:.1f}s, {rate:.1f} MB/s, {len(ranges)} 块)")
+    return rows
+
 # ——————— 数据库保障 ———————
 def ensure_database(ssh: paramiko.SSHClient, server: dict, target_db: str):
     # 1) 在 postgres 库中检查是否存在（使用 ILIKE 实现大小写不敏感匹配）
@@ -174,87 +1213,535 @@ def ensure_database(ssh: paramiko.SSHClient, server: dict, target_db: str):
     print(f'[{server["ip"]}] 已创建数据库 "{target_db}"')
 
 
-# ——————— 部署 & 导入 ———————
-def deploy_and_import(server: dict):
-    ip = server['ip']
-    print(f"=== [{ip}] Start ===")
-    # 1. 建立 SSH + SFTP
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(ip, server['port'], server['username'], server['password'])
-    sftp = ssh.open_sftp()
-    ssh.exec_command(f"mkdir -p {REMOTE_TMP_DIR}")
-
-    # 2. 确保数据库存在
-    ensure_database(ssh, server, db_name)
-
-    # 3. 遍历本地所有 CSV
-    for csv_file in LOCAL_CSV_DIR.glob("*.csv"):
-        tbl = csv_file.stem
-        remote_path = f"{REMOTE_TMP_DIR}/{csv_file.name}"
-
-        # 上传
-        sftp.put(str(csv_file), remote_path)
-        print(f"[{ip}] 上传 {csv_file.name}")
-
-        # 生成建表 + \copy 语句
-        create_sql = csv_create_table_sql(csv_file)
-        #-------------------------------
-        create_table_cmd = (
-            f"{server['psql']} -p {server['pg_port']} -d {db_name} -c "
-            f"'{create_sql}'"
-        )
-        code, out, err = run_ssh_cmd(ssh, create_table_cmd)
+# ——————— 增量导入 ———————
+def delta_hash_path(key: str, tbl: str) -> Path:
+    return DELTA_DIR / re.sub(r'\W', '_', key) / f"{tbl}.npy"
+
+
+def extract_changed_rows(csv_file: Path, prev: Optional[np.ndarray], out_path: Optional[Path]) -> tuple:
+    """
+    逐块读取输入文件（CSV / 压缩 CSV / Parquet），按行计算 64 位哈希；prev（上次文件的有序行哈希）非空时，把不在 prev 中的行
+    连同表头写入 out_path。返回 (本次全部行哈希（有序去重）, 总行数, 写出的变化行数)。
+    """
+    hashes = []
+    total = changed = 0
+    reader = input_formats.iter_frames(csv_file, INFER_CHUNK_ROWS, NULL_TOKEN)
+    out = open(out_path, 'w', newline='', encoding='utf-8') if prev is not None else None
+    try:
+        for chunk in reader:
+            h = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            hashes.append(h)
+            total += len(chunk)
+            if out is None:
+                continue
+            idx = np.minimum(np.searchsorted(prev, h), len(prev) - 1) if len(prev) else None
+            new = ~(prev[idx] == h) if idx is not None else np.ones(len(h), dtype=bool)
+            if new.any():
+                chunk[new].to_csv(out, index=False, header=changed == 0)
+                changed += int(new.sum())
+    finally:
+        reader.close()
+        if out:
+            out.close()
+    all_hashes = np.unique(np.concatenate(hashes)) if hashes else np.empty(0, dtype='u8')
+    return all_hashes, total, changed
+
+
+def save_row_hashes(server: dict, db: str, tbl: str, hashes: np.ndarray):
+    path = delta_hash_path(manifest_key(server, db), tbl)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp.npy')
+    np.save(tmp, hashes)
+    os.replace(tmp, path)
+
+
+def merge_key_sql(tbl: str, key_cols: list) -> str:
+    """ON CONFLICT 需要 merge_key 上的唯一索引；已有相同列的唯一索引（含主键）时不再创建"""
+    cols = ", ".join(f'"{c}"' for c in key_cols)
+    names = ", ".join(f"'{c}'" for c in key_cols)
+    idx_name = f"{tbl}_{'_'.join(key_cols)}_key"[:63]
+    return (
+        f"DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = '\"{tbl}\"'::regclass "
+        f"AND i.indisunique AND (SELECT array_agg(a.attname::text ORDER BY k.ord) "
+        f"FROM unnest(i.indkey) WITH ORDINALITY k(attnum, ord) "
+        f"JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum) = ARRAY[{names}]::text[]) "
+        f'THEN CREATE UNIQUE INDEX "{idx_name}" ON "{tbl}" ({cols}); END IF; END $$;'
+    )
+
+
+def merge_sql(tbl: str, stage: str, columns: list, key_cols: list, skip_unchanged: bool) -> str:
+    """
+    把暂存表并入目标表：暂存表按 merge_key 去重后 INSERT ... ON CONFLICT DO UPDATE，
+    skip_unchanged 时值完全相同的行不更新（不产生新版本）。
+    返回一行 "去重后行数|新增|更新"，新增与更新由 RETURNING (xmax = 0) 区分。
+    """
+    names = [name for name, _ in columns]
+    col_list = ", ".join(f'"{c}"' for c in names)
+    keys = ", ".join(f'"{c}"' for c in key_cols)
+    rest = [c for c in names if c not in key_cols]
+    if rest:
+        action = "DO UPDATE SET " + ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in rest)
+        if skip_unchanged:
+            old = ", ".join(f'"{tbl}"."{c}"' for c in rest)
+            new = ", ".join(f'EXCLUDED."{c}"' for c in rest)
+            action += f" WHERE ({old}) IS DISTINCT FROM ({new})"
+    else:
+        action = "DO NOTHING"
+    return (
+        f'WITH src AS (SELECT DISTINCT ON ({keys}) {col_list} FROM "{stage}"), '
+        f'up AS (INSERT INTO "{tbl}" ({col_list}) SELECT {col_list} FROM src ON CONFLICT ({keys}) {action} '
+        f'RETURNING (xmax = 0) AS inserted) '
+        f'SELECT (SELECT count(*) FROM src), count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM up;'
+    )
+
+
+def table_has_rows(engine, db: str, tbl: str) -> bool:
+    code, out, err = engine.execute(db, f'SELECT count(*) FROM (SELECT 1 FROM "{tbl}" LIMIT 1) t;')
+    return code == 0 and out.strip().splitlines()[-1:] == ["1"]
+
+
+def import_csv_delta(engine, server: dict, db: str, csv_file: Path, tbl: str, columns: list) -> Optional[int]:
+    """
+    增量导入到已有数据的表，成功返回文件总行数，失败返回 None（目标表不变）。
+    本地保存了上次成功导入文件的逐行哈希时，只把新增/变化的行写成临时 CSV 传输；
+    数据先 COPY 进 UNLOGGED 暂存表，再按 merge_key upsert，输出新增/更新/未变行数。
+    逐行哈希只反映上次导入的文件；若目标表在两次导入之间被其他途径改动，可删除 .csv2pg_delta 下对应文件改为全量比对。
+    """
+    ip = f"{server['ip']}/{db}"
+    opts = TABLE_OPTIONS[tbl]
+    key_cols = opts["merge_key"]
+    hash_path = delta_hash_path(manifest_key(server, db), tbl)
+    prev = np.load(hash_path) if hash_path.exists() else None
+    work = hash_path.with_suffix('.delta.csv')
+    hash_path.parent.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.time()
+    hashes, total, changed = extract_changed_rows(csv_file, prev, work if prev is not None else None)
+    if prev is None:
+        changed = total
+        print(f"[{ip}] {tbl} 无上次导入的逐行哈希，全部 {total} 行进入比对")
+    else:
+        print(f"[{ip}] {tbl} 与上次文件相比变化 {changed}/{total} 行（比对 {time.time() - t0:.1f}s）")
+    if changed == 0:
+        save_row_hashes(server, db, tbl, hashes)
+        print(f"[{ip}] {tbl} 无变化，跳过传输 (新增 0, 更新 0, 未变 {total})")
+        return total
+
+    stage = f"{tbl}__delta"
+    code, out, err = engine.execute(db, f'DROP TABLE IF EXISTS "{stage}"; '
+                                        f'CREATE UNLOGGED TABLE "{stage}" (LIKE "{tbl}" INCLUDING DEFAULTS);')
+    if code != 0:
+        print(f"[{ip}] 创建暂存表 {stage} 失败: {err or out}")
+        work.unlink(missing_ok=True)
+        return None
+    try:
+        if load_csv_file(engine, server, db, work if prev is not None else csv_file, stage, columns,
+                         unlogged=True, created=True) is None:
+            return None
+        code, out, err = engine.execute(db, merge_key_sql(tbl, key_cols))
+        if code != 0:
+            print(f"[{ip}] 为 {tbl} 创建 merge_key 唯一索引失败（已有重复键？）: {err or out}")
+            return None
+        code, out, err = engine.execute(db, merge_sql(tbl, stage, columns, key_cols, opts["skip_unchanged"]))
+        counts = [line for line in out.splitlines() if re.fullmatch(r'\d+\|\d+\|\d+', line.strip())]
+        if code != 0 or not counts:
+            print(f"[{ip}] 合并 {tbl} 失败: {err or out}")
+            return None
+        staged, inserted, updated = (int(x) for x in counts[-1].strip().split('|'))
+    finally:
+        engine.execute(db, f'DROP TABLE IF EXISTS "{stage}";')
+        work.unlink(missing_ok=True)
+
+    save_row_hashes(server, db, tbl, hashes)
+    print(f"[{ip}] 增量导入 {tbl} 成功 (新增 {inserted}, 更新 {updated}, 未变 {total - inserted - updated}, "
+          f"传输 {changed}/{total} 行, 暂存去重后 {staged} 行, {time.time() - t0:.1f}s)")
+    return total
+
+
+# ——————— 单表导入 ———————
+def import_csv_file(engine, server: dict, db: str, csv_file: Path, columns: list) -> Optional[int]:
+    """
+    建表并导入单个 CSV，成功返回导入行数，失败返回 None。
+    结合导入清单：已完成且文件未变的表直接跳过；曾失败、中断或文件已变化的表先清空再重导。
+    [Table:表名] 配置了 merge_key 且表中已有数据时改走 import_csv_delta（不清空，按键 upsert）。
+    load_mode = fast 时新表以 UNLOGGED 创建并与 COPY FREEZE 同事务执行，导入后再 SET LOGGED、
+    建声明的主键/索引并 ANALYZE，逐步输出耗时。
+    """
+    ip = f"{server['ip']}/{db}"
+    tbl = input_formats.table_name(csv_file)
+    fast = server.get('load_mode') == 'fast'
+    key = manifest_key(server, db)
+    fingerprint = file_fingerprint(csv_file)
+    prev = MANIFEST.get(key, tbl) if MANIFEST else None
+    if prev and prev.get("status") == "done" and prev.get("fingerprint") == fingerprint:
+        print(f"[{ip}] 跳过 {tbl}（清单显示已导入 {prev.get('rows', 0)} 行且文件未变化）")
+        return prev.get("rows", 0)
+
+    def mark(**fields):
+        if MANIFEST:
+            MANIFEST.update(key, tbl, fingerprint=fingerprint, **fields)
+
+    merge_key = TABLE_OPTIONS.get(tbl, {}).get("merge_key")
+    if merge_key and table_has_rows(engine, db, tbl):
+        mark(status="loading")
+        rows = import_csv_delta(engine, server, db, csv_file, tbl, columns)
+        if rows is None:
+            mark(status="failed")
+        else:
+            mark(status="done", rows=rows)
+        return rows
+
+    timings = {}
+    t0 = time.time()
+    # 建表/清空语句：普通模式立即执行；fast 模式放进 COPY 所在事务，以便使用 COPY FREEZE
+    setup = []
+    # created：表由本次导入新建（切块导入只对这样的表用改名替换）
+    code, out, err = engine.execute(
+        db, f"SELECT 1 FROM pg_class WHERE relname = '{tbl}' AND relkind = 'r' AND pg_table_is_visible(oid);"
+    )
+    if code != 0:
+        print(f"[{ip}] 检查表 {tbl} 失败: {err or out}")
+        mark(status="failed")
+        return None
+    created = out.strip() != "1"
+    if fast:
+        if created:
+            setup.append(csv_create_table_sql(csv_file, columns, unlogged=True))
+    elif created:
+        code, out, err = engine.execute(db, csv_create_table_sql(csv_file, columns))
         if code != 0:
             print(f"[{ip}] 创建表 {tbl} 失败: {err or out}")
-            # 删除远程临时文件
-            ssh.exec_command(f"rm {remote_path}")
-            continue
-        # -------------------------------
+            mark(status="failed")
+            return None
 
-        # 执行 COPY 命令导入数据
-        copy_cmd = (
-            f"{server['psql']} -p {server['pg_port']} -d {db_name} -c "
-            f"\"COPY \\\"{tbl}\\\" FROM '{remote_path}' WITH (FORMAT csv, HEADER true, NULL 'NULL');\""
-        )
-        code, out, err = run_ssh_cmd(ssh, copy_cmd)
+    # 清单中有记录但未完成或文件已变：先清空，避免重复追加
+    if prev and not created:
+        reason = "文件已变化" if prev.get("fingerprint") != fingerprint else f"上次状态 {prev.get('status')}"
+        print(f"[{ip}] 清空 {tbl} 后重新导入（{reason}）")
+        if fast:
+            setup.append(f'TRUNCATE TABLE "{tbl}";')
+        else:
+            code, out, err = engine.execute(db, f'TRUNCATE TABLE "{tbl}";')
+            if code != 0:
+                print(f"[{ip}] 清空 {tbl} 失败: {err or out}")
+                mark(status="failed")
+                return None
+    timings["create"] = time.time() - t0
+
+    mark(status="loading")
+    t0 = time.time()
+    rows = load_csv_file(engine, server, db, csv_file, tbl, columns, setup_sql=" ".join(setup) or None,
+                         freeze=bool(setup), unlogged=created and fast, created=created, timings=timings)
+    # staged 模式的上传单独计入 transfer；流式模式传输与 COPY 重叠，统一计入 copy
+    timings["copy"] = time.time() - t0 - timings.get("transfer", 0.0)
+    if rows is not None and not finish_table(engine, server, db, tbl, created and fast, timings):
+        rows = None
+    if rows is None:
+        mark(status="failed")
+        return None
+    mark(status="done", rows=rows)
+    if merge_key:
+        # 记录本次文件的逐行哈希，下次增量导入只传变化的行
+        t0 = time.time()
+        save_row_hashes(server, db, tbl, extract_changed_rows(csv_file, None, None)[0])
+        timings["row_hashes"] = time.time() - t0
+    print(f"[{ip}] {tbl} 各步骤耗时: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+    IMPORT_STATS.append({"server": server['ip'], "db": db, "table": tbl, "bytes": csv_file.stat().st_size,
+                         "rows": rows, "timings": timings})
+    return rows
+
+
+def finish_table(engine, server: dict, db: str, tbl: str, created_unlogged: bool, timings: dict) -> bool:
+    """
+    数据导入后的收尾：UNLOGGED 新表 SET LOGGED，创建 [Table:表名] 中声明的主键与索引，
+    fast 模式下执行 ANALYZE。每步耗时记入 timings，任一步失败返回 False。
+    """
+    ip = f"{server['ip']}/{db}"
+    opts = TABLE_OPTIONS.get(tbl, {})
+    steps = []
+    if created_unlogged:
+        steps.append(("set_logged", f'ALTER TABLE "{tbl}" SET LOGGED;'))
+    if opts.get("primary_key"):
+        cols = ", ".join(f'"{c}"' for c in opts["primary_key"])
+        # 已有主键时跳过（例如追加导入已存在的表）
+        steps.append(("primary_key", (
+            f"DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_constraint "
+            f"WHERE conrelid = '\"{tbl}\"'::regclass AND contype = 'p') "
+            f'THEN ALTER TABLE "{tbl}" ADD PRIMARY KEY ({cols}); END IF; END $$;'
+        )))
+    if opts.get("merge_key"):
+        steps.append(("merge_key", merge_key_sql(tbl, opts["merge_key"])))
+    for idx_cols in opts.get("indexes", []):
+        idx_name = f"{tbl}_{'_'.join(idx_cols)}_idx"[:63]
+        cols = ", ".join(f'"{c}"' for c in idx_cols)
+        steps.append((f"index {idx_name}", f'CREATE INDEX IF NOT EXISTS "{idx_name}" ON "{tbl}" ({cols});'))
+    if server.get('load_mode') == 'fast':
+        steps.append(("analyze", f'ANALYZE "{tbl}";'))
+
+    for name, sql in steps:
+        t0 = time.time()
+        code, out, err = engine.execute(db, sql)
+        timings[name] = time.time() - t0
+        if code != 0:
+            print(f"[{ip}] {tbl} 执行 {name} 失败: {err or out}")
+            return False
+    return True
+
+
+def binary_supported(columns: list) -> bool:
+    # pg_binary 只能编码这些类型；其余（如 Parquet 映射出的 REAL、NUMERIC(p,s)、TIMESTAMPTZ）退回 CSV 格式
+    return all(t in pg_binary.FIXED_DTYPES or t in ('NUMERIC', 'VARCHAR', 'TEXT') for _, t in columns)
+
+
+@contextmanager
+def open_source(csv_file: Path, columns: list, binary: bool, passthrough: bool):
+    """
+    打开导入源，产出尚未按传输编码压缩的可读流：passthrough 时为原始文件字节（已是 gzip/zstd），
+    Parquet 为逐批转出的 CSV 文本，其余为（解压后的）CSV，binary 时再转为二进制 COPY 格式。
+    """
+    if input_formats.input_kind(csv_file) == 'parquet':
+        yield input_formats.ParquetCsvReader(csv_file)
+        return
+    with (open(csv_file, 'rb') if passthrough else input_formats.open_csv_stream(csv_file)) as f:
+        yield pg_binary.BinaryCopyReader(f, columns, NULL_TOKEN, workers=BINARY_WORKERS) if binary else f
+
+
+def load_csv_file(engine, server: dict, db: str, csv_file: Path, tbl: str, columns: list,
+                  setup_sql: Optional[str] = None, freeze: bool = False, unlogged: bool = False,
+                  created: bool = False, timings: Optional[dict] = None) -> Optional[int]:
+    """
+    按服务器配置选择切块 / 流式 / 暂存方式把 CSV 导入表，返回导入行数，失败返回 None。
+    timings 非空时 staged 模式的上传耗时记入 timings["transfer"]。
+    setup_sql（建表 / TRUNCATE）与单路 COPY 同事务执行，freeze 时使用 COPY FREEZE；
+    切块导入无法共享事务，先单独执行 setup_sql，unlogged 时暂存表也用 UNLOGGED；
+    created 表示目标表由本次导入新建，只有这时切块导入才可用暂存表改名替换目标表。
+    copy_format = binary 时按 columns 在本地编码为二进制 COPY 流（只能走流式通道）。
+    staged 模式在同一 SSH 连接上单独开一个 SFTP 通道上传，stream 模式单独开一个 exec 通道
+    （psycopg 引擎则从连接池取连接），均可被多个线程并发调用。
+    输入为 .csv.gz / .csv.zst 时 psql 引擎直接传输原压缩字节、远端解压；需本地解析时边读边解压；
+    Parquet 按 record batch 转为 CSV 流走流式通道（不切块、不支持 binary 格式）。
+    """
+    ip = f"{server['ip']}/{db}"
+    ssh = engine.ssh
+    kind = input_formats.input_kind(csv_file)
+    binary = server.get('copy_format') == 'binary' and kind != 'parquet' and binary_supported(columns)
+    # 输入本身已是 gzip/zstd 压缩：原样发送，由远端解压
+    passthrough = engine.name == 'psql' and kind in ('gzip', 'zstd') and not binary
+    # psycopg 引擎直接把本地流写入驱动连接，不经远端 shell，因而不做传输压缩、也没有暂存模式
+    if engine.name != 'psql':
+        codec = 'none'
+    elif passthrough:
+        codec = kind
+    elif kind == 'csv':
+        codec = choose_codec(server, csv_file)
+    else:
+        # 本地解码后的流无法按文件采样估算压缩收益，auto 按不压缩处理
+        codec = server.get('transfer_codec', 'none') if server.get('transfer_codec') in CODEC_SUFFIX else 'none'
+    level = server.get('codec_level', 3)
+
+    # 大文件切块并发导入（始终走 COPY FROM STDIN 流式通道；只支持未压缩 CSV）
+    chunk_bytes = server.get('chunk_size_mb', 0) * 1024 * 1024
+    if chunk_bytes > 0 and kind == 'csv':
+        ranges = split_csv_ranges(csv_file, chunk_bytes)
+        if len(ranges) > 1:
+            if setup_sql:
+                code, out, err = engine.execute(db, setup_sql)
+                if code != 0:
+                    print(f"[{ip}] 准备 {tbl} 失败: {err or out}")
+                    return None
+            return import_csv_chunked(engine, server, db, csv_file, tbl, columns, ranges, codec, unlogged=unlogged,
+                                      created=created)
+
+    if server.get('transfer_mode') == 'stream' or engine.name != 'psql' or binary or kind == 'parquet':
+        # 流式：本地文件（按需解压/转 CSV/转二进制、压缩后）直接写入 COPY FROM STDIN，上传与导入重叠
+        null = input_formats.PARQUET_NULL if kind == 'parquet' else NULL_TOKEN
+        options = copy_options(True, freeze, binary, null=null)
+        with open_source(csv_file, columns, binary, passthrough) as src:
+            src = CountingReader(src) if passthrough else open_compressed(src, codec, level)
+            code, out, err, sent, sec = engine.copy_in(db, tbl, src, codec, options=options, setup_sql=setup_sql)
         if code != 0:
             print(f"[{ip}] 导入 {tbl} 失败: {err or out}")
+            return None
+        size = csv_file.stat().st_size
+        rate = size / sec / 1024 / 1024 if sec > 0 else 0.0
+        print(
+            f"[{ip}] 导入 {tbl} 成功 (输入 {size / 1024 / 1024:.1f} MB, 传输 {sent / 1024 / 1024:.1f} MB "
+            f"[{server.get('copy_format', 'csv')}/{codec}], {sec:.1f}s, {rate:.1f} MB/s)"
+        )
+        return parse_copy_rows(out)
+
+    # 多个数据集可能有同名文件，远端文件名带上数据库名
+    remote_path = f"{REMOTE_TMP_DIR}/{db}__{csv_file.name}{'' if passthrough else CODEC_SUFFIX.get(codec, '')}"
+    # 未压缩或输入本身已压缩：分段并发、流水线上传并校验摘要（远端已有相同文件则跳过）；
+    # 需压缩：边压缩边写远端文件，不生成本地中间文件
+    keep = server.get('keep_uploads', False) and (codec == 'none' or passthrough)
+    t_upload = time.time()
+    if codec == 'none' or passthrough:
+        up = sftp_upload.upload(ssh, csv_file, remote_path, parts=server.get('upload_parts', sftp_upload.DEFAULT_PARTS))
+        if up["skipped"]:
+            print(f"[{ip}] 远端已有相同的 {csv_file.name}（{up['digest'][:12]}），跳过上传")
         else:
-            print(f"[{ip}] 导入 {tbl} 成功")
+            print(f"[{ip}] 上传 {csv_file.name} [{up['parts']} 段, {up['sec']:.1f}s, {up['mb_s']:.1f} MB/s, 已校验]")
+    else:
+        sftp = ssh.open_sftp()
+        try:
+            with open(csv_file, 'rb') as f, sftp.open(remote_path, 'wb') as rf:
+                rf.set_pipelined(True)
+                src = open_compressed(f, codec, level)
+                while True:
+                    buf = src.read(STREAM_CHUNK_SIZE)
+                    if not buf:
+                        break
+                    rf.write(buf)
+        finally:
+            sftp.close()
+        print(f"[{ip}] 上传 {csv_file.name} [{codec}]")
+    if timings is not None:
+        timings["transfer"] = time.time() - t_upload
 
+    try:
         # 执行 COPY 命令导入数据
-        # copy_cmd = (
-        #     f"COPY \"{tbl}\" "
-        #     f"FROM '{remote_path}' "
-        #     f"WITH (FORMAT csv, HEADER, NULL 'NULL');"
-        # )
-        #
-        # # 然后 full_cmd 变成：
-        # full_cmd = (
-        #     f"{server['psql']} -c "
-        #     f"\"{create_sql} {copy_cmd}\""
-        # )
-        #
-        # stdin, stdout, stderr = ssh.exec_command(full_cmd)
-        # err = stderr.read().decode().strip()
-        # if err:
-        #     print(f"[{ip}] 导入 {tbl} 失败: {err}")
-        # else:
-        #     print(f"[{ip}] 导入 {tbl} 成功")
-
-        # 删除远程临时文件
-        ssh.exec_command(f"rm {remote_path}")
+        if codec == 'none':
+            copy_cmd = (
+                f"{server['psql']} -p {server['pg_port']} -d {db} -v ON_ERROR_STOP=1 -X {psql_setup_args(setup_sql)}-c "
+                f"\"COPY \\\"{tbl}\\\" FROM '{remote_path}' WITH ({copy_options(True, freeze)});\""
+            )
+        else:
+            # 压缩文件在远端解压后经管道送入 COPY FROM STDIN
+            copy_cmd = copy_from_stdin_cmd(server, db, tbl, codec, remote_file=remote_path,
+                                           options=copy_options(True, freeze), setup_sql=setup_sql)
+        code, out, err = run_ssh_cmd(ssh, copy_cmd)
+        if code != 0:
+            print(f"[{ip}] 导入 {tbl} 失败: {err or out}")
+            return None
+        print(f"[{ip}] 导入 {tbl} 成功")
+        return parse_copy_rows(out)
+    finally:
+        # 删除远程临时文件（keep_uploads 时保留，供下次比对摘要跳过上传）
+        if not keep:
+            ssh.exec_command(f"rm {remote_path}")
+
+
+# ——————— 部署 & 导入 ———————
+def prepare_server(server: dict, dbs: list):
+    """连接服务器、建临时目录并确保各数据集的数据库存在，返回执行引擎；失败返回 None（该服务器的任务全部跳过）"""
+    ip = server['ip']
+    print(f"=== [{ip}] Start (workers={server.get('import_workers', 1)}, "
+          f"transfer={server.get('transfer_mode', 'staged')}, engine={server.get('engine', 'psql')}, "
+          f"load={server.get('load_mode', 'normal')}, 数据库 {len(dbs)} 个) ===")
+    try:
+        # 取该主机的共享 SSH 连接池（各导入任务复用已认证的 transport，按需各自开通道，受 ssh_channels 限制）
+        ssh = ssh_pool.get_pool(ip, server['port'], server['username'], server['password'],
+                                max_channels=server['ssh_channels'])
+        # 并行上传前必须确保临时目录已建好，这里等待命令返回
+        run_ssh_cmd(ssh, f"mkdir -p {REMOTE_TMP_DIR}")
+        engine = make_engine(ssh, server)
+        for db in dbs:
+            engine.ensure_database(db)
+        return engine
+    except Exception as e:
+        print(f"[{ip}] 准备失败，跳过该服务器: {e}")
+        return None
+
+
+# ——————— 全局调度 ———————
+class ImportScheduler:
+    """
+    所有 (服务器, 数据库, 表) 导入任务的共享队列，按文件大小从大到小出队。
+    每台服务器同时运行的任务数不超过其 import_workers，全体不超过 global_workers（工作线程数）；
+    某台服务器已满时跳过它的任务，取下一个能运行的最大任务，使各服务器一直忙到最后一个任务结束，
+    避免最后剩一个大表串行拖尾。
+    """
+
+    def __init__(self, jobs: list, limits: dict):
+        self.jobs = sorted(jobs, key=lambda j: j["size"], reverse=True)
+        self.limits = limits
+        self.running = {k: 0 for k in limits}
+        self._cond = threading.Condition()
+
+    def take(self) -> Optional[dict]:
+        with self._cond:
+            while self.jobs:
+                for i, job in enumerate(self.jobs):
+                    if self.running[job["server"]] < self.limits[job["server"]]:
+                        self.running[job["server"]] += 1
+                        return self.jobs.pop(i)
+                self._cond.wait()
+            return None
+
+    def done(self, job: dict):
+        with self._cond:
+            self.running[job["server"]] -= 1
+            self._cond.notify_all()
+
+
+def deploy_and_import(datasets: list, schemas: dict, global_workers: int = 0):
+    """
+    datasets 为 [(数据库名, [CSV 文件])]。各服务器并行准备后，把全部导入任务放进一个 ImportScheduler，
+    由 global_workers 个线程（0 表示各服务器 import_workers 之和）共同消费，最后按服务器汇总结果。
+    """
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        engines = list(executor.map(partial(prepare_server, dbs=[db for db, _ in datasets]), servers))
+
+    jobs = [{"server": i, "db": db, "csv_file": f, "size": f.stat().st_size}
+            for i, engine in enumerate(engines) if engine is not None
+            for db, csv_files in datasets for f in csv_files]
+    limits = {i: max(1, server.get('import_workers', 1)) for i, server in enumerate(servers)}
+    workers = global_workers or sum(limits[i] for i, e in enumerate(engines) if e is not None)
+    scheduler = ImportScheduler(jobs, limits)
+    failed = {i: [] for i in limits}
+    lock = threading.Lock()
+    print(f"[schedule] 共 {len(jobs)} 个导入任务，{len(datasets)} 个数据库，全局并发 {workers}")
+
+    def worker():
+        while True:
+            job = scheduler.take()
+            if job is None:
+                return
+            i, db, csv_file = job["server"], job["db"], job["csv_file"]
+            # 单表失败互不影响，仅记录
+            try:
+                columns = schemas.get(csv_file) or infer_schema(csv_file)["columns"]
+                ok = import_csv_file(engines[i], servers[i], db, csv_file, columns) is not None
+            except Exception as e:
+                print(f"[{servers[i]['ip']}/{db}] 导入 {csv_file.name} 异常: {e}")
+                ok = False
+            finally:
+                scheduler.done(job)
+            if not ok:
+                with lock:
+                    failed[i].append(f"{db}.{input_formats.table_name(csv_file)}")
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(jobs))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
 
     # 收尾
-    sftp.close()
-    ssh.close()
-    print(f"=== [{ip}] Done ===")
+    total = sum(len(csv_files) for _, csv_files in datasets)
+    for i, server in enumerate(servers):
+        ip = server['ip']
+        if engines[i] is None:
+            print(f"=== [{ip}] Failed (准备阶段失败，0/{total} 成功) ===")
+            continue
+        engines[i].close()
+        if failed[i]:
+            print(f"[{ip}] 失败的表({len(failed[i])}): {', '.join(sorted(failed[i]))}")
+        print(f"=== [{ip}] Done ({total - len(failed[i])}/{total} 成功) ===")
 
 # ——————— 并行入口 ———————
 def main():
-    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
-        executor.map(deploy_and_import, servers)
+    datasets = [(db, input_formats.list_inputs(d)) for db, d in discover_datasets()]
+    for _, files in datasets:
+        for f in files:
+            input_formats.check_available(f)
+    # 表结构只推断一次，所有服务器共用
+    schemas = prepare_schemas([f for _, csv_files in datasets for f in csv_files])
+    deploy_and_import(datasets, schemas, config.getint('General', 'global_workers', fallback=0))
+    pg_binary.shutdown_pool()
+    ssh_pool.print_report()
+    ssh_pool.close_all()
 
 if __name__ == "__main__":
     main()
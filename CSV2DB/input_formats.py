@@ -0,0 +1,179 @@
+import io
+import gzip
+from pathlib import Path
+import pandas as pd
+
+# zstd 压缩的 CSV 需要可选的 zstandard 模块
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Parquet 输入需要可选的 pyarrow
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#csv2pg 支持的输入格式：.csv、.csv.gz、.csv.zst、.parquet，均以流的方式读取，本地与远端都不生成解压后的中间文件
+#- 压缩 CSV：psql 引擎直接把原压缩字节发到远端，由 gzip/zstd 解压后管道给 COPY；需在本地解析时（psycopg 引擎、binary 格式、类型推断）边读边解压；
+#- Parquet：列类型直接由文件 schema 映射为 PostgreSQL 类型，无需推断；数据按 record batch 转为 CSV 文本流送入 COPY。
+
+# 后缀 -> 输入类型（按从长到短匹配）
+INPUT_SUFFIXES = {".csv.gz": "gzip", ".csv.zst": "zstd", ".csv": "csv", ".parquet": "parquet"}
+# Parquet 转出的 CSV 中非空值一律加引号、NULL 不加引号，COPY 据此区分 NULL 与空串
+PARQUET_NULL = ''
+# 每个 record batch 的行数
+PARQUET_BATCH_ROWS = 65536
+
+
+def input_kind(path: Path) -> str:
+    name = path.name.lower()
+    for suffix, kind in INPUT_SUFFIXES.items():
+        if name.endswith(suffix):
+            return kind
+    raise ValueError(f"不支持的输入文件格式: {path.name}")
+
+
+def table_name(path: Path) -> str:
+    """去掉 .csv / .csv.gz / .csv.zst / .parquet 后缀得到表名"""
+    name = path.name
+    for suffix in INPUT_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return path.stem
+
+
+def list_inputs(directory: Path) -> list:
+    """目录下所有支持格式的输入文件；同名表出现多种格式时报错"""
+    files = sorted(f for f in directory.iterdir()
+                   if f.is_file() and any(f.name.lower().endswith(s) for s in INPUT_SUFFIXES))
+    seen = {}
+    for f in files:
+        tbl = table_name(f)
+        if tbl in seen:
+            raise ValueError(f"{directory} 中 {seen[tbl].name} 与 {f.name} 对应同一张表 {tbl}")
+        seen[tbl] = f
+    return files
+
+
+def check_available(path: Path):
+    kind = input_kind(path)
+    if kind == "zstd" and zstandard is None:
+        raise ValueError(f"{path.name} 为 zstd 压缩，但本地未安装 zstandard 模块")
+    if kind == "parquet" and pyarrow is None:
+        raise ValueError(f"{path.name} 为 Parquet 文件，但本地未安装 pyarrow")
+
+
+def open_csv_stream(path: Path):
+    """返回解压后的 CSV 字节流（可读、可迭代，供 pandas 与 COPY 流使用）"""
+    kind = input_kind(path)
+    if kind == "gzip":
+        return gzip.open(path, "rb")
+    if kind == "zstd":
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                         closefd=True)
+        return io.BufferedReader(raw)
+    if kind == "csv":
+        return open(path, "rb")
+    raise ValueError(f"{path.name} 不是 CSV 输入")
+
+
+# ——————— Parquet ———————
+def _pg_type(t) -> str:
+    types = pyarrow.types
+    if types.is_dictionary(t):
+        return _pg_type(t.value_type)
+    if types.is_boolean(t):
+        return 'BOOLEAN'
+    if types.is_int8(t) or types.is_int16(t) or types.is_uint8(t):
+        return 'SMALLINT'
+    if types.is_int32(t) or types.is_uint16(t):
+        return 'INT'
+    if types.is_int64(t) or types.is_uint32(t):
+        return 'BIGINT'
+    if types.is_uint64(t):
+        return 'NUMERIC'
+    if types.is_float16(t) or types.is_float32(t):
+        return 'REAL'
+    if types.is_float64(t):
+        return 'DOUBLE PRECISION'
+    if types.is_decimal(t):
+        return f'NUMERIC({t.precision},{t.scale})'
+    if types.is_string(t) or types.is_large_string(t) or types.is_null(t):
+        return 'VARCHAR'
+    if types.is_date(t):
+        return 'DATE'
+    if types.is_timestamp(t):
+        return 'TIMESTAMPTZ' if t.tz else 'TIMESTAMP'
+    if types.is_time(t):
+        return 'TIME'
+    return None
+
+
+def parquet_columns(path: Path) -> tuple:
+    """由 Parquet schema 直接得到 ([[列名, SQL 类型], ...], 行数)，不读取数据"""
+    pf = pyarrow.parquet.ParquetFile(path)
+    schema = pf.schema_arrow
+    columns = []
+    for f in schema:
+        sql_type = _pg_type(f.type)
+        if sql_type is None:
+            raise ValueError(f"{path.name} 的列 {f.name} 类型 {f.type} 暂不支持导入")
+        columns.append([f.name, sql_type])
+    return columns, pf.metadata.num_rows
+
+
+def _plain_batch(batch):
+    # 字典编码列先还原为值类型，CSV 写出器按值格式化
+    arrays = [a.dictionary_decode() if pyarrow.types.is_dictionary(a.type) else a for a in batch.columns]
+    return pyarrow.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+class ParquetCsvReader:
+    """
+    可读流：逐个 record batch 读取 Parquet，转为 CSV 文本（首批带表头），read() 返回字节。
+    非空值加引号、NULL 写为不加引号的空字段，对应 COPY 参数 NULL ''（见 PARQUET_NULL）。
+    raw_bytes 记录已输出字节数，rows 为已读行数。
+    """
+
+    def __init__(self, path: Path, batch_rows: int = PARQUET_BATCH_ROWS):
+        self._batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_rows)
+        self._buf = bytearray()
+        self._header = True
+        self.raw_bytes = 0
+        self.rows = 0
+
+    def _next(self) -> bool:
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        sink = io.BytesIO()
+        pyarrow.csv.write_csv(_plain_batch(batch), sink, write_options=pyarrow.csv.WriteOptions(
+            include_header=self._header, quoting_style='all_valid'))
+        self._header = False
+        self._buf += sink.getvalue()
+        self.rows += batch.num_rows
+        return True
+
+    def read(self, size: int = 4 * 1024 * 1024) -> bytes:
+        while len(self._buf) < size and self._next():
+            pass
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        self.raw_bytes += len(out)
+        return out
+
+
+def iter_frames(path: Path, chunk_rows: int, null_token: str):
+    """按块产出全为字符串的 DataFrame（NULL 为 null_token），供类型推断与增量比对使用"""
+    if input_kind(path) != "parquet":
+        with open_csv_stream(path) as f, pd.read_csv(f, dtype=str, keep_default_na=False, na_filter=False,
+                                                     chunksize=chunk_rows, low_memory=False) as reader:
+            yield from reader
+        return
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        df = _plain_batch(batch).to_pandas()
+        yield df.astype(str).where(df.notna(), null_token)
@@ -1,15 +1,159 @@
-import paramiko
+import re
+import sys
+import json
+import uuid
+import codecs
+import socket
 import time
 import sqlparse
 import concurrent.futures
 import configparser
+from datetime import datetime
 from pathlib import Path
 
-def execute_sql_fast_no_output(ip, port, username, password, sql_file_path, psql_command, psql_close_command, repeat=20):
+# 仓库根目录下与 CSV2DB 共用的模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ssh_pool
+
+# 单条语句的默认最长等待时间（秒），超时视为失败而不是无限等待
+STATEMENT_TIMEOUT = 3600
+# psql 启动的最长等待时间（秒）
+STARTUP_TIMEOUT = 30
+# 语句超时后发送取消（Ctrl-C）并等待 psql 回到提示符的最长时间（秒），超过则放弃该会话
+CANCEL_TIMEOUT = 60
+# 逐条语句结果的本地保存目录（与 excute_sql_safe.py 的 ./runs/<时间>/<服务器>/ 一致）
+LOCAL_RUNS_DIR = Path("./runs")
+# 启动 psql 前在远端 shell 中设置：提示信息不随服务器语言环境翻译；客户端编码与本地解码一致（UTF-8）
+PSQL_SHELL_ENV = "export LC_ALL=C PGCLIENTENCODING=UTF8"
+
+
+class PsqlShell:
+    """
+    交互式 psql 会话驱动：每条语句后追加一个唯一的 \\echo 标记，读到该标记所在的整行即认为语句执行完毕，
+    因此上一条语句结束后立即发送下一条，不再固定 sleep；同时记录每条语句耗时并提取 ERROR 信息。
+    语句是否出错按 psql 的 SQLSTATE 变量判断（服务器端的错误前缀会按其 lc_messages 翻译），
+    psql 11 以前没有该变量时退回到查找 "ERROR:" 行。
+    语句超时后发送 Ctrl-C 取消并同步到新标记，丢弃其迟到的输出；取消后仍无响应时会话标记为 broken，不再执行后续语句。
+    """
+
+    def __init__(self, shell, timeout: int = STATEMENT_TIMEOUT):
+        self.shell = shell
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._buf = ""
+        self.broken = False
+
+    def _next_marker(self) -> str:
+        self.seq += 1
+        return f"__DONE_{self.token}_{self.seq}__"
+
+    def _state_mark(self) -> str:
+        # 与本条语句的完成标记同序号，超时语句迟到的状态行不会被后续语句误认
+        return f"__STATE_{self.token}_{self.seq}__"
+
+    def wait_for(self, marker: str, timeout: float) -> tuple:
+        """
+        读取输出直到出现独占一行的 marker（终端回显的 "\\echo marker" 行不会匹配），
+        返回 (标记之前的输出, 是否在超时前读到标记)。
+        """
+        pattern = re.compile(rf"^{re.escape(marker)}\r?$", re.M)
+        deadline = time.time() + timeout
+        scan_from = 0
+        while True:
+            m = pattern.search(self._buf, scan_from)
+            if m:
+                out, self._buf = self._buf[:m.start()], self._buf[m.end():]
+                return out, True
+            # 只需从上次末尾附近继续查找，避免大输出时反复全量扫描
+            scan_from = max(0, len(self._buf) - len(marker) - 2)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return self._buf, False
+            self.shell.settimeout(min(remaining, 1.0))
+            try:
+                data = self.shell.recv(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                return self._buf, False
+            self._buf += self._decoder.decode(data)
+
+    def sync(self, timeout: float) -> tuple:
+        """发送一个标记并等待其返回，用于确认 psql 已就绪或前面的输入都已处理完"""
+        marker = self._next_marker()
+        self.shell.send(f"\\echo {marker}\n")
+        return self.wait_for(marker, timeout)
+
+    def run(self, sql: str) -> dict:
+        """发送一条语句并等待完成，返回 {elapsed_sec, output, error, timeout, status}"""
+        if self.broken:
+            return {"elapsed_sec": 0.0, "output": "", "error": "psql 会话在之前的语句超时后未能恢复，未执行",
+                    "timeout": False, "status": "aborted"}
+        marker = self._next_marker()
+        state_mark = self._state_mark()
+        t0 = time.time()
+        self.shell.send(f"{sql};\n\\echo {state_mark} :SQLSTATE\n\\echo {marker}\n")
+        out, ok = self.wait_for(marker, self.timeout)
+        elapsed = round(time.time() - t0, 3)
+        # 终端回显的 "\echo ..." 输入行不以标记开头，不会匹配
+        m = re.search(rf"^{state_mark} (\S+)\r?$", out, re.M)
+        state = m.group(1) if m and re.fullmatch(r"[0-9A-Z]{5}", m.group(1)) else None
+        if m:
+            out = out[:m.start()] + out[m.end():]
+        lines = [line.strip() for line in out.splitlines()]
+        if state is None:
+            errors = [line for line in lines if "ERROR:" in line]
+        elif state != "00000":
+            # 错误信息行（任何语言）都以 "xxx:  " 开头，取不到时至少记下 SQLSTATE
+            errors = [line for line in lines if re.match(r"^[^\s:]+:  ", line)] or [f"SQLSTATE {state}"]
+        else:
+            errors = []
+        if not ok:
+            errors.append(f"等待语句完成超时（{self.timeout}s）")
+            self.cancel()
+        status = "timeout" if not ok else ("error" if errors else "ok")
+        return {"elapsed_sec": elapsed, "output": out, "error": "\n".join(errors), "timeout": not ok,
+                "status": status}
+
+    def cancel(self):
+        """取消正在执行的语句（psql 收到 Ctrl-C 会向服务器发送取消请求），并同步到新标记以丢弃其剩余输出"""
+        self.shell.send("\x03")
+        _, ok = self.sync(CANCEL_TIMEOUT)
+        if not ok:
+            self.broken = True
+
+
+def open_psql_shell(ssh, psql_command, timeout=STATEMENT_TIMEOUT) -> PsqlShell:
+    """打开交互式 shell 并启动 psql，等待其就绪（而不是固定等待 1 秒）"""
+    shell = ssh.invoke_shell()
+    psql = PsqlShell(shell, timeout)
+    shell.send(f"{PSQL_SHELL_ENV}\n{psql_command}\n")
+    # 关闭分页器，避免大结果集卡在 more/less 中
+    shell.send("\\pset pager off\n")
+    startup, ok = psql.sync(STARTUP_TIMEOUT)
+    if not ok:
+        shell.close()
+        raise RuntimeError(f"psql 启动超时: {startup[-500:]}")
+    return psql
+
+
+def close_psql_shell(psql: PsqlShell, psql_close_command=None):
+    """退出 psql；如提供 psql_close_command（如 pg_ctl stop），退出后在 shell 中执行并等待其完成"""
+    shell = psql.shell
+    shell.send("\\q\n")
+    if psql_close_command:
+        marker = psql._next_marker()
+        shell.send(f"{psql_close_command}; echo {marker}\n")
+        psql.wait_for(marker, STARTUP_TIMEOUT * 4)
+    shell.close()
+
+
+def execute_sql_fast_no_output(ip, port, username, password, sql_file_path, psql_command, psql_close_command,
+                               repeat=20, timeout=STATEMENT_TIMEOUT):
     print(f"\n>>> 正在连接 {ip} ...")
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(ip, port=port, username=username, password=password)
+    ssh = ssh_pool.get_pool(ip, port, username, password)
     print("ssh连接成功")
 
     # 读取 SQL 脚本并按语句切分
@@ -17,36 +161,39 @@ def execute_sql_fast_no_output(ip, port, username, password, sql_file_path, psql
         sql_content = f.read()
     print("sql文件读取成功")
 
-    statements = sqlparse.split(sql_content)
+    statements = [s.strip() for s in sqlparse.split(sql_content) if s.strip()]
 
     # 启动 psql 会话
-    shell = ssh.invoke_shell()
-    shell.send(f"{psql_command}\n")
-    time.sleep(1)  # 等待 psql 启动
+    psql = open_psql_shell(ssh, psql_command, timeout)
 
-    # 快速执行，每次循环 1 轮 SQL
+    # 每条语句完成后立即发送下一条，记录逐条耗时
+    results = []
     for round_num in range(1, repeat + 1):
         print(f">>> 正在执行第 {round_num} 次脚本 ...")
-        for statement in statements:
-            clean_sql = statement.strip()
-            if not clean_sql:
-                continue
-            shell.send(clean_sql + ";\n")
-            time.sleep(2)  # 简短等待，保证语句送入
+        round_sec = 0.0
+        for i, clean_sql in enumerate(statements, start=1):
+            res = psql.run(clean_sql)
+            round_sec += res["elapsed_sec"]
+            results.append({"round": round_num, "statement": i, "status": res["status"],
+                             "elapsed_sec": res["elapsed_sec"], "error": res["error"]})
+            if res["error"]:
+                print(f"[{ip}] 第 {round_num} 轮第 {i} 条 SQL 出错: {res['error'][:500]}")
+            if psql.broken:
+                break
+        if psql.broken:
+            print(f"[{ip}] 第 {round_num} 轮第 {i} 条 SQL 超时后 psql 无响应，放弃剩余语句")
+            break
+        print(f"[{ip}] 第 {round_num} 轮完成，用时 {round_sec:.3f}s")
 
     # 退出 psql
-    shell.send(psql_close_command+"\n")
-    time.sleep(1)
-
-    shell.close()
-    ssh.close()
+    close_psql_shell(psql, psql_close_command)
     print(">>> 所有执行完成，连接已关闭。")
+    return results
 
-def execute_sql_in_persistent_psql_session(ip, port, username, password, sql_file_path, psql_command):
+def execute_sql_in_persistent_psql_session(ip, port, username, password, sql_file_path, psql_command,
+                                           timeout=STATEMENT_TIMEOUT):
     print(f"\n>>> 正在连接 {ip} ...")
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(ip, port=port, username=username, password=password)
+    ssh = ssh_pool.get_pool(ip, port, username, password)
     print("ssh连接成功")
 
     # 读取 SQL 脚本并按语句切分
@@ -56,37 +203,46 @@ def execute_sql_in_persistent_psql_session(ip, port, username, password, sql_fil
 
     statements = sqlparse.split(sql_content)
 
-    # 打开交互式 shell，并启动 psql 会话
-    shell = ssh.invoke_shell()
-    shell.send(f"{psql_command}\n")
-    time.sleep(1)  # 等待 psql 启动
-
-    # 读取启动 psql 的初始提示信息
-    if shell.recv_ready():
-        print(shell.recv(4096).decode())
+    # 打开交互式 shell，并启动 psql 会话（读到就绪标记即返回）
+    psql = open_psql_shell(ssh, psql_command, timeout)
 
+    results = []
     for i, statement in enumerate(statements, start=1):
         clean_sql = statement.strip()
         if not clean_sql:
             continue
-        # 输入 SQL（每句后加分号防止粘连）
+        # 输入 SQL（每句后加分号防止粘连），读到完成标记后立即继续下一条
         print(f">>> [第 {i} 条 SQL] 正在发送: {clean_sql[:80]}{'...' if len(clean_sql) > 80 else ''}")
-        shell.send(clean_sql + ";\n")
-        time.sleep(5)  # 等待语句执行完毕（可根据语句复杂度调整）
-        while shell.recv_ready():
-            output = shell.recv(4096).decode()
-            print(output.strip())
+        res = psql.run(clean_sql)
+        print(res["output"].strip())
+        print(f">>> [第 {i} 条 SQL] 用时 {res['elapsed_sec']:.3f}s")
+        if res["error"]:
+            print(f">>> [第 {i} 条 SQL] 出错: {res['error']}")
+        results.append({"statement": i, "status": res["status"], "elapsed_sec": res["elapsed_sec"],
+                        "error": res["error"]})
+        if psql.broken:
+            print(f">>> [第 {i} 条 SQL] 超时后 psql 无响应，放弃剩余语句")
+            break
 
     # 退出 psql
-    shell.send("\\q\n")
-    time.sleep(1)
-    if shell.recv_ready():
-        print(shell.recv(4096).decode())
-    shell.send("\\q\n")
-    shell.close()
-    ssh.close()
+    close_psql_shell(psql)
+    return results
 
 
+def save_results(run_dir: Path, server: dict, results: list) -> int:
+    """把逐条语句结果写入 run_dir/<ip>/results.jsonl 并输出汇总，返回失败（出错或超时）的语句数"""
+    out_dir = run_dir / server["ip"]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with open(out_dir / "results.jsonl", "w", encoding="utf-8") as f:
+        for rec in results:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    failed = [r for r in results if r["status"] != "ok"]
+    total_sec = sum(r["elapsed_sec"] for r in results)
+    print(f"[{server['ip']}] 共 {len(results)} 条语句，失败 {len(failed)} 条，总用时 {total_sec:.3f}s，"
+          f"结果已写入 {out_dir / 'results.jsonl'}")
+    for r in failed[:10]:
+        print(f"[{server['ip']}]   第 {r['round']} 轮第 {r['statement']} 条 [{r['status']}]: {r['error'][:200]}")
+    return len(failed)
 
 
 if __name__ == "__main__":
@@ -120,27 +276,37 @@ if __name__ == "__main__":
                     "password": config.get(section, 'password'),
                     "sql_file_path": config.get(section, 'sql_file_path'),  # 新增：SQL文件路径
                     "psql_command": config.get(section, 'psql_command'),  # 新增：psql命令
-                    "psql_close_command": config.get(section, 'psql_close_command')  # 新增：关闭命令
+                    "psql_close_command": config.get(section, 'psql_close_command'),  # 新增：关闭命令
+                    # 可选：单条语句最长等待秒数，超时记为失败
+                    "statement_timeout": config.getint(section, 'statement_timeout', fallback=STATEMENT_TIMEOUT),
                 }
                 servers.append(server)
             except configparser.NoOptionError as e:
                 print(f"配置文件错误：{section} 缺少必要配置项: {e}")
                 continue
 
+    run_dir = LOCAL_RUNS_DIR / datetime.now().strftime("%Y%m%d-%H%M%S")
+    failures = 0
     with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
         # Submit both tasks at once
-        futures = [
+        futures = {
             executor.submit(
                 execute_sql_fast_no_output,
                 srv["ip"], srv["port"], srv["username"], srv["password"],
-                srv["sql_file_path"], srv["psql_command"], srv["psql_close_command"]
-            )
+                srv["sql_file_path"], srv["psql_command"], srv["psql_close_command"],
+                timeout=srv["statement_timeout"]
+            ): srv
             for srv in servers
-        ]
-        # Optionally wait for both to complete
+        }
         for future in concurrent.futures.as_completed(futures):
+            srv = futures[future]
             try:
-                future.result()  # will re‑raise any exceptions
+                failures += save_results(run_dir, srv, future.result())
             except Exception as e:
-                print("Task raised an exception:", e)
+                print(f"[{srv['ip']}] 执行失败: {e}")
+                failures += 1
+    ssh_pool.print_report()
+    ssh_pool.close_all()
+    # 任一语句出错、超时或某台服务器执行失败时返回非零退出码
+    sys.exit(1 if failures else 0)
 
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 runner_from_conf.py —— 自动读取同目录下的 .conf（无命令行参数），直接在 main() 运行
+                        对比两次运行：python excute_sql_safe.py compare <目录A> <目录B>
+                        并发压测：    python excute_sql_safe.py load（参数见 [Load] 段）
 
 设计要点
 - 不再在 main() 中硬编码参数；自动扫描脚本目录下的 .conf 文件读取参数；
@@ -12,26 +14,106 @@ runner_from_conf.py —— 自动读取同目录下的 .conf（无命令行参
   (B) 可选 [Runner] 段用于覆盖 repeat/retry/timeout/remote_tmp_dir/pre_checkpoint/save_local 等；
 - 实现非交互 psql 执行、失败即停、repeat+重试、结构化日志(远端 JSONL + meta.json)；
 - 可选在批次开始前执行 CHECKPOINT；可选在全部完成后执行 psql_close_command。
+- 多服务器按 [Runner] concurrency 并发执行：同一数据库（ip+pg_port+库名，或显式 group）的服务器串行，
+  不同主机并行；round_barrier = true 时所有正在运行的服务器在每一轮开始前对齐
+  （session_mode = persistent 时只对齐首个会话的开始，失败后的重试会话不再等待）。
+- session_mode = persistent 时所有轮次在同一个 psql 会话内执行（避免每轮重新 fork/连接、缓存变冷），
+  每轮前后输出带服务器时间戳的标记行，按标记解析每轮耗时；某轮失败时从该轮起重连重试。
+- SQL 文件用 sqlparse 切分后逐条写入 wrapper，借助 \\timing 记录每条语句耗时（results.jsonl 的 stmt_ms）；
+  前 warmup 轮只执行不统计，结束后按语句/按轮计算 min/median/p95/p99/stddev/cv 写入 summary.json；
+  compare 子命令对两个运行目录逐条语句做 Mann-Whitney U 检验，标出显著变慢的语句。
+- load 子命令（类似 pgbench）：每台服务器开 K 个常驻 psql 会话，按权重混合执行多个 SQL 文件（每个文件为一个事务），
+  按时长或事务数运行并支持逐步加压（ramp-up）；对 [Load] clients 中的每个 K 输出 TPS、延迟分位数，汇总为扩展曲线写入 load.json。
 
 注意
 - 若同目录存在多个 .conf：优先使用 server_config.conf；否则使用第一个找到的 .conf；
   也可通过环境变量 RUNNER_CONF 指定特定配置文件路径。
 - psql_command 若已包含 -d/-p/-h/-U，将按原样执行，并追加固定参数(-X -q -At -v ON_ERROR_STOP=1 -P pager=off)；
 - 如 password 配置了，将以环境变量 PGPASSWORD 传入远端会话（建议生产使用 .pgpass）。
+- 远端 psql 一律以 LC_ALL=C 运行，\\timing 的 "Time:" 行不随服务器语言环境翻译；
+  某轮解析到的语句耗时少于语句数时输出警告（通常是 sshd 未接受 LC_* 环境变量）。
+- 每轮结果经 ResultSink 缓冲后批量写出（[Runner] result_sinks / result_batch）：远端 run 目录的 results.jsonl
+  （格式不变）、本地 JSONL / SQLite / Parquet 可任选组合，不再每条记录打开一次 SFTP 文件。
+- 远端 stdout/stderr 同时流式读取（stream_capture），内存中只保留 output_cap_kb；
+  output_mode = file 时完整输出写入本地文件（可 gzip），hash 时只记录字节数、行数与 sha256。
+- SSH 连接统一走仓库根目录的 ssh_pool：同一主机复用已认证的 transport，通道数受 [Runner] ssh_channels 限制。
+- [Runner] cache_mode 控制每轮开始前的缓存状态（需 session_mode = per_round）：as-is 不处理；
+  cold 每轮前执行 [ServerN] restart_command 重启/刷新 PostgreSQL 并清空操作系统页缓存；
+  warm 先执行预热轮找出 SQL 访问到的表和索引（pg_statio 差值），之后每轮前用 pg_prewarm 载入 shared_buffers。
+  模式记入 meta.json 与每条结果，compare 只在相同模式之间比较。
+- [Runner] metrics_interval > 0 时在独立通道上按间隔采样服务器指标（pg_metrics：pg_stat_database/bgwriter/io/statements、
+  /proc/stat、meminfo、diskstats），原始采样写入 metrics.jsonl，并按每轮/每条语句的起止时间聚合进
+  results.json 与 round_metrics.jsonl，summary.json 的 slow_rounds 列出最慢几轮及其资源使用。
 """
 
 from __future__ import annotations
 import os
+import re
+import sys
 import json
+import math
 import time
+import random
+import shlex
+import statistics
+import sqlite3
+import threading
 import paramiko
+import sqlparse
 import configparser
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Parquet 结果输出的可选依赖
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# 仓库根目录下与 CSV2DB 共用的模块
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ssh_pool
+import sftp_upload
+import stream_capture
+import pg_metrics
 
 PSQL_ARGS = "-X -q -At -v ON_ERROR_STOP=1 -P pager=off"
+SESSION_MODES = ("per_round", "persistent")
+# 持久会话模式下每轮前后输出的标记行：__ROUND__|轮次|begin/end|epoch 秒
+ROUND_MARK = "__ROUND__"
+# 每条语句前输出的标记行：__STMT__|序号；随后的 "Time: x ms" 行即该语句耗时
+STMT_MARK = "__STMT__"
+TIMING_RE = re.compile(r"^Time: ([\d.]+) ms")
+# 传给每个远端 psql 的语言环境：psql 的 \timing 与提示信息按 LC_MESSAGES 翻译（如 zh_CN 输出 "时间："），
+# 固定为 C 才能按 TIMING_RE 解析；非终端会话的 client_encoding 不取自语言环境，不受影响
+PSQL_LOCALE_ENV = {"LC_ALL": "C"}
+# compare 的判定阈值：p 值小于 COMPARE_ALPHA 且中位数变化超过 COMPARE_MIN_CHANGE 才标记
+COMPARE_ALPHA = 0.05
+COMPARE_MIN_CHANGE = 0.05
+# 压测模式：事务开始/结束标记；结束标记带上 LAST_ERROR_SQLSTATE 判断事务是否出错
+TX_MARK = "__TX__"
+TXEND_MARK = "__TXEND__"
+# 每个客户端保持在途的事务数，使 psql 不必等待 SSH 往返即可执行下一个事务
+LOAD_PIPELINE = 2
+# 结果输出目标：remote = 远端 run 目录 results.jsonl；jsonl/parquet = 本地 ./runs/<ts>/<server>/；sqlite = 本地 ./runs/results.sqlite
+RESULT_SINKS = ("remote", "jsonl", "sqlite", "parquet")
+LOCAL_RUNS_DIR = Path("./runs")
+# 查询输出的处理方式：memory = 仅内存（受 output_cap_kb 限制）；file = 写入本地文件；hash = 只记录行数与摘要
+OUTPUT_MODES = ("memory", "file", "hash")
+# summary.json 中列出资源使用的最慢轮数
+SLOW_ROUNDS = 3
+# 每轮开始前的缓存状态：as-is = 不处理；cold = 重启数据库并清空 OS 页缓存；warm = pg_prewarm 预热访问到的关系
+CACHE_MODES = ("as-is", "cold", "warm")
+# 统计每个表/索引累计访问块数，两次快照之差即 SQL 访问到的关系
+STATIO_SQL = ("SELECT relid, coalesce(heap_blks_read,0)+coalesce(heap_blks_hit,0)+coalesce(toast_blks_read,0)"
+              "+coalesce(toast_blks_hit,0), relid::regclass FROM pg_statio_user_tables "
+              "UNION ALL SELECT indexrelid, coalesce(idx_blks_read,0)+coalesce(idx_blks_hit,0), indexrelid::regclass "
+              "FROM pg_statio_user_indexes")
 
 @dataclass
 class RunnerCfg:
@@ -44,6 +126,25 @@ class RunnerCfg:
     remote_tmp_dir: str = "/tmp"
     pre_checkpoint: bool = False
     save_local: bool = False
+    concurrency: int = 1          # 同时执行的服务器组数
+    round_barrier: bool = False   # 每轮开始前所有运行中的服务器对齐
+    session_mode: str = "per_round"  # per_round: 每轮一个 psql 进程；persistent: 所有轮次共用一个会话
+    warmup: int = 0               # 正式 repeat 之前额外执行、不计入统计的轮数
+    ssh_channels: int = ssh_pool.DEFAULT_MAX_CHANNELS  # 每台主机同时打开的 SSH 通道上限
+    result_sinks: List[str] = field(default_factory=lambda: ["remote"])  # 结果写到哪些目标
+    result_batch: int = 50        # 缓冲多少条记录写出一次；0 表示只在结束时写出
+    output_mode: str = "memory"   # memory / file / hash
+    output_compress: bool = False # output_mode = file 时写成 .gz
+    output_cap_kb: int = 1024     # stdout/stderr 各自在内存中保留的上限
+    metrics_interval: float = 0   # 服务器指标采样间隔（秒），0 表示不采样
+    metrics_pgss_top: int = 5     # 每个采样区间记录耗时最高的 pg_stat_statements 条数
+    cache_mode: str = "as-is"     # as-is / cold / warm，作用于每一轮
+    drop_caches_command: str = "sync && echo 3 | sudo -n tee /proc/sys/vm/drop_caches >/dev/null"
+    cache_ready_timeout: int = 120  # cold 模式重启后等待数据库可连接的秒数
+
+    @property
+    def rounds(self) -> int:
+        return self.warmup + self.repeat
 
 @dataclass
 class ServerCfg:
@@ -57,6 +158,17 @@ class ServerCfg:
     psql_command: str  # 基础 psql 命令行（例如：psql -d db -p 5432）
     psql_close_command: Optional[str] = None
     remote_tmp_dir: Optional[str] = None  # 可覆盖 runner.remote_tmp_dir
+    group: Optional[str] = None  # 同组串行；未配置时按 ip+pg_port+库名 自动分组
+    restart_command: Optional[str] = None  # cache_mode = cold 时每轮前执行的重启命令
+
+@dataclass
+class LoadCfg:
+    clients: List[int] = field(default_factory=lambda: [1])  # 依次测试的并发会话数（扩展曲线）
+    duration_sec: int = 60        # 每个并发级别的测量时长（不含 ramp-up）
+    transactions: int = 0         # >0 时改为每个客户端执行固定事务数
+    ramp_up_sec: int = 0          # 客户端在该时间内均匀启动
+    cooldown_sec: int = 5         # 各并发级别之间的间隔
+    workload: List[tuple] = field(default_factory=list)  # [(sql 文件, 权重)]，为空时使用服务器的 sql_file_path
 
 def choose_conf_file() -> Path:
     # 1) 环境变量优先
@@ -90,6 +202,45 @@ def read_conf(path: Path) -> tuple[RunnerCfg, List[ServerCfg]]:
         rcfg.remote_tmp_dir = g.get("remote_tmp_dir", rcfg.remote_tmp_dir)
         rcfg.pre_checkpoint = g.getboolean("pre_checkpoint", rcfg.pre_checkpoint)
         rcfg.save_local = g.getboolean("save_local", rcfg.save_local)
+        rcfg.concurrency = int(g.get("concurrency", rcfg.concurrency))
+        rcfg.round_barrier = g.getboolean("round_barrier", rcfg.round_barrier)
+        rcfg.session_mode = g.get("session_mode", rcfg.session_mode).strip().lower()
+        rcfg.warmup = int(g.get("warmup", rcfg.warmup))
+        rcfg.ssh_channels = int(g.get("ssh_channels", rcfg.ssh_channels))
+        rcfg.result_sinks = [x.strip().lower() for x in g.get("result_sinks", ",".join(rcfg.result_sinks)).split(",") if x.strip()]
+        rcfg.result_batch = int(g.get("result_batch", rcfg.result_batch))
+        rcfg.output_mode = g.get("output_mode", rcfg.output_mode).strip().lower()
+        rcfg.output_compress = g.getboolean("output_compress", rcfg.output_compress)
+        rcfg.output_cap_kb = int(g.get("output_cap_kb", rcfg.output_cap_kb))
+        rcfg.metrics_interval = float(g.get("metrics_interval", rcfg.metrics_interval))
+        rcfg.metrics_pgss_top = int(g.get("metrics_pgss_top", rcfg.metrics_pgss_top))
+        rcfg.cache_mode = g.get("cache_mode", rcfg.cache_mode).strip().lower()
+        rcfg.drop_caches_command = g.get("drop_caches_command", rcfg.drop_caches_command)
+        rcfg.cache_ready_timeout = int(g.get("cache_ready_timeout", rcfg.cache_ready_timeout))
+    if rcfg.metrics_interval < 0:
+        raise SystemExit(f"[Runner] metrics_interval 不能为负数，当前为 {rcfg.metrics_interval}")
+    if rcfg.output_mode not in OUTPUT_MODES:
+        raise SystemExit(f"[Runner] output_mode 仅支持 {', '.join(OUTPUT_MODES)}，当前为 {rcfg.output_mode}")
+    bad = [x for x in rcfg.result_sinks if x not in RESULT_SINKS]
+    if bad or not rcfg.result_sinks:
+        raise SystemExit(f"[Runner] result_sinks 仅支持 {', '.join(RESULT_SINKS)} 的组合，当前为 {rcfg.result_sinks}")
+    if "parquet" in rcfg.result_sinks and pyarrow is None:
+        raise SystemExit("[Runner] result_sinks 包含 parquet，但本地未安装 pyarrow")
+    if rcfg.result_batch < 0:
+        raise SystemExit(f"[Runner] result_batch 不能为负数，当前为 {rcfg.result_batch}")
+    if rcfg.warmup < 0:
+        raise SystemExit(f"[Runner] warmup 不能为负数，当前为 {rcfg.warmup}")
+    if rcfg.session_mode not in SESSION_MODES:
+        raise SystemExit(f"[Runner] session_mode 仅支持 {', '.join(SESSION_MODES)}，当前为 {rcfg.session_mode}")
+    if rcfg.concurrency < 1:
+        raise SystemExit(f"[Runner] concurrency 必须为正整数，当前为 {rcfg.concurrency}")
+    if rcfg.cache_mode not in CACHE_MODES:
+        raise SystemExit(f"[Runner] cache_mode 仅支持 {', '.join(CACHE_MODES)}，当前为 {rcfg.cache_mode}")
+    if rcfg.cache_mode != "as-is" and rcfg.session_mode != "per_round":
+        raise SystemExit(f"[Runner] cache_mode = {rcfg.cache_mode} 需要在每轮之间处理缓存，只能与 session_mode = per_round 同用")
+    if rcfg.cache_mode == "warm":
+        # 至少一轮预热，用来找出 SQL 访问到的关系
+        rcfg.warmup = max(rcfg.warmup, 1)
 
     servers: List[ServerCfg] = []
     for sec in cp.sections():
@@ -107,29 +258,72 @@ def read_conf(path: Path) -> tuple[RunnerCfg, List[ServerCfg]]:
             psql_command = s.get("psql_command", "psql"),
             psql_close_command = s.get("psql_close_command", None),
             remote_tmp_dir = s.get("remote_tmp_dir", None),
+            group = s.get("group", None),
+            restart_command = s.get("restart_command", None),
         ))
+        if rcfg.cache_mode == "cold" and not servers[-1].restart_command:
+            raise SystemExit(f"[Runner] cache_mode = cold 需要为 [{sec}] 配置 restart_command（例如 pg_ctl -D ... restart -m fast）")
     if not servers:
         raise SystemExit("配置文件中未找到 [Server...] 段落。请参考示例：\n[Server1]\nip=...\nport=22\nusername=...\nsql_file_path=...\npsql_command=psql -d db -p 5432")
     return rcfg, servers
 
-def ssh_connect(ip: str, port: int, username: str, password: str, timeout: int, banner_timeout: int) -> paramiko.SSHClient:
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(ip, port=port, username=username, password=password or None,
-                timeout=timeout, banner_timeout=banner_timeout)
-    return ssh
+def read_load_conf(path: Path) -> LoadCfg:
+    # [Load] 段：clients = 1,4,8,16；workload = a.sql@3, b.sql@1（与 pgbench -f file@weight 相同写法）
+    cp = configparser.ConfigParser()
+    cp.read(path, encoding="utf-8")
+    lcfg = LoadCfg()
+    if not cp.has_section("Load"):
+        return lcfg
+    g = cp["Load"]
+    try:
+        lcfg.clients = [int(x) for x in g.get("clients", "1").split(",") if x.strip()]
+    except ValueError:
+        raise SystemExit(f"[Load] clients 必须为逗号分隔的正整数，当前为 {g.get('clients')}")
+    lcfg.duration_sec = int(g.get("duration_sec", lcfg.duration_sec))
+    lcfg.transactions = int(g.get("transactions", lcfg.transactions))
+    lcfg.ramp_up_sec = int(g.get("ramp_up_sec", lcfg.ramp_up_sec))
+    lcfg.cooldown_sec = int(g.get("cooldown_sec", lcfg.cooldown_sec))
+    for item in g.get("workload", "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        path_, _, weight = item.rpartition("@") if "@" in item else (item, "", "1")
+        if not weight.isdigit() or int(weight) <= 0:
+            raise SystemExit(f"[Load] workload 权重必须为正整数: {item}")
+        lcfg.workload.append((path_.strip(), int(weight)))
+    if not lcfg.clients or min(lcfg.clients) < 1:
+        raise SystemExit(f"[Load] clients 必须为逗号分隔的正整数，当前为 {g.get('clients')}")
+    if lcfg.transactions <= 0 and lcfg.duration_sec <= 0:
+        raise SystemExit("[Load] duration_sec 与 transactions 至少有一个需大于 0")
+    return lcfg
+
+def ssh_connect(ip: str, port: int, username: str, password: str, timeout: int, banner_timeout: int,
+                max_channels: int = ssh_pool.DEFAULT_MAX_CHANNELS) -> ssh_pool.SSHPool:
+    # 返回该主机的共享连接池（用法与 SSHClient 相同），由 main() 结束时统一关闭
+    return ssh_pool.get_pool(ip, port, username, password, max_channels=max_channels,
+                             timeout=timeout, banner_timeout=banner_timeout)
 
 def sftp_write_text(sftp, remote_path: str, text: str):
     with sftp.file(remote_path, "a") as f:
         f.write(text)
 
-def run_cmd(ssh: paramiko.SSHClient, cmd: str, env: Optional[Dict[str,str]] = None, timeout: int = 1800):
+def run_cmd(ssh: paramiko.SSHClient, cmd: str, env: Optional[Dict[str,str]] = None, timeout: int = 1800,
+            out_sink=None, cap: int = stream_capture.DEFAULT_CAP):
+    # stdout/stderr 同时流式读取，返回的 out/err 各自最多 cap 字节；完整 stdout 可另交给 out_sink
     t0 = time.time()
     stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=False, environment=env, timeout=timeout)
-    out = stdout.read().decode(errors="ignore")
-    err = stderr.read().decode(errors="ignore")
-    code = stdout.channel.recv_exit_status()
-    return code, out, err, round(time.time() - t0, 3)
+    out_buf = stream_capture.CappedBuffer(cap)
+    err_buf = stream_capture.CappedBuffer(cap)
+    code = stream_capture.pump(stdout.channel, stream_capture.Tee(out_buf, out_sink), err_buf, timeout=timeout)
+    return code, out_buf.text(), err_buf.text(), round(time.time() - t0, 3)
+
+def make_output_sink(rcfg: RunnerCfg, local_dir: Path, tag: str):
+    # 按 output_mode 决定查询输出的去向；memory 模式不额外保存
+    if rcfg.output_mode == "file":
+        return stream_capture.FileSink(local_dir/"output"/f"{tag}.txt", compress=rcfg.output_compress)
+    if rcfg.output_mode == "hash":
+        return stream_capture.HashSink()
+    return None
 
 def make_remote_run_dir(base_dir: str) -> str:
     ts = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -141,16 +335,444 @@ def build_psql_cmd(psql_command: str) -> str:
         return psql_command
     return f"{psql_command} {PSQL_ARGS}"
 
-def run_server(s: ServerCfg, rcfg: RunnerCfg) -> Dict:
-    ssh = None
+def psql_env(s: ServerCfg) -> Dict[str, str]:
+    env = dict(PSQL_LOCALE_ENV)
+    if s.password:
+        env["PGPASSWORD"] = s.password
+    return env
+
+def warn_missing_timings(name: str, r: int, stmt_ms: List[Optional[float]]):
+    got = sum(ms is not None for ms in stmt_ms)
+    if got < len(stmt_ms):
+        print(f"[{name}] 警告: 第 {r} 轮只解析到 {got}/{len(stmt_ms)} 条语句耗时"
+              f"（远端 psql 的 \\timing 输出可能已被翻译，请确认 sshd 接受 LC_ALL 环境变量）")
+
+def split_statements(sql_text: str) -> List[str]:
+    # 与 excute_sql.py 一样用 sqlparse 切分；去掉只有注释的片段，并保证每条以分号结尾
+    stmts = []
+    for st in sqlparse.split(sql_text):
+        st = st.strip()
+        if not st or not sqlparse.format(st, strip_comments=True).strip():
+            continue
+        stmts.append(st if st.endswith(";") else st + ";")
+    return stmts
+
+def session_setup(rcfg: RunnerCfg) -> str:
+    return (
+        f"SET lock_timeout = '{rcfg.lock_timeout_ms}ms';\n"
+        f"SET statement_timeout = '{rcfg.stmt_timeout_ms}ms';\n"
+        f"SET idle_in_transaction_session_timeout = '5min';\n"
+        f"\\timing on\n"
+    )
+
+def build_wrapper(statements: List[str], rcfg: RunnerCfg, rounds: Optional[range] = None) -> str:
+    # 会话级超时设置 + 逐条语句（前置标记，\\timing 输出耗时）；
+    # rounds 为 None 时只执行一遍，否则在一个会话内按轮次执行并输出轮次标记
+    setup = session_setup(rcfg)
+    script = "".join(f"\\echo {STMT_MARK}|{i}\n{st}\n" for i, st in enumerate(statements, start=1))
+    if rounds is None:
+        return setup + script
+    body = []
+    for r in rounds:
+        body.append(f"SELECT '{ROUND_MARK}', {r}, 'begin', extract(epoch from clock_timestamp());\n")
+        body.append(script)
+        body.append(f"SELECT '{ROUND_MARK}', {r}, 'end', extract(epoch from clock_timestamp());\n")
+    return setup + "".join(body)
+
+class StmtTimings:
+    """逐行解析 __STMT__ 标记与其后的 \\timing 输出，收集一轮内每条语句的耗时(ms)"""
+
+    def __init__(self, n: int):
+        self.n = n
+        self._ms: Dict[int, float] = {}
+        self._cur: Optional[int] = None
+
+    def feed(self, line: str):
+        if line.startswith(STMT_MARK + "|"):
+            self._cur = int(line.strip().split("|")[1])
+            return
+        m = TIMING_RE.match(line)
+        if m and self._cur is not None:
+            self._ms[self._cur] = float(m.group(1))
+            self._cur = None
+
+    def take(self) -> List[Optional[float]]:
+        # 按语句序号返回本轮耗时（未执行到的语句为 None），并清空以便下一轮
+        out = [self._ms.get(i) for i in range(1, self.n + 1)]
+        self._ms, self._cur = {}, None
+        return out
+
+def run_session(ssh: paramiko.SSHClient, cmd: str, env: Optional[Dict[str,str]], timeout: int,
+                n_stmts: int, on_round, out_sink=None, cap: int = stream_capture.DEFAULT_CAP):
+    """
+    执行一个持久 psql 会话并流式逐行解析输出，每读到一轮的 end 标记即回调 on_round(round, elapsed_sec, stmt_ms)。
+    返回 (exit_code, stderr, 已开始但未结束的轮次或 None, 该轮开始后的本地耗时, 该轮已完成语句的耗时)。
+    """
+    stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=False, environment=env, timeout=timeout)
+    timer = StmtTimings(n_stmts)
+    state = {"round": None, "ts": 0.0, "local": 0.0}
+
+    def on_line(line: str):
+        if not line.startswith(ROUND_MARK + "|"):
+            timer.feed(line)
+            return
+        _, r, kind, ts = line.strip().split("|")
+        if kind == "begin":
+            state.update(round=int(r), ts=float(ts), local=time.time())
+            timer.take()
+        else:
+            on_round(int(r), round(float(ts) - state["ts"], 3), timer.take())
+            state["round"] = None
+
+    err_buf = stream_capture.CappedBuffer(cap)
+    code = stream_capture.pump(stdout.channel, stream_capture.Tee(stream_capture.LineSink(on_line), out_sink),
+                               err_buf, timeout=timeout)
+    open_round = state["round"]
+    return (code, err_buf.text(), open_round,
+            round(time.time() - state["local"], 3) if open_round else 0.0, timer.take())
+
+def psql_dbname(psql_command: str) -> str:
+    # 从 psql 命令中解析库名：-d db / --dbname=db / 末尾的位置参数；未指定时为空（即默认库）
+    try:
+        args = shlex.split(psql_command)[1:]
+    except ValueError:
+        args = psql_command.split()[1:]
+    positional = []
+    i = 0
+    while i < len(args):
+        a = args[i]
+        if a in ("-d", "--dbname") and i + 1 < len(args):
+            return args[i + 1]
+        if a.startswith("--dbname="):
+            return a.split("=", 1)[1]
+        if re.fullmatch(r"-d\S+", a):
+            return a[2:]
+        if a in ("-h", "-p", "-U", "--host", "--port", "--username", "-f", "-c", "-v"):
+            i += 2
+            continue
+        if not a.startswith("-"):
+            positional.append(a)
+        i += 1
+    return positional[0] if positional else ""
+
+def server_group(s: ServerCfg) -> str:
+    # 显式 group 优先；否则同一 ip+pg_port+库名 视为同库，需要串行（DDL 脚本会互相干扰）
+    if s.group:
+        return s.group
+    return f"{s.ip}:{s.pg_port}/{psql_dbname(s.psql_command)}"
+
+class RoundBarrier:
+    """
+    动态成员的轮次屏障：服务器开始执行时 register，结束（含失败）时 deregister。
+    arrive(name, r) 会阻塞到所有已注册成员都到达第 r 轮（或更后）为止；
+    后加入的成员从第 1 轮开始，已在等待的成员会等它追上，因此不会死锁。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._arrived: Dict[str, int] = {}
+
+    def register(self, name: str):
+        with self._cond:
+            self._arrived[name] = 0
+            self._cond.notify_all()
+
+    def deregister(self, name: str):
+        with self._cond:
+            self._arrived.pop(name, None)
+            self._cond.notify_all()
+
+    def arrive(self, name: str, r: int):
+        with self._cond:
+            self._arrived[name] = r
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: all(v >= r for v in self._arrived.values()))
+
+# ——————— 缓存控制 ———————
+class CacheControl:
+    """
+    每轮开始前把缓存置于 rcfg.cache_mode 指定的状态，返回准备耗时（秒）。
+    cold：执行 restart_command，清空 OS 页缓存，等待数据库重新可连接；
+    warm：第 1 轮（预热轮）前后各取一次 pg_statio 快照，差值即访问到的表/索引，之后每轮前对它们执行 pg_prewarm。
+    """
+
+    def __init__(self, ssh, s: ServerCfg, rcfg: RunnerCfg, env: Optional[Dict[str,str]]):
+        self.ssh = ssh
+        self.s = s
+        self.rcfg = rcfg
+        self.env = env
+        self.psql = build_psql_cmd(s.psql_command)
+        self._before: Optional[Dict[str, int]] = None
+        self.touched: Optional[List[tuple]] = None  # [(oid, 名称)]
+
+    def _sql(self, sql: str, timeout: int = 600) -> str:
+        code, out, err, _ = run_cmd(self.ssh, f"{self.psql} -c {shlex.quote(sql)}", env=self.env, timeout=timeout)
+        if code != 0:
+            raise RuntimeError(f"缓存控制 SQL 执行失败: {err[:500]}")
+        return out
+
+    def _statio(self) -> Dict[str, tuple]:
+        snap = {}
+        for line in self._sql(STATIO_SQL).splitlines():
+            parts = line.split("|")
+            if len(parts) == 3:
+                snap[parts[0]] = (int(parts[1]), parts[2])
+        return snap
+
+    def _cold(self):
+        code, _, err, _ = run_cmd(self.ssh, self.s.restart_command, timeout=self.rcfg.cache_ready_timeout)
+        if code != 0:
+            raise RuntimeError(f"restart_command 执行失败: {err[:500]}")
+        code, _, err, _ = run_cmd(self.ssh, self.rcfg.drop_caches_command, timeout=120)
+        if code != 0:
+            raise RuntimeError(f"清空页缓存失败（需要 root 或免密 sudo）: {err[:500]}")
+        deadline = time.time() + self.rcfg.cache_ready_timeout
+        while True:
+            code, _, err, _ = run_cmd(self.ssh, f'{self.psql} -c "SELECT 1"', env=self.env, timeout=30)
+            if code == 0:
+                return
+            if time.time() > deadline:
+                raise RuntimeError(f"重启后 {self.rcfg.cache_ready_timeout}s 内数据库仍不可连接: {err[:500]}")
+            time.sleep(1)
+
+    def _warm(self, r: int):
+        if r == 1:
+            self._sql("CREATE EXTENSION IF NOT EXISTS pg_prewarm")
+            self._before = self._statio()
+            return
+        if self.touched is None:
+            after = self._statio()
+            self.touched = [(oid, name) for oid, (blks, name) in after.items()
+                            if blks > self._before.get(oid, (0, name))[0]]
+            print(f"[{self.s.name}] 预热关系 {len(self.touched)} 个: {', '.join(n for _, n in self.touched[:10])}")
+        if self.touched:
+            oids = ",".join(oid for oid, _ in self.touched)
+            self._sql(f"SELECT sum(pg_prewarm(o)) FROM unnest(ARRAY[{oids}]::oid[]) AS o",
+                      timeout=self.rcfg.stmt_timeout_ms // 1000 + 60)
+
+    def prepare(self, r: int) -> float:
+        t0 = time.time()
+        if self.rcfg.cache_mode == "cold":
+            self._cold()
+        elif self.rcfg.cache_mode == "warm":
+            self._warm(r)
+        return round(time.time() - t0, 3)
+
+# ——————— 结果输出 ———————
+class RemoteJsonlTarget:
+    # 远端 run 目录下的 results.jsonl，一批记录只打开一次文件
+    def __init__(self, sftp, run_dir: str):
+        self.sftp = sftp
+        self.path = f"{run_dir}/results.jsonl"
+
+    def write_batch(self, recs: List[Dict]):
+        sftp_write_text(self.sftp, self.path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs))
+
+    def close(self):
+        pass
+
+class LocalJsonlTarget:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+
+    def write_batch(self, recs: List[Dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in recs)
+
+    def close(self):
+        pass
+
+class SqliteTarget:
+    # 所有服务器、所有运行写入同一个库，按 server + remote_dir 区分
+    def __init__(self, path: Path, server: str, remote_dir: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.server = server
+        self.remote_dir = remote_dir
+        self.conn = sqlite3.connect(str(path), timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (server TEXT, remote_dir TEXT, round INTEGER, attempt INTEGER,"
+            " exit INTEGER, elapsed_sec REAL, warmup INTEGER, stderr TEXT, stmt_ms TEXT, record TEXT)"
+        )
+        self.conn.commit()
+
+    def write_batch(self, recs: List[Dict]):
+        self.conn.executemany(
+            "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.server, self.remote_dir, r.get("round"), r.get("attempt"), r.get("exit"), r.get("elapsed_sec"),
+              int(bool(r.get("warmup"))), r.get("stderr"), json.dumps(r.get("stmt_ms")),
+              json.dumps(r, ensure_ascii=False)) for r in recs]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class ParquetTarget:
+    # Parquet 不便追加，记录在内存中累积，关闭时一次写出
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.recs: List[Dict] = []
+
+    def write_batch(self, recs: List[Dict]):
+        self.recs.extend(recs)
+
+    def close(self):
+        if self.recs:
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(self.recs), str(self.path))
+
+class ResultSink:
+    """
+    每轮记录先放入本地缓冲，满 batch 条或关闭时再写到各目标，测量循环内不再有 SFTP 往返。
+    batch 为 0 时只在关闭时写出。
+    """
+
+    def __init__(self, targets: list, batch: int):
+        self.targets = targets
+        self.batch = batch
+        self.buf: List[Dict] = []
+
+    def write(self, rec: Dict):
+        self.buf.append(rec)
+        if self.batch and len(self.buf) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.buf:
+            return
+        recs, self.buf = self.buf, []
+        for t in self.targets:
+            t.write_batch(recs)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for t in self.targets:
+                t.close()
+
+def make_sink(rcfg: RunnerCfg, sftp, run_dir: str, server: str, local_dir: Path) -> ResultSink:
+    targets = []
+    for kind in rcfg.result_sinks:
+        if kind == "remote":
+            targets.append(RemoteJsonlTarget(sftp, run_dir))
+        elif kind == "jsonl":
+            targets.append(LocalJsonlTarget(local_dir/"results.jsonl"))
+        elif kind == "sqlite":
+            targets.append(SqliteTarget(LOCAL_RUNS_DIR/"results.sqlite", server, run_dir))
+        elif kind == "parquet":
+            targets.append(ParquetTarget(local_dir/"results.parquet"))
+    return ResultSink(targets, rcfg.result_batch)
+
+def record_result(sink: ResultSink, results: List[Dict], rec: Dict):
+    results.append(rec)
+    sink.write(rec)
+
+def run_persistent(ssh, sftp, s: ServerCfg, rcfg: RunnerCfg, run_dir: str, statements: List[str],
+                   env: Optional[Dict[str,str]], results: List[Dict], sink: ResultSink,
+                   barrier: Optional[RoundBarrier], local_dir: Path) -> List[Dict]:
+    """
+    所有轮次在同一 psql 会话内执行；某轮失败时，从失败的那一轮起生成新的 wrapper 重新连接，
+    每轮的重试次数与 per_round 模式一致（超过 retry 即失败）。
+    返回各次会话的输出摘要（output_mode 为 file/hash 时）。
+    """
+    attempts: Dict[int, int] = {}
+    outputs: List[Dict] = []
+    start = 1
+    while start <= rcfg.rounds:
+        wrapper = f"{run_dir}/wrapper_r{start}.sql"
+        with sftp.file(wrapper, "w") as fh:
+            fh.write(build_wrapper(statements, rcfg, range(start, rcfg.rounds + 1)))
+        psql_cmd = build_psql_cmd(s.psql_command) + f' --file="{wrapper}"'
+        if barrier and start == 1:
+            # 会话内无法暂停，屏障只对齐首个会话的开始；其他服务器在各自会话内不会再 arrive，
+            # 重试会话若按第 start 轮等待会一直卡到它们结束，因此不再对齐
+            barrier.arrive(s.name, start)
+
+        def on_round(r: int, sec: float, stmt_ms: List[Optional[float]]):
+            nonlocal start
+            attempts[r] = attempts.get(r, 0) + 1
+            ended = time.time()
+            record_result(sink, results, {"round": r, "attempt": attempts[r], "exit": 0,
+                                          "elapsed_sec": sec, "stderr": "",
+                                          "warmup": r <= rcfg.warmup, "stmt_ms": stmt_ms,
+                                          "started_at": round(ended - sec, 3), "ended_at": round(ended, 3),
+                                          "cache_mode": rcfg.cache_mode})
+            warn_missing_timings(s.name, r, stmt_ms)
+            start = r + 1
+
+        out_sink = make_output_sink(rcfg, local_dir, f"session_r{start}")
+        session_start = start
+        code, err, failed, sec, stmt_ms = run_session(ssh, psql_cmd, env, rcfg.stmt_timeout_ms//1000 + 60,
+                                                      len(statements), on_round, out_sink, rcfg.output_cap_kb * 1024)
+        if out_sink:
+            outputs.append({"from_round": session_start, **out_sink.summary()})
+        if code == 0 and start > rcfg.rounds:
+            break
+        # 会话在第一轮标记前就失败（如连接失败）时，记为 start 这一轮失败
+        r = failed or start
+        attempts[r] = attempts.get(r, 0) + 1
+        ended = time.time()
+        record_result(sink, results, {"round": r, "attempt": attempts[r], "exit": code,
+                                      "elapsed_sec": sec, "stderr": (err or "")[:4000],
+                                      "warmup": r <= rcfg.warmup, "stmt_ms": stmt_ms,
+                                      "started_at": round(ended - sec, 3), "ended_at": round(ended, 3),
+                                      "cache_mode": rcfg.cache_mode})
+        if attempts[r] > rcfg.retry:
+            raise RuntimeError(f"psql failed after {attempts[r]} attempts (round {r}): {err[:500]}")
+        time.sleep(min(2*attempts[r], 10))
+        start = r
+    return outputs
+
+def attach_metrics(sampler: pg_metrics.MetricsSampler, results: List[Dict], interval: float):
+    """
+    把采样按时间窗口聚合到每轮（metrics）与每条语句（stmt_metrics）。
+    语句在轮内顺序执行，窗口按 stmt_ms 累加推算；短于一个采样间隔的语句无法分辨，记为 None。
+    """
+    missing = []
+    for rec in results:
+        if "started_at" not in rec:
+            continue
+        rec["metrics"] = sampler.window(rec["started_at"], rec["ended_at"])
+        if rec["metrics"] is None or not any(k.startswith("pg_") for k in rec["metrics"]):
+            missing.append(rec["round"])
+        t = rec["started_at"]
+        per_stmt = []
+        for ms in rec.get("stmt_ms") or []:
+            if ms is None:
+                per_stmt.append(None)
+                continue
+            sec = ms / 1000
+            per_stmt.append(sampler.window(t, t + sec) if sec >= interval else None)
+            t += sec
+        rec["stmt_metrics"] = per_stmt
+    if missing:
+        print(f"[metrics] 警告: {len(missing)} 轮没有 pg_stat_* 采样（轮次 {', '.join(map(str, missing[:20]))}"
+              f"{' ...' if len(missing) > 20 else ''}），可能短于采样间隔或采样会话已断开")
+
+def slow_rounds(results: List[Dict], n: int = SLOW_ROUNDS) -> List[Dict]:
+    recs = sorted(measured(results), key=lambda r: r["elapsed_sec"], reverse=True)[:n]
+    return [{"round": r["round"], "elapsed_sec": r["elapsed_sec"], "metrics": r.get("metrics")} for r in recs]
+
+def run_server(s: ServerCfg, rcfg: RunnerCfg, barrier: Optional[RoundBarrier] = None) -> Dict:
+    sftp = None
+    sink = None
+    sampler = None
+    local_dir = LOCAL_RUNS_DIR / datetime.now().strftime("%Y%m%d-%H%M%S") / s.name
+    if barrier:
+        barrier.register(s.name)
     meta = {
         "server": s.name, "ip": s.ip, "ssh_port": s.ssh_port, "username": s.username,
         "pg_port": s.pg_port, "sql_file_path": s.sql_file_path,
-        "psql_command": s.psql_command, "repeat": rcfg.repeat, "retry": rcfg.retry,
-        "stmt_timeout_ms": rcfg.stmt_timeout_ms, "lock_timeout_ms": rcfg.lock_timeout_ms
+        "psql_command": s.psql_command, "repeat": rcfg.repeat, "warmup": rcfg.warmup, "retry": rcfg.retry,
+        "stmt_timeout_ms": rcfg.stmt_timeout_ms, "lock_timeout_ms": rcfg.lock_timeout_ms,
+        "session_mode": rcfg.session_mode, "metrics_interval": rcfg.metrics_interval,
+        "cache_mode": rcfg.cache_mode
     }
     try:
-        ssh = ssh_connect(s.ip, s.ssh_port, s.username, s.password, rcfg.ssh_timeout, rcfg.banner_timeout)
+        ssh = ssh_connect(s.ip, s.ssh_port, s.username, s.password, rcfg.ssh_timeout, rcfg.banner_timeout,
+                          rcfg.ssh_channels)
         sftp = ssh.open_sftp()
         run_dir = make_remote_run_dir(s.remote_tmp_dir or rcfg.remote_tmp_dir)
         try: sftp.mkdir(run_dir)
@@ -163,46 +785,95 @@ def run_server(s: ServerCfg, rcfg: RunnerCfg) -> Dict:
             sql_local.parent.mkdir(parents=True, exist_ok=True)
             sql_local.write_text("-- demo sql\nSELECT 1;\n", encoding="utf-8")
 
-        # 上传 SQL 与生成 wrapper（注入超时）
+        # 上传 SQL 与生成 wrapper（注入超时，语句逐条内联以便计时）
         remote_sql = f"{run_dir}/{sql_local.name}"
-        sftp.put(str(sql_local), remote_sql)
+        sftp_upload.upload(ssh, sql_local, remote_sql, skip_same=False)
+        statements = split_statements(sql_local.read_text(encoding="utf-8"))
+        with sftp.file(f"{run_dir}/statements.json", "w") as fh:
+            fh.write(json.dumps(statements, ensure_ascii=False, indent=2))
 
         wrapper = f"{run_dir}/wrapper.sql"
-        setup = (
-            f"SET lock_timeout = '{rcfg.lock_timeout_ms}ms';\n"
-            f"SET statement_timeout = '{rcfg.stmt_timeout_ms}ms';\n"
-            f"SET idle_in_transaction_session_timeout = '5min';\n"
-            f"\\i {remote_sql}\n"
-        )
         with sftp.file(wrapper, "w") as fh:
-            fh.write(setup)
+            fh.write(build_wrapper(statements, rcfg))
 
         # 批次开始前可选 CHECKPOINT
         if rcfg.pre_checkpoint:
             ck = build_psql_cmd(s.psql_command) + ' -c "CHECKPOINT"'
-            run_cmd(ssh, ck, env={"PGPASSWORD": s.password} if s.password else None, timeout=120)
+            run_cmd(ssh, ck, env=psql_env(s), timeout=120)
 
         # 执行 repeat 次
         results = []
-        psql_cmd = build_psql_cmd(s.psql_command) + f' --file="{wrapper}"'
-        for r in range(1, rcfg.repeat + 1):
-            attempts = 0
-            while True:
-                attempts += 1
-                code, out, err, sec = run_cmd(ssh, psql_cmd,
-                                              env={"PGPASSWORD": s.password} if s.password else None,
-                                              timeout=rcfg.stmt_timeout_ms//1000 + 60)
-                rec = {"round": r, "attempt": attempts, "exit": code, "elapsed_sec": sec, "stderr": (err or "")[:4000]}
-                results.append(rec)
-                sftp_write_text(sftp, f"{run_dir}/results.jsonl", json.dumps(rec, ensure_ascii=False) + "\n")
-                if code == 0: break
-                if attempts > rcfg.retry:
-                    raise RuntimeError(f"psql failed after {attempts} attempts (round {r}): {err[:500]}")
-                time.sleep(min(2*attempts, 10))
-
-        # 写元数据
+        sink = make_sink(rcfg, sftp, run_dir, s.name, local_dir)
+        env = psql_env(s)
+        if rcfg.metrics_interval > 0:
+            sampler = pg_metrics.MetricsSampler(ssh, build_psql_cmd(s.psql_command), env,
+                                                rcfg.metrics_interval, rcfg.metrics_pgss_top)
+            sampler.start()
+        if rcfg.session_mode == "persistent":
+            outputs = run_persistent(ssh, sftp, s, rcfg, run_dir, statements, env, results, sink, barrier, local_dir)
+            if outputs:
+                meta["session_outputs"] = outputs
+        else:
+            psql_cmd = build_psql_cmd(s.psql_command) + f' --file="{wrapper}"'
+            cache = CacheControl(ssh, s, rcfg, env)
+            for r in range(1, rcfg.rounds + 1):
+                # 先准备缓存再对齐，使各服务器同时开始计时
+                prep_sec = cache.prepare(r)
+                if sampler and rcfg.cache_mode == "cold":
+                    # 重启断开了采样用的 psql \watch 会话，重新建立后本轮才有 pg_stat_* 指标
+                    sampler.restart_pg()
+                if barrier:
+                    barrier.arrive(s.name, r)
+                attempts = 0
+                while True:
+                    attempts += 1
+                    # 语句耗时在读取时逐行解析，完整输出按 output_mode 另行保存
+                    timer = StmtTimings(len(statements))
+                    out_sink = make_output_sink(rcfg, local_dir, f"round{r}_a{attempts}")
+                    code, out, err, sec = run_cmd(ssh, psql_cmd, env=env,
+                                                  timeout=rcfg.stmt_timeout_ms//1000 + 60,
+                                                  out_sink=stream_capture.Tee(stream_capture.LineSink(timer.feed), out_sink),
+                                                  cap=rcfg.output_cap_kb * 1024)
+                    ended = time.time()
+                    rec = {"round": r, "attempt": attempts, "exit": code, "elapsed_sec": sec, "stderr": (err or "")[:4000],
+                           "warmup": r <= rcfg.warmup, "stmt_ms": timer.take(),
+                           "started_at": round(ended - sec, 3), "ended_at": round(ended, 3),
+                           "cache_mode": rcfg.cache_mode, "cache_prep_sec": prep_sec}
+                    if out_sink:
+                        rec["output"] = out_sink.summary()
+                    record_result(sink, results, rec)
+                    if code == 0:
+                        warn_missing_timings(s.name, r, rec["stmt_ms"])
+                        break
+                    if attempts > rcfg.retry:
+                        raise RuntimeError(f"psql failed after {attempts} attempts (round {r}): {err[:500]}")
+                    time.sleep(min(2*attempts, 10))
+
+        # 写出剩余的缓冲记录，再写元数据与统计摘要
+        sink.close()
+        sink = None
+        samples = None
+        if sampler:
+            # 多等一个间隔，使最后一轮之后的采样也能到达
+            time.sleep(rcfg.metrics_interval)
+            samples = sampler.stop()
+            attach_metrics(sampler, results, rcfg.metrics_interval)
+            round_metrics = [{k: rec.get(k) for k in ("round", "attempt", "started_at", "ended_at", "elapsed_sec",
+                                                      "metrics", "stmt_metrics")} for rec in results]
+            with sftp.file(f"{run_dir}/metrics.jsonl", "w") as fh:
+                fh.write("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in samples))
+            with sftp.file(f"{run_dir}/round_metrics.jsonl", "w") as fh:
+                fh.write("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in round_metrics))
+        if rcfg.session_mode == "per_round" and cache.touched is not None:
+            meta["prewarmed"] = [name for _, name in cache.touched]
         with sftp.file(f"{run_dir}/meta.json", "w") as fh:
             fh.write(json.dumps(meta, ensure_ascii=False, indent=2))
+        summary = summarize(results, statements)
+        if sampler:
+            summary["slow_rounds"] = slow_rounds(results)
+        with sftp.file(f"{run_dir}/summary.json", "w") as fh:
+            fh.write(json.dumps(summary, ensure_ascii=False, indent=2))
+        print_summary(s.name, summary)
 
         # 可选停库（若配置提供了 close 命令）
         if s.psql_close_command:
@@ -210,37 +881,391 @@ def run_server(s: ServerCfg, rcfg: RunnerCfg) -> Dict:
 
         # 可选本地保存摘要
         if rcfg.save_local:
-            ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-            ldir = Path(f"./runs/{ts}/{s.name}")
+            ldir = local_dir
             ldir.mkdir(parents=True, exist_ok=True)
             (ldir/"meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
             (ldir/"results.json").write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+            (ldir/"statements.json").write_text(json.dumps(statements, ensure_ascii=False, indent=2), encoding="utf-8")
+            (ldir/"summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+            if samples is not None:
+                (ldir/"metrics.jsonl").write_text("".join(json.dumps(x, ensure_ascii=False) + "\n" for x in samples),
+                                                  encoding="utf-8")
 
-        return {"server": s.name, "remote_dir": run_dir, "results_n": len(results)}
+        return {"server": s.name, "remote_dir": run_dir, "results_n": len(results),
+                "round_median_sec": summary["rounds"].get("median")}
 
     except Exception as e:
         return {"server": s.name, "error": str(e)}
     finally:
+        if barrier:
+            barrier.deregister(s.name)
+        if sampler:
+            sampler.stop()
         try:
-            if ssh: ssh.close()
+            # 出错时也写出已缓冲的记录
+            if sink: sink.close()
+        except Exception as e:
+            print(f"[{s.name}] 写出结果失败: {e}")
+        try:
+            if sftp: sftp.close()
         except Exception:
             pass
 
-def main():
-    conf = choose_conf_file()
-    print(f"[runner] use config: {conf}")
-    rcfg, servers = read_conf(conf)
-    # 顺序执行（如需并发可自行改为线程池；DDL 建议同库串行）
-    all_res = []
-    for s in servers:
+# ——————— 统计 ———————
+def percentile(sorted_vals: List[float], q: float) -> float:
+    # 线性插值分位数，sorted_vals 需已排序且非空
+    pos = (len(sorted_vals) - 1) * q
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+def describe(values: List[float]) -> Dict:
+    v = sorted(values)
+    if not v:
+        return {"n": 0}
+    mean = statistics.fmean(v)
+    sd = statistics.stdev(v) if len(v) > 1 else 0.0
+    return {"n": len(v), "min": v[0], "median": statistics.median(v), "p95": percentile(v, 0.95),
+            "p99": percentile(v, 0.99), "mean": round(mean, 3), "stddev": round(sd, 3),
+            "cv": round(sd / mean, 4) if mean else None}
+
+def measured(results: List[Dict]) -> List[Dict]:
+    # 只统计成功且非预热的轮次
+    return [r for r in results if r.get("exit") == 0 and not r.get("warmup")]
+
+def cache_mode_of(results: List[Dict]) -> str:
+    # 早于 cache_mode 的结果没有该字段，视为 as-is
+    modes = sorted({r.get("cache_mode", "as-is") for r in results})
+    return ",".join(modes) or "as-is"
+
+def summarize(results: List[Dict], statements: List[str]) -> Dict:
+    recs = measured(results)
+    per_stmt = []
+    for i, st in enumerate(statements):
+        vals = [r["stmt_ms"][i] for r in recs if len(r.get("stmt_ms") or []) > i and r["stmt_ms"][i] is not None]
+        per_stmt.append({"stmt": i + 1, "sql": st[:200], **describe(vals)})
+    return {"cache_mode": cache_mode_of(results), "rounds": describe([r["elapsed_sec"] for r in recs]),
+            "statements": per_stmt}
+
+def print_summary(name: str, summary: Dict):
+    rd = summary["rounds"]
+    if rd["n"]:
+        print(f"[{name}] rounds n={rd['n']} median={rd['median']:.3f}s p95={rd['p95']:.3f}s cv={rd['cv']}")
+    for st in summary["statements"]:
+        if st["n"]:
+            print(f"[{name}]   #{st['stmt']:<3} median={st['median']:.3f}ms p95={st['p95']:.3f}ms "
+                  f"p99={st['p99']:.3f}ms cv={st['cv']}  {st['sql'][:60]!r}")
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """双侧 Mann-Whitney U 检验的 p 值（正态近似，含并列秩修正与连续性修正）"""
+    n1, n2 = len(a), len(b)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    pooled = sorted([(x, 0) for x in a] + [(x, 1) for x in b])
+    n = n1 + n2
+    r1 = 0.0
+    ties = 0.0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        avg_rank = (i + j) / 2 + 1
+        t = j - i + 1
+        ties += t ** 3 - t
+        r1 += avg_rank * sum(1 for k in range(i, j + 1) if pooled[k][1] == 0)
+        i = j + 1
+    u1 = r1 - n1 * (n1 + 1) / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = max(abs(u1 - n1 * n2 / 2) - 0.5, 0) / sigma
+    return math.erfc(z / math.sqrt(2))
+
+def load_run_dir(path: Path) -> Dict[str, tuple]:
+    """
+    读取一个运行目录，返回 {服务器名: (results, statements)}。
+    支持单个服务器目录（本地 ./runs/<ts>/<server> 或下载回来的远端 run_<ts>，含 results.json 或 results.jsonl），
+    也支持包含多个服务器子目录的 ./runs/<ts>。
+    """
+    def load_one(d: Path):
+        if (d/"results.json").exists():
+            results = json.loads((d/"results.json").read_text(encoding="utf-8"))
+        elif (d/"results.jsonl").exists():
+            results = [json.loads(l) for l in (d/"results.jsonl").read_text(encoding="utf-8").splitlines() if l.strip()]
+        else:
+            return None
+        stmts = json.loads((d/"statements.json").read_text(encoding="utf-8")) if (d/"statements.json").exists() else []
+        name = d.name
+        if (d/"meta.json").exists():
+            name = json.loads((d/"meta.json").read_text(encoding="utf-8")).get("server", name)
+        return name, (results, stmts)
+
+    one = load_one(path)
+    if one:
+        return {one[0]: one[1]}
+    runs = dict(filter(None, (load_one(d) for d in sorted(path.iterdir()) if d.is_dir())))
+    if not runs:
+        raise SystemExit(f"目录中未找到 results.json / results.jsonl: {path}")
+    return runs
+
+def compare_runs(dir_a: str, dir_b: str) -> int:
+    """逐服务器、逐语句比较 A（基线）与 B；返回显著变慢的语句数"""
+    runs_a, runs_b = load_run_dir(Path(dir_a)), load_run_dir(Path(dir_b))
+    # 单服务器目录之间直接比较，不要求服务器名一致
+    if len(runs_a) == 1 and len(runs_b) == 1:
+        pairs = [(f"{next(iter(runs_a))} vs {next(iter(runs_b))}", next(iter(runs_a.values())), next(iter(runs_b.values())))]
+    else:
+        pairs = [(name, runs_a[name], runs_b[name]) for name in runs_a if name in runs_b]
+    regressions = 0
+    for name, (res_a, st_a), (res_b, st_b) in pairs:
+        # 不同缓存模式的耗时不可比，只比较两边都有的模式
+        mode_a, mode_b = cache_mode_of(res_a), cache_mode_of(res_b)
+        if mode_a != mode_b:
+            print(f"[{name}] 跳过：缓存模式不同（A={mode_a}, B={mode_b}）")
+            continue
+        rec_a, rec_b = measured(res_a), measured(res_b)
+        n_stmts = max([len(r.get("stmt_ms") or []) for r in rec_a + rec_b] or [0])
+        print(f"== {name} [{mode_a}]: A n={len(rec_a)} rounds, B n={len(rec_b)} rounds")
+        if st_a and st_b and st_a != st_b:
+            print(f"[{name}] 警告：两次运行的 SQL 语句不一致，按序号对比")
+        rows = [("round", [r["elapsed_sec"] * 1000 for r in rec_a], [r["elapsed_sec"] * 1000 for r in rec_b], "")]
+        for i in range(n_stmts):
+            va = [r["stmt_ms"][i] for r in rec_a if len(r.get("stmt_ms") or []) > i and r["stmt_ms"][i] is not None]
+            vb = [r["stmt_ms"][i] for r in rec_b if len(r.get("stmt_ms") or []) > i and r["stmt_ms"][i] is not None]
+            sql = (st_b or st_a)[i][:60] if i < len(st_b or st_a) else ""
+            rows.append((f"#{i + 1}", va, vb, sql))
+        for label, va, vb, sql in rows:
+            if not va or not vb:
+                continue
+            ma, mb = statistics.median(va), statistics.median(vb)
+            change = (mb - ma) / ma if ma else 0.0
+            p = mann_whitney_p(va, vb)
+            flag = ""
+            if p < COMPARE_ALPHA and change > COMPARE_MIN_CHANGE:
+                flag = "REGRESSION"
+                regressions += 1
+            elif p < COMPARE_ALPHA and change < -COMPARE_MIN_CHANGE:
+                flag = "improved"
+            print(f"  {label:<6} A={ma:10.3f}ms B={mb:10.3f}ms {change:+7.1%} p={p:.4f} {flag:<10} {sql!r}")
+    print(f"[compare] 显著变慢的语句数: {regressions}")
+    return regressions
+
+# ——————— 并发压测 ———————
+def load_client(ssh: paramiko.SSHClient, cmd: str, env: Optional[Dict[str,str]], setup: str,
+                txs: List[str], weights: List[int], seed: int, start_at: float, stop_at: float,
+                tx_limit: int, timeout: int) -> tuple:
+    """
+    单个压测客户端：一个常驻 psql 从 stdin 读取事务，按权重随机抽取事务脚本，保持 LOAD_PIPELINE 个事务在途。
+    事务延迟为其各语句 \\timing 之和（psql 端测得，不含 SSH 往返）。
+    返回 ([(完成时刻, 延迟ms, 是否成功)], 错误信息或 None)。会话中途断开（连接被重置、后端被杀）时不抛出：
+    已完成的事务照常返回，已发送未完成的事务记为失败，并返回错误信息。
+    """
+    time.sleep(max(0.0, start_at - time.time()))
+    rng = random.Random(seed)
+    sent = 0
+    done = []
+    error = None
+    stdin = None
+
+    def more() -> bool:
+        return sent < tx_limit if tx_limit else time.time() < stop_at
+
+    def send():
+        nonlocal sent
+        sent += 1
+        stdin.write(f"\\set LAST_ERROR_SQLSTATE 00000\n\\echo {TX_MARK}|{sent}\n"
+                    f"{rng.choices(txs, weights)[0]}"
+                    f"\\echo {TXEND_MARK}|{sent}|:LAST_ERROR_SQLSTATE\n")
+        stdin.flush()
+
+    try:
+        stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=False, environment=env, timeout=timeout)
+        # 错误信息并入 stdout，避免 stderr 缓冲写满阻塞 psql
+        stdout.channel.set_combine_stderr(True)
+        stdin.write(setup)
+        for _ in range(LOAD_PIPELINE):
+            if more():
+                send()
+        ms = 0.0
+        if sent:
+            for line in stdout:
+                m = TIMING_RE.match(line)
+                if m:
+                    ms += float(m.group(1))
+                elif line.startswith(TX_MARK + "|"):
+                    ms = 0.0
+                elif line.startswith(TXEND_MARK + "|"):
+                    _, seq, state = line.strip().split("|")
+                    done.append((time.time(), round(ms, 3), state == "00000"))
+                    if more():
+                        send()
+                    elif int(seq) == sent:
+                        break
+        if len(done) < sent:
+            # 输出提前结束：psql 已退出（如连接丢失），不再等待剩余事务
+            error = f"psql 会话提前结束（退出码 {stdout.channel.recv_exit_status()}）"
+        else:
+            stdin.write("\\q\n")
+            stdin.flush()
+            stdin.channel.shutdown_write()
+            stdout.channel.recv_exit_status()
+    except (OSError, EOFError, paramiko.SSHException) as e:
+        error = f"{type(e).__name__}: {e}"
+    if error:
+        if stdin is not None:
+            stdin.channel.close()
+        now = time.time()
+        done.extend((now, 0.0, False) for _ in range(sent - len(done)))
+    return done, error
+
+def run_load_level(ssh: ssh_pool.SSHPool, cmd: str, env: Optional[Dict[str,str]], setup: str,
+                   txs: List[str], weights: List[int], k: int, lcfg: LoadCfg, timeout: int) -> Dict:
+    """
+    以 k 个并发客户端运行一个级别；时长模式只统计 ramp-up 结束后测量窗口内完成的事务，
+    事务数模式的窗口从第一个事务开始（有 ramp-up 时从其结束）到最后一个事务完成，只统计窗口内完成的事务
+    """
+    t0 = time.time() + 1
+    ramp_end = t0 + lcfg.ramp_up_sec
+    stop_at = ramp_end + lcfg.duration_sec
+    with ThreadPoolExecutor(max_workers=k) as pool:
+        futs = [pool.submit(load_client, ssh, cmd, env, setup, txs, weights,
+                            k * 1000 + i, t0 + lcfg.ramp_up_sec * i / k, stop_at, lcfg.transactions, timeout)
+                for i in range(k)]
+        outcomes = [f.result() for f in futs]
+    samples = [x for done, _ in outcomes for x in done]
+    # 单个客户端断开只影响它自己，其余客户端照常跑完本级别
+    client_errors = [err for _, err in outcomes if err]
+    for err in client_errors[:5]:
+        print(f"[load] clients={k} 有客户端中途断开: {err}")
+    if lcfg.transactions:
+        # 从第一个事务开始执行（有 ramp-up 时不早于其结束）到最后一个事务完成，不计连接与爬坡阶段；
+        # 事务开始时刻按 完成时刻 - 延迟 估算
+        begin = min([ts - ms / 1000 for ts, ms, _ in samples] or [ramp_end])
+        if lcfg.ramp_up_sec:
+            begin = max(begin, ramp_end)
+        samples = [x for x in samples if x[0] >= begin]
+        window = max([ts for ts, _, _ in samples] or [begin]) - begin
+    else:
+        samples = [x for x in samples if ramp_end <= x[0] <= stop_at]
+        window = float(lcfg.duration_sec)
+    ok = [ms for _, ms, good in samples if good]
+    return {"clients": k, "tx": len(samples), "errors": len(samples) - len(ok), "failed_clients": len(client_errors),
+            "window_sec": round(window, 3), "tps": round(len(ok) / window, 2) if window > 0 else None,
+            "latency_ms": describe(ok)}
+
+def run_load_server(s: ServerCfg, rcfg: RunnerCfg, barrier: Optional[RoundBarrier] = None,
+                    lcfg: Optional[LoadCfg] = None) -> Dict:
+    sftp = None
+    try:
+        workload = lcfg.workload or [(s.sql_file_path, 1)]
+        txs, weights = [], []
+        for path_, weight in workload:
+            stmts = split_statements(Path(path_).expanduser().read_text(encoding="utf-8"))
+            txs.append("".join(st + "\n" for st in stmts))
+            weights.append(weight)
+        max_k = max(lcfg.clients)
+        # 连接池按需开多个 transport（每个承载的通道数受 sshd MaxSessions 限制）
+        ssh = ssh_connect(s.ip, s.ssh_port, s.username, s.password, rcfg.ssh_timeout, rcfg.banner_timeout,
+                          max(rcfg.ssh_channels, max_k + 1))
+        sftp = ssh.open_sftp()
+        run_dir = make_remote_run_dir(s.remote_tmp_dir or rcfg.remote_tmp_dir)
+        try: sftp.mkdir(run_dir)
+        except: pass
+
+        env = psql_env(s)
+        # 压测中单个事务出错不应终止会话
+        cmd = build_psql_cmd(s.psql_command) + " -v ON_ERROR_STOP=0"
+        timeout = rcfg.stmt_timeout_ms // 1000 + 60
+        levels = []
+        for n, k in enumerate(lcfg.clients):
+            if n:
+                time.sleep(lcfg.cooldown_sec)
+            lv = run_load_level(ssh, cmd, env, session_setup(rcfg), txs, weights, k, lcfg, timeout)
+            # 扩展曲线：相对第一个级别的吞吐加速比与并行效率
+            base = levels[0] if levels else lv
+            if base["tps"] and lv["tps"] is not None:
+                lv["speedup"] = round(lv["tps"] / base["tps"], 3)
+                lv["efficiency"] = round(lv["speedup"] / (k / base["clients"]), 3)
+            levels.append(lv)
+            lat = lv["latency_ms"]
+            print(f"[{s.name}] clients={k:<4} tps={lv['tps']} tx={lv['tx']} errors={lv['errors']} "
+                  f"failed_clients={lv['failed_clients']} "
+                  f"p50={lat.get('median')}ms p95={lat.get('p95')}ms p99={lat.get('p99')}ms")
+
+        load = {"server": s.name, "ip": s.ip, "pg_port": s.pg_port, "psql_command": s.psql_command,
+                "workload": [{"file": f, "weight": w} for f, w in workload],
+                "duration_sec": lcfg.duration_sec, "transactions": lcfg.transactions,
+                "ramp_up_sec": lcfg.ramp_up_sec, "levels": levels}
+        with sftp.file(f"{run_dir}/load.json", "w") as fh:
+            fh.write(json.dumps(load, ensure_ascii=False, indent=2))
+        if rcfg.save_local:
+            ts = datetime.now().strftime("%Y%m%d-%H%M%S")
+            ldir = Path(f"./runs/{ts}/{s.name}")
+            ldir.mkdir(parents=True, exist_ok=True)
+            (ldir/"load.json").write_text(json.dumps(load, ensure_ascii=False, indent=2), encoding="utf-8")
+
+        return {"server": s.name, "remote_dir": run_dir,
+                "curve": [{"clients": lv["clients"], "tps": lv["tps"], "p95_ms": lv["latency_ms"].get("p95")}
+                          for lv in levels]}
+
+    except Exception as e:
+        return {"server": s.name, "error": str(e)}
+    finally:
+        try:
+            if sftp: sftp.close()
+        except Exception:
+            pass
+
+def run_group(members: List[ServerCfg], rcfg: RunnerCfg, barrier: Optional[RoundBarrier],
+              runner=run_server) -> Dict[str, Dict]:
+    # 同组服务器依次执行
+    out = {}
+    for s in members:
         print(f"[{s.name}] connecting {s.ip}:{s.ssh_port} sql={s.sql_file_path}")
-        res = run_server(s, rcfg)
-        all_res.append(res)
+        res = runner(s, rcfg, barrier)
         if "error" in res:
             print(f"[{s.name}] ERROR: {res['error']}")
         else:
             print(f"[{s.name}] OK -> {res['remote_dir']}")
+        out[s.name] = res
+    return out
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) != 4:
+            raise SystemExit("用法：python excute_sql_safe.py compare <目录A> <目录B>")
+        sys.exit(1 if compare_runs(sys.argv[2], sys.argv[3]) else 0)
+
+    conf = choose_conf_file()
+    print(f"[runner] use config: {conf}")
+    rcfg, servers = read_conf(conf)
+    runner = run_server
+    if len(sys.argv) > 1 and sys.argv[1] == "load":
+        runner = partial(run_load_server, lcfg=read_load_conf(conf))
+    elif len(sys.argv) > 1:
+        raise SystemExit(f"未知子命令: {sys.argv[1]}（支持 compare / load）")
+
+    # 按库分组：组内串行，组间按 concurrency 并行
+    groups: Dict[str, List[ServerCfg]] = {}
+    for s in servers:
+        groups.setdefault(server_group(s), []).append(s)
+    workers = min(rcfg.concurrency, len(groups))
+    print(f"[runner] {len(servers)} servers in {len(groups)} groups, concurrency={workers}"
+          f"{', round_barrier' if rcfg.round_barrier else ''}")
+    barrier = RoundBarrier() if rcfg.round_barrier and runner is run_server else None
+
+    done: Dict[str, Dict] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_group, members, rcfg, barrier, runner): key for key, members in groups.items()}
+        for fut in as_completed(futures):
+            done.update(fut.result())
+
+    # 汇总结果保持配置文件中的服务器顺序
+    all_res = [done[s.name] for s in servers]
     print(json.dumps(all_res, ensure_ascii=False, indent=2))
+    ssh_pool.print_report()
+    ssh_pool.close_all()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,272 @@
+import re
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+import stream_capture
+
+#SQL 运行期间的服务器指标采样
+#在各自的 SSH 通道上常驻两个远端进程，每 interval 秒输出一次：
+#- 一个 shell 循环读取 /proc/stat、/proc/meminfo、/proc/diskstats；
+#- 一个 psql 会话用 \watch 查询 pg_stat_database、pg_stat_bgwriter（及 pg_stat_checkpointer / pg_stat_io / pg_stat_statements，若存在）与 autovacuum 进程数。
+#本地把相邻两次采样做差得到速率（CPU 占比、磁盘 MB/s、每秒块读写等），时间戳换算到本地时钟，
+#再按轮次/语句的起止时间聚合，用于解释某一轮为什么变慢。
+
+PROC_MARK = "__PROC__"
+PROC_END = "__PROC_END__"
+PG_MARK = "__PG__"
+# 整盘设备以外的分区不计入磁盘汇总
+PARTITION_RE = re.compile(r"^((sd|vd|xvd|hd)[a-z]+\d+|nvme\d+n\d+p\d+|mmcblk\d+p\d+)$")
+SKIP_DISK_RE = re.compile(r"^(loop|ram|zram|sr)\d*")
+DB_FIELDS = ("xact_commit", "xact_rollback", "blks_read", "blks_hit", "tup_returned", "tup_fetched",
+             "tup_inserted", "tup_updated", "tup_deleted", "temp_files", "temp_bytes", "deadlocks")
+# 聚合时取最大值的瞬时量；bgw_/ckpt_ 前缀为计数差值，取和；其余（速率、占比）取平均
+GAUGE_KEYS = ("autovacuum_workers", "active_backends", "mem_available_mb", "dirty_mb", "cached_mb")
+
+
+def pg_sample_sql(has_io: bool, has_checkpointer: bool, has_pgss: bool, pgss_top: int) -> str:
+    db = ", ".join(f"'{f}', {f}" for f in DB_FIELDS)
+    parts = [
+        "'ts', extract(epoch from clock_timestamp())",
+        f"'db', (SELECT json_build_object({db}) FROM pg_stat_database WHERE datname = current_database())",
+        "'bgwriter', (SELECT row_to_json(b) FROM pg_stat_bgwriter b)",
+        "'autovacuum', (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'autovacuum worker')",
+        "'active', (SELECT count(*) FROM pg_stat_activity WHERE state = 'active' AND pid <> pg_backend_pid())",
+    ]
+    if has_checkpointer:
+        parts.append("'checkpointer', (SELECT row_to_json(c) FROM pg_stat_checkpointer c)")
+    if has_io:
+        parts.append("'io', (SELECT json_build_object('reads', sum(reads), 'writes', sum(writes), "
+                     "'extends', sum(extends), 'fsyncs', sum(fsyncs)) FROM pg_stat_io)")
+    if has_pgss:
+        # 取累计耗时最高的若干条，本地按 queryid 做差得到采样区间内的耗时
+        parts.append("'pgss', (SELECT json_build_object('calls', sum(calls), 'exec_ms', sum(total_exec_time), "
+                     "'top', (SELECT json_agg(t) FROM (SELECT queryid, calls, total_exec_time AS exec_ms, "
+                     f"left(query, 80) AS query FROM pg_stat_statements ORDER BY total_exec_time DESC "
+                     f"LIMIT {pgss_top * 4}) t)) FROM pg_stat_statements)")
+    return f"SELECT '{PG_MARK}|' || json_build_object({', '.join(parts)})"
+
+
+def _delta(cur: dict, prev: dict) -> Dict[str, float]:
+    out = {}
+    for k, v in (cur or {}).items():
+        p = (prev or {}).get(k)
+        if isinstance(v, (int, float)) and isinstance(p, (int, float)):
+            out[k] = v - p
+    return out
+
+
+def parse_proc(lines: List[str]) -> dict:
+    """把一次 /proc 输出解析为原始计数"""
+    raw = {"cpu": [], "mem": {}, "disks": {}}
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == "cpu":
+            raw["cpu"] = [int(x) for x in parts[1:9]]
+        elif parts[0].endswith(":"):
+            raw["mem"][parts[0][:-1]] = int(parts[1])
+        elif len(parts) >= 14 and parts[0].isdigit():
+            name = parts[2]
+            if SKIP_DISK_RE.match(name) or PARTITION_RE.match(name):
+                continue
+            raw["disks"][name] = {"rd_ios": int(parts[3]), "rd_sec": int(parts[5]),
+                                  "wr_ios": int(parts[7]), "wr_sec": int(parts[9]), "io_ticks": int(parts[12])}
+    return raw
+
+
+def proc_rates(cur: dict, prev: dict, dt: float) -> dict:
+    out = {}
+    if cur["cpu"] and prev["cpu"]:
+        d = [a - b for a, b in zip(cur["cpu"], prev["cpu"])]
+        total = sum(d) or 1
+        user, nice, system, idle, iowait, irq, softirq, steal = d + [0] * (8 - len(d))
+        out.update(cpu_user_pct=round((user + nice) / total * 100, 2),
+                   cpu_system_pct=round((system + irq + softirq) / total * 100, 2),
+                   cpu_iowait_pct=round(iowait / total * 100, 2),
+                   cpu_steal_pct=round(steal / total * 100, 2),
+                   cpu_idle_pct=round(idle / total * 100, 2))
+    mem = cur["mem"]
+    if mem:
+        out.update(mem_available_mb=round(mem.get("MemAvailable", 0) / 1024, 1),
+                   dirty_mb=round(mem.get("Dirty", 0) / 1024, 1),
+                   cached_mb=round(mem.get("Cached", 0) / 1024, 1))
+    rd = wr = ios = 0
+    util = 0.0
+    for name, dc in cur["disks"].items():
+        dp = prev["disks"].get(name)
+        if not dp:
+            continue
+        rd += dc["rd_sec"] - dp["rd_sec"]
+        wr += dc["wr_sec"] - dp["wr_sec"]
+        ios += (dc["rd_ios"] - dp["rd_ios"]) + (dc["wr_ios"] - dp["wr_ios"])
+        util = max(util, (dc["io_ticks"] - dp["io_ticks"]) / (dt * 1000) * 100)
+    out.update(disk_read_mb_s=round(rd * 512 / 1048576 / dt, 2), disk_write_mb_s=round(wr * 512 / 1048576 / dt, 2),
+               disk_iops=round(ios / dt, 1), disk_util_pct=round(min(util, 100.0), 1))
+    return out
+
+
+def pg_rates(cur: dict, prev: dict, dt: float, pgss_top: int) -> dict:
+    out = {f"pg_{k}_s": round(v / dt, 2) for k, v in _delta(cur.get("db"), prev.get("db")).items()}
+    out.update({f"bgw_{k}": v for k, v in _delta(cur.get("bgwriter"), prev.get("bgwriter")).items()})
+    out.update({f"ckpt_{k}": v for k, v in _delta(cur.get("checkpointer"), prev.get("checkpointer")).items()})
+    out.update({f"io_{k}_s": round(v / dt, 2) for k, v in _delta(cur.get("io"), prev.get("io")).items()})
+    pgss, pgss_prev = cur.get("pgss") or {}, prev.get("pgss") or {}
+    if pgss and pgss_prev:
+        out["pgss_calls_s"] = round(((pgss.get("calls") or 0) - (pgss_prev.get("calls") or 0)) / dt, 2)
+        out["pgss_exec_ms_s"] = round(((pgss.get("exec_ms") or 0) - (pgss_prev.get("exec_ms") or 0)) / dt, 2)
+        before = {q["queryid"]: q for q in pgss_prev.get("top") or []}
+        top = []
+        for q in pgss.get("top") or []:
+            p = before.get(q["queryid"])
+            if p and q["exec_ms"] > p["exec_ms"]:
+                top.append({"queryid": q["queryid"], "calls": q["calls"] - p["calls"],
+                            "exec_ms": round(q["exec_ms"] - p["exec_ms"], 3), "query": q["query"]})
+        out["pgss_top"] = sorted(top, key=lambda q: q["exec_ms"], reverse=True)[:pgss_top]
+    out["autovacuum_workers"] = cur.get("autovacuum", 0)
+    out["active_backends"] = cur.get("active", 0)
+    return out
+
+
+class MetricsSampler:
+    """
+    ssh 为 ssh_pool.SSHPool；psql_cmd 为带固定参数的 psql 命令（同 build_psql_cmd）。
+    start() 后在后台采样，stop() 结束并返回全部采样；window(t0, t1) 按本地时间区间聚合。
+    数据库重启后需调用 restart_pg() 重新建立 \\watch 会话（/proc 采样不受影响）。
+    """
+
+    def __init__(self, ssh, psql_cmd: str, env: Optional[Dict[str, str]], interval: float, pgss_top: int = 5):
+        self.ssh = ssh
+        self.psql_cmd = psql_cmd
+        self.env = env
+        self.interval = interval
+        self.pgss_top = pgss_top
+        self.samples: List[dict] = []
+        self._lock = threading.Lock()
+        self._channels = []
+        self._threads = []
+        self._pg_query: Optional[str] = None
+        self._pg_channel = None
+        # 本地时间 - 服务器时间 的最小观测值（包含最小网络延迟），用于把采样时刻换算到本地时钟
+        self._skew: Optional[float] = None
+
+    def _observe(self, server_ts: float):
+        skew = time.time() - server_ts
+        with self._lock:
+            self._skew = skew if self._skew is None else min(self._skew, skew)
+
+    def _add(self, source: str, server_ts: float, dt: float, metrics: dict):
+        with self._lock:
+            self.samples.append({"source": source, "server_ts": server_ts, "dt": round(dt, 3), **metrics})
+
+    def _spawn(self, cmd: str, stdin_text: Optional[str], on_line):
+        """启动远端命令并在后台线程中逐行回调 on_line，返回其通道"""
+        stdin, stdout, stderr = self.ssh.exec_command(cmd, environment=self.env)
+        self._channels.append(stdout.channel)
+        if stdin_text:
+            stdin.write(stdin_text)
+            stdin.flush()
+        t = threading.Thread(target=stream_capture.pump, daemon=True, args=(
+            stdout.channel, stream_capture.LineSink(on_line), stream_capture.CappedBuffer(64 * 1024)))
+        t.start()
+        self._threads.append(t)
+        return stdout.channel
+
+    def _capabilities(self) -> tuple:
+        sql = ("SELECT to_regclass('pg_stat_io') IS NOT NULL, to_regclass('pg_stat_checkpointer') IS NOT NULL, "
+               "to_regclass('pg_stat_statements') IS NOT NULL")
+        stdin, stdout, stderr = self.ssh.exec_command(f'{self.psql_cmd} -c "{sql}"', environment=self.env)
+        out = stream_capture.CappedBuffer(4096)
+        stream_capture.pump(stdout.channel, out, stream_capture.CappedBuffer(4096))
+        flags = out.text().strip().split("|")
+        return tuple(f == "t" for f in flags) if len(flags) == 3 else (False, False, False)
+
+    def start(self):
+        has_io, has_ckpt, has_pgss = self._capabilities()
+
+        # /proc 采样：每块以 __PROC__|服务器时间 开头，以 __PROC_END__ 结尾
+        proc_state = {"lines": None, "ts": 0.0, "prev": None}
+
+        def on_proc(line: str):
+            if line.startswith(PROC_MARK + "|"):
+                proc_state["ts"] = float(line.split("|")[1])
+                proc_state["lines"] = []
+                self._observe(proc_state["ts"])
+            elif line == PROC_END and proc_state["lines"] is not None:
+                raw = parse_proc(proc_state["lines"])
+                prev = proc_state["prev"]
+                if prev:
+                    dt = proc_state["ts"] - prev[0]
+                    if dt > 0:
+                        self._add("proc", proc_state["ts"], dt, proc_rates(raw, prev[1], dt))
+                proc_state["prev"] = (proc_state["ts"], raw)
+                proc_state["lines"] = None
+            elif proc_state["lines"] is not None:
+                proc_state["lines"].append(line)
+
+        self._spawn(
+            f"while :; do echo \"{PROC_MARK}|$(date +%s.%N)\"; head -1 /proc/stat; "
+            f"grep -E '^(MemAvailable|Dirty|Cached):' /proc/meminfo; cat /proc/diskstats; "
+            f"echo {PROC_END}; sleep {self.interval}; done",
+            None, on_proc)
+
+        self._pg_query = pg_sample_sql(has_io, has_ckpt, has_pgss, self.pgss_top)
+        self._start_pg()
+
+    def _start_pg(self):
+        # 每个会话各自求差值，重启前后的计数器不相减
+        pg_state = {"prev": None}
+
+        def on_pg(line: str):
+            if not line.startswith(PG_MARK + "|"):
+                return
+            cur = json.loads(line[len(PG_MARK) + 1:])
+            self._observe(cur["ts"])
+            prev = pg_state["prev"]
+            if prev and cur["ts"] > prev["ts"]:
+                dt = cur["ts"] - prev["ts"]
+                self._add("pg", cur["ts"], dt, pg_rates(cur, prev, dt, self.pgss_top))
+            pg_state["prev"] = cur
+
+        self._pg_channel = self._spawn(self.psql_cmd, f"{self._pg_query} \\watch {self.interval}\n", on_pg)
+
+    def restart_pg(self):
+        """数据库重启会断开 psql \\watch 会话，关闭旧通道后重新建立"""
+        if self._pg_channel is None:
+            return
+        self._pg_channel.close()
+        self._start_pg()
+
+    def stop(self) -> List[dict]:
+        # 关闭通道后远端循环因写管道失败而退出
+        for ch in self._channels:
+            ch.close()
+        for t in self._threads:
+            t.join(timeout=5)
+        with self._lock:
+            skew = self._skew or 0.0
+            for s in self.samples:
+                s["ts"] = round(s["server_ts"] + skew, 3)
+            return list(self.samples)
+
+    def window(self, t0: float, t1: float) -> Optional[dict]:
+        """聚合与本地时间区间 [t0, t1] 有重叠的采样（每个采样覆盖 (ts - dt, ts]）"""
+        hit = [s for s in self.samples if "ts" in s and s["ts"] > t0 and s["ts"] - s["dt"] < t1]
+        if not hit:
+            return None
+        agg: Dict[str, list] = {}
+        for s in hit:
+            for k, v in s.items():
+                if k in ("source", "server_ts", "ts", "dt") or not isinstance(v, (int, float)):
+                    continue
+                agg.setdefault(k, []).append(v)
+        out = {"samples": len(hit)}
+        for k, vals in agg.items():
+            if k.startswith(("bgw_", "ckpt_")):
+                out[k] = sum(vals)
+            elif k in GAUGE_KEYS:
+                out[k] = max(vals)
+            else:
+                out[k] = round(sum(vals) / len(vals), 2)
+        return out
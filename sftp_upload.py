@@ -0,0 +1,137 @@
+import time
+import uuid
+import shlex
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+#CSV2DB 与 excute_sql 共用的 SFTP 上传
+#- 大窗口 + 流水线写（set_pipelined）：不必等每个写请求的确认，高延迟链路上也能跑满带宽；
+#- 大文件按字节区间切成多段，各段在独立的 SFTP 通道上并发写入同一个临时文件；
+#- 上传前用远端 sha256sum 与本地摘要比对，一致则跳过（同一数据集分发到多台主机、多次运行时只传一次）；
+#- 上传后在远端校验摘要，一致才原子改名为目标文件，中途失败不会留下不完整的目标文件。
+#ssh 为 ssh_pool.SSHPool（各段通道计入该主机的通道上限）。
+
+MB = 1024 * 1024
+# 单次从本地读取并写入的块大小
+WRITE_BLOCK = 1 * MB
+# SFTP 通道的 SSH 窗口大小（paramiko 默认约 2MB）
+SFTP_WINDOW = 64 * MB
+DEFAULT_PARTS = 4
+# 每段至少这么大才值得再切分
+DEFAULT_MIN_PART_MB = 64
+# 本地摘要算法与远端对应命令
+HASH_CMDS = {"sha256": "sha256sum", "sha1": "sha1sum", "md5": "md5sum"}
+
+# 同一文件会被上传到多台主机，本地摘要按 (路径, 大小, 修改时间) 缓存，只算一次
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def local_digest(path: Path, algo: str = "sha256") -> str:
+    st = path.stat()
+    key = (str(path.resolve()), st.st_size, st.st_mtime_ns, algo)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    h = hashlib.new(algo)
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(8 * MB), b""):
+            h.update(buf)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digest_cache[key] = digest
+    return digest
+
+
+def remote_digest(ssh, remote_path: str, algo: str = "sha256") -> Optional[str]:
+    """远端文件摘要；文件不存在或命令失败时返回 None"""
+    stdin, stdout, stderr = ssh.exec_command(f"{HASH_CMDS[algo]} {shlex.quote(remote_path)} 2>/dev/null")
+    out = stdout.read().decode(errors="ignore")
+    if stdout.channel.recv_exit_status() != 0 or not out.strip():
+        return None
+    return out.split()[0].lower()
+
+
+def _write_range(ssh, local_path: Path, remote_path: str, offset: int, length: int):
+    # 每段独占一个 SFTP 通道，定位到 offset 后流水线写入 length 字节
+    sftp = ssh.open_sftp(window_size=SFTP_WINDOW)
+    try:
+        with open(local_path, "rb") as f, sftp.open(remote_path, "r+b") as rf:
+            rf.set_pipelined(True)
+            f.seek(offset)
+            rf.seek(offset)
+            remaining = length
+            while remaining:
+                buf = f.read(min(WRITE_BLOCK, remaining))
+                if not buf:
+                    raise IOError(f"本地文件在上传过程中被截断: {local_path}")
+                rf.write(buf)
+                remaining -= len(buf)
+    finally:
+        sftp.close()
+
+
+def upload(ssh, local_path, remote_path: str, parts: int = DEFAULT_PARTS,
+           min_part_mb: int = DEFAULT_MIN_PART_MB, algo: str = "sha256",
+           verify: bool = True, skip_same: bool = True) -> dict:
+    """
+    上传 local_path 到 remote_path，返回 {skipped, bytes, parts, sec, mb_s, digest}。
+    skip_same：远端已有摘要相同的文件时直接返回；verify：上传后校验远端摘要，不一致抛出 IOError。
+    """
+    local_path = Path(local_path)
+    size = local_path.stat().st_size
+    t0 = time.time()
+    digest = local_digest(local_path, algo) if (verify or skip_same) else None
+    if skip_same and remote_digest(ssh, remote_path, algo) == digest:
+        return {"skipped": True, "bytes": 0, "parts": 0, "sec": round(time.time() - t0, 3),
+                "mb_s": 0.0, "digest": digest}
+
+    n = max(1, min(parts, size // (min_part_mb * MB)))
+    tmp_path = f"{remote_path}.part-{uuid.uuid4().hex[:8]}"
+    # 先建好临时文件（并行时预设长度），随即归还通道，避免持有通道等待各段通道造成死锁
+    sftp = ssh.open_sftp()
+    try:
+        with sftp.open(tmp_path, "wb"):
+            pass
+        if n > 1:
+            sftp.truncate(tmp_path, size)
+    finally:
+        sftp.close()
+
+    try:
+        bounds = [size * i // n for i in range(n + 1)]
+        if n == 1:
+            _write_range(ssh, local_path, tmp_path, 0, size)
+        else:
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                futures = [pool.submit(_write_range, ssh, local_path, tmp_path, bounds[i], bounds[i + 1] - bounds[i])
+                           for i in range(n)]
+                for fut in futures:
+                    fut.result()
+        if verify:
+            got = remote_digest(ssh, tmp_path, algo)
+            if got != digest:
+                raise IOError(f"上传校验失败 {remote_path}: 本地 {digest}, 远端 {got}")
+        sftp = ssh.open_sftp()
+        try:
+            try:
+                sftp.posix_rename(tmp_path, remote_path)
+            except IOError:
+                # 服务端不支持 posix-rename 扩展时，先删除旧文件再改名
+                try:
+                    sftp.remove(remote_path)
+                except IOError:
+                    pass
+                sftp.rename(tmp_path, remote_path)
+        finally:
+            sftp.close()
+    except BaseException:
+        ssh.exec_command(f"rm -f {shlex.quote(tmp_path)}")
+        raise
+
+    sec = time.time() - t0
+    return {"skipped": False, "bytes": size, "parts": n, "sec": round(sec, 3),
+            "mb_s": round(size / MB / sec, 1) if sec > 0 else 0.0, "digest": digest}
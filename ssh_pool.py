@@ -0,0 +1,291 @@
+import time
+import threading
+import paramiko
+
+#CSV2DB 与 excute_sql 共用的 SSH 连接池
+#每台主机（ip, port, username）一个 SSHPool：维护若干已认证的 transport，按需在其上开通道，
+#通道总数受 max_channels 限制（超出时等待），单个 transport 上的通道数受 channels_per_transport 限制（sshd 默认 MaxSessions=10）；
+#transport 开启 keepalive，断线后按指数退避重连；首次握手得到的主机密钥会被缓存，之后的连接必须与之一致。
+#SSHPool 提供与 paramiko.SSHClient 相同的 exec_command / open_sftp / invoke_shell，以及与 Transport 相同的 open_channel，
+#调用方可以直接把它当作 ssh 对象使用；通道关闭后自动归还名额，池本身由 close_all() 统一关闭。
+
+DEFAULT_MAX_CHANNELS = 16
+DEFAULT_CHANNELS_PER_TRANSPORT = 8
+DEFAULT_KEEPALIVE = 30
+# 等待空闲通道名额时的轮询间隔（秒）
+WAIT_POLL = 0.05
+# 等待通道名额的上限（秒），超时抛出 TimeoutError，避免名额被长期占用时调用方无声挂起
+DEFAULT_OPEN_TIMEOUT = 600
+
+# 本进程内已见过的主机密钥，重连或新建 transport 时复用
+_host_keys = paramiko.HostKeys()
+_host_keys_lock = threading.Lock()
+
+
+def _host_key_name(ip: str, port: int) -> str:
+    # 与 known_hosts 的写法一致：非 22 端口为 [ip]:port
+    return ip if port == 22 else f"[{ip}]:{port}"
+
+
+class SSHPool:
+    def __init__(self, ip: str, port: int, username: str, password: str,
+                 max_channels: int = DEFAULT_MAX_CHANNELS,
+                 channels_per_transport: int = DEFAULT_CHANNELS_PER_TRANSPORT,
+                 keepalive: int = DEFAULT_KEEPALIVE, timeout: int = 10, banner_timeout: int = 10,
+                 retries: int = 3, backoff: float = 1.0, open_timeout: float = DEFAULT_OPEN_TIMEOUT):
+        self.ip = ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_channels = max_channels
+        self.channels_per_transport = channels_per_transport
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.banner_timeout = banner_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.open_timeout = open_timeout
+        self._cond = threading.Condition()
+        # 每个元素为 [SSHClient（握手中为 None）, 该 transport 上尚未关闭的通道列表, 正在其上开通道的请求数]
+        self._clients = []
+        # 已占名额但通道尚未打开的请求数
+        self._reserved = 0
+        self._closed = False
+        self.handshakes = 0
+        self.reconnects = 0
+        self.channels_opened = 0
+        self.channels_peak = 0
+        self.wait_sec = 0.0
+
+    # ——————— 连接 ———————
+    def _connect(self) -> paramiko.SSHClient:
+        """新建一个已认证的 SSHClient；网络类错误按指数退避重试，认证失败与主机密钥不一致直接抛出"""
+        name = _host_key_name(self.ip, self.port)
+        for attempt in range(1, self.retries + 1):
+            client = paramiko.SSHClient()
+            with _host_keys_lock:
+                known = _host_keys.lookup(name)
+            if known:
+                for key_type, key in known.items():
+                    client.get_host_keys().add(name, key_type, key)
+                client.set_missing_host_key_policy(paramiko.RejectPolicy())
+            else:
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(self.ip, port=self.port, username=self.username, password=self.password or None,
+                               timeout=self.timeout, banner_timeout=self.banner_timeout)
+            except (paramiko.AuthenticationException, paramiko.BadHostKeyException):
+                client.close()
+                raise
+            except (paramiko.SSHException, OSError) as e:
+                client.close()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1)
+                print(f"[ssh_pool] 连接 {self.ip}:{self.port} 失败({e})，{delay:.1f}s 后重试")
+                time.sleep(delay)
+                continue
+            transport = client.get_transport()
+            transport.set_keepalive(self.keepalive)
+            key = transport.get_remote_server_key()
+            with _host_keys_lock:
+                _host_keys.add(name, key.get_name(), key)
+            with self._cond:
+                self.handshakes += 1
+            return client
+
+    def _prune(self):
+        # 去掉已关闭的通道与失效的 transport（失效的计为一次重连，下次取用时重新握手）；正在握手的保留
+        alive = []
+        for entry in self._clients:
+            client, chans, _ = entry
+            chans[:] = [c for c in chans if not c.closed]
+            if client is None or (client.get_transport() is not None and client.get_transport().is_active()):
+                alive.append(entry)
+            else:
+                self.reconnects += 1
+                client.close()
+        self._clients = alive
+
+    def _in_use(self) -> int:
+        # 已打开的通道 + 已占名额但还在握手/开通道的请求
+        return sum(len(chans) for _, chans, _ in self._clients) + self._reserved
+
+    def _listed(self, entry) -> bool:
+        return any(e is entry for e in self._clients)
+
+    def _pick(self) -> tuple:
+        """在锁内为一次开通道选定 transport 并占住其上的一个位置；没有空位时登记一个待握手的 transport"""
+        with self._cond:
+            self._prune()
+            slots = [e for e in self._clients if len(e[1]) + e[2] < self.channels_per_transport]
+            if slots:
+                entry, fresh = min(slots, key=lambda e: len(e[1]) + e[2]), False
+            else:
+                entry, fresh = [None, [], 0], True
+                self._clients.append(entry)
+            entry[2] += 1
+            return entry, fresh
+
+    def _ready(self, entry, fresh: bool) -> paramiko.SSHClient:
+        """返回 entry 上已认证的 SSHClient：新登记的在锁外握手，其他选中它的调用方等待握手完成"""
+        if fresh:
+            try:
+                client = self._connect()
+            except BaseException:
+                with self._cond:
+                    self._clients = [e for e in self._clients if e is not entry]
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                if self._closed or not self._listed(entry):
+                    client.close()
+                    raise RuntimeError(f"SSH 连接池已关闭: {self.ip}:{self.port}")
+                entry[0] = client
+                self._cond.notify_all()
+            return client
+        with self._cond:
+            while entry[0] is None and self._listed(entry):
+                self._cond.wait(WAIT_POLL)
+            if entry[0] is None:
+                raise ConnectionError(f"连接 {self.ip}:{self.port} 的握手失败")
+            return entry[0]
+
+    def _open(self, opener):
+        """
+        等待通道名额，在负载最低的 transport 上用 opener(transport) 打开通道；transport 失效时重连重试。
+        名额在锁内占住，握手（含退避等待）与开通道的往返都在锁外进行，不阻塞其他线程取用或归还名额。
+        等待超过 open_timeout 秒仍无名额时抛出 TimeoutError。
+        """
+        t0 = time.time()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"SSH 连接池已关闭: {self.ip}:{self.port}")
+            while True:
+                self._prune()
+                if self._in_use() < self.max_channels:
+                    break
+                if self.open_timeout and time.time() - t0 > self.open_timeout:
+                    self.wait_sec += time.time() - t0
+                    raise TimeoutError(f"等待 {self.ip}:{self.port} 的 SSH 通道名额超过 {self.open_timeout}s"
+                                       f"（上限 {self.max_channels}，使用中 {self._in_use()}），请检查是否有通道未关闭")
+                self._cond.wait(WAIT_POLL)
+            self.wait_sec += time.time() - t0
+            self._reserved += 1
+        reserved = True
+        try:
+            for attempt in range(1, self.retries + 1):
+                entry, fresh = self._pick()
+                client = None
+                try:
+                    client = self._ready(entry, fresh)
+                    chan = opener(client.get_transport())
+                except BaseException as e:
+                    # 开通道时 transport 已断开：丢弃后重新握手；握手本身失败（_connect 已重试过）直接抛出
+                    retry = client is not None and isinstance(e, (paramiko.SSHException, EOFError, OSError))
+                    with self._cond:
+                        entry[2] -= 1
+                        if retry:
+                            entry[0].close()
+                            self._prune()
+                            self._cond.notify_all()
+                    if not retry or attempt == self.retries:
+                        raise
+                    continue
+                with self._cond:
+                    entry[2] -= 1
+                    entry[1].append(chan)
+                    self._reserved -= 1
+                    reserved = False
+                    self.channels_opened += 1
+                    self.channels_peak = max(self.channels_peak, self._in_use())
+                    return chan
+        finally:
+            if reserved:
+                with self._cond:
+                    self._reserved -= 1
+                    self._cond.notify_all()
+
+    # ——————— 与 SSHClient / Transport 兼容的接口 ———————
+    def exec_command(self, command: str, bufsize: int = -1, timeout=None, get_pty: bool = False, environment=None):
+        chan = self._open(lambda t: t.open_session(timeout=timeout))
+        if get_pty:
+            chan.get_pty()
+        chan.settimeout(timeout)
+        if environment:
+            chan.update_environment(environment)
+        chan.exec_command(command)
+        stdin = chan.makefile_stdin("wb", bufsize)
+        stdout = chan.makefile("r", bufsize)
+        stderr = chan.makefile_stderr("r", bufsize)
+        return stdin, stdout, stderr
+
+    def invoke_shell(self, term: str = "vt100", width: int = 80, height: int = 24):
+        chan = self._open(lambda t: t.open_session())
+        chan.get_pty(term, width, height)
+        chan.invoke_shell()
+        return chan
+
+    def open_sftp(self, window_size=None, max_packet_size=None) -> paramiko.SFTPClient:
+        # window_size 调大可减少高延迟链路上等待窗口调整的停顿（见 sftp_upload）
+        chan = self._open(lambda t: t.open_session(window_size=window_size, max_packet_size=max_packet_size))
+        chan.invoke_subsystem("sftp")
+        return paramiko.SFTPClient(chan)
+
+    def open_channel(self, kind: str, dest_addr=None, src_addr=None, timeout=None):
+        # 供端口转发（direct-tcpip）使用，签名与 Transport.open_channel 相同
+        return self._open(lambda t: t.open_channel(kind, dest_addr, src_addr, timeout=timeout))
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._prune()
+            return {"host": f"{self.ip}:{self.port}", "user": self.username, "handshakes": self.handshakes,
+                    "reconnects": self.reconnects, "transports": len(self._clients),
+                    "channels_opened": self.channels_opened, "channels_in_use": self._in_use(),
+                    "channels_peak": self.channels_peak, "channel_wait_sec": round(self.wait_sec, 3)}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for client, _, _ in self._clients:
+                if client is not None:
+                    client.close()
+            self._clients = []
+            self._cond.notify_all()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(ip: str, port: int, username: str, password: str, max_channels: int = DEFAULT_MAX_CHANNELS,
+             **kwargs) -> SSHPool:
+    """按 (ip, port, username) 取共享连接池；已存在时只会按需调高 max_channels"""
+    key = (ip, port, username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = _pools[key] = SSHPool(ip, port, username, password, max_channels=max_channels, **kwargs)
+        else:
+            pool.max_channels = max(pool.max_channels, max_channels)
+        return pool
+
+
+def report() -> list:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [p.stats() for p in pools]
+
+
+def print_report():
+    for st in report():
+        print(f"[ssh_pool] {st['user']}@{st['host']}: 握手 {st['handshakes']} 次, 重连 {st['reconnects']} 次, "
+              f"通道 {st['channels_opened']} 个(峰值并发 {st['channels_peak']}), 等待 {st['channel_wait_sec']}s")
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for p in pools:
+        p.close()
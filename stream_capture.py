@@ -0,0 +1,153 @@
+import gzip
+import time
+import select
+import socket
+import hashlib
+from pathlib import Path
+
+#CSV2DB 与 excute_sql 共用的远端命令输出捕获
+#pump() 在同一个循环里交替读取通道的 stdout 与 stderr，任一方输出很多都不会把通道写满而卡住对方；
+#读到的数据按块交给 sink，内存中只保留有上限的一份（CappedBuffer），其余可直接写入本地文件（可 gzip）
+#或只统计行数与摘要（HashSink），查询返回大量行时客户端内存不再随之增长。
+#sink 只需提供 write(bytes)，可选 close()。
+
+CHUNK_SIZE = 256 * 1024
+# 默认在内存中保留的输出上限（字节）
+DEFAULT_CAP = 16 * 1024 * 1024
+# 通道暂无数据时的等待间隔（秒）
+POLL_INTERVAL = 0.05
+
+
+class CappedBuffer:
+    """只保留前 cap 字节，其余只计数；text() 在截断时附加说明"""
+
+    def __init__(self, cap: int = DEFAULT_CAP):
+        self.cap = cap
+        self.buf = bytearray()
+        self.total = 0
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        room = self.cap - len(self.buf)
+        if room > 0:
+            self.buf += data[:room]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.buf)
+
+    def text(self) -> str:
+        out = self.buf.decode(errors="ignore")
+        if self.truncated:
+            out += f"\n...[输出共 {self.total} 字节，仅保留前 {len(self.buf)} 字节]"
+        return out
+
+
+class FileSink:
+    """写入本地文件；compress 为 True 时写成 .gz"""
+
+    def __init__(self, path, compress: bool = False):
+        self.path = Path(str(path) + ".gz" if compress and not str(path).endswith(".gz") else path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = gzip.open(self.path, "wb", compresslevel=3) if compress else open(self.path, "wb")
+        self.bytes = 0
+
+    def write(self, data: bytes):
+        self.bytes += len(data)
+        self.f.write(data)
+
+    def close(self):
+        self.f.close()
+
+    def summary(self) -> dict:
+        return {"file": str(self.path), "bytes": self.bytes}
+
+
+class HashSink:
+    """不保存内容，只记录字节数、行数与摘要"""
+
+    def __init__(self, algo: str = "sha256"):
+        self.algo = algo
+        self.h = hashlib.new(algo)
+        self.bytes = 0
+        self.rows = 0
+
+    def write(self, data: bytes):
+        self.bytes += len(data)
+        self.rows += data.count(b"\n")
+        self.h.update(data)
+
+    def summary(self) -> dict:
+        return {"bytes": self.bytes, "rows": self.rows, self.algo: self.h.hexdigest()}
+
+
+class LineSink:
+    """按行回调 callback(str)（不含换行符），跨块的半行会拼接后再回调"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._rest = b""
+
+    def write(self, data: bytes):
+        lines = (self._rest + data).split(b"\n")
+        self._rest = lines.pop()
+        for line in lines:
+            self.callback(line.decode(errors="ignore").rstrip("\r"))
+
+    def close(self):
+        if self._rest:
+            self.callback(self._rest.decode(errors="ignore").rstrip("\r"))
+            self._rest = b""
+
+
+class Tee:
+    def __init__(self, *sinks):
+        self.sinks = [s for s in sinks if s is not None]
+
+    def write(self, data: bytes):
+        for s in self.sinks:
+            s.write(data)
+
+    def close(self):
+        for s in self.sinks:
+            close_sink(s)
+
+
+def close_sink(sink):
+    close = getattr(sink, "close", None)
+    if close:
+        close()
+
+
+def pump(channel, out_sink, err_sink, timeout=None, chunk: int = CHUNK_SIZE) -> int:
+    """
+    同时读取 channel 的 stdout/stderr 直到命令结束，分别写入 out_sink/err_sink，返回退出码。
+    timeout 秒内两路都没有任何输出时抛出 socket.timeout（与 exec_command 的 timeout 语义一致）。
+    """
+    last = time.time()
+    while True:
+        busy = False
+        if channel.recv_ready():
+            data = channel.recv(chunk)
+            if data:
+                out_sink.write(data)
+                busy = True
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(chunk)
+            if data:
+                err_sink.write(data)
+                busy = True
+        if busy:
+            last = time.time()
+            continue
+        # 退出状态在全部输出之后到达；此时两路缓冲都已读空即可结束
+        if channel.exit_status_ready() or channel.closed:
+            if not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            continue
+        if timeout is not None and time.time() - last > timeout:
+            raise socket.timeout(f"命令在 {timeout}s 内没有输出")
+        select.select([channel], [], [], POLL_INTERVAL)
+    for s in (out_sink, err_sink):
+        close_sink(s)
+    return channel.recv_exit_status()